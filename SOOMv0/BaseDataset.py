@@ -47,6 +47,8 @@ class BaseDataset(object):
                         row when printing
         weightcol       default weighting column
         generations     The number of past dataset generations to keep.
+        compress_chunks Compress the temporary chunk files written
+                        while loading data.
         generation      Update generation count
         date_created    When the dataset was first created (mx.DateTime)
         date_updated    When the dataset was last updated
@@ -206,8 +208,8 @@ class BaseDataset(object):
     def __getitem__(self, index_or_slice):
         if isinstance(index_or_slice, basestring):
             try:
-                return self._column_dict[index_or_slice]
-            except KeyError:
+                return self.get_column(index_or_slice)
+            except ColumnNotFound:
                 raise KeyError(index_or_slice)
         if isinstance(index_or_slice, slice):
             from SOOMv0.Filter import sliced_ds
@@ -16,23 +16,329 @@
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/ChunkingLoader.py,v $
 
 import os
+import sys
 import zlib
+import mmap
+import errno
+import array
+import struct
 import cPickle
 import time
+import mx.DateTime
+import Numeric
 from SOOMv0.Soom import soom
+from SOOMv0.common import *
+
+# A chunk record starts with a header giving the encoding, whether the
+# sections are compressed, and the number of values, followed by
+# sections, each prefixed with its (stored) length. Records are held
+# in memory while loading, and a chunk file is one or more records
+# written end to end:
+#
+#   encoding    sections
+#   'i'         C long values, null flags
+#   'f'         C double values, null flags
+#   's'         C long offsets (n+1) into heap, string heap, null flags
+#   'D'         C long absdate, C double abstime, null flags
+#   'p'         pickled list (any other type, or values that don't
+#               fit the column's encoding)
+#
+# Null flags are one byte per value, and are omitted (zero length)
+# if no values are null. Null values are stored as zero.
+chunk_magic = 'SOOMchk1'
+chunk_header = struct.Struct('=8scc6xl')
+chunk_section = struct.Struct('=l')
+
+chunk_encodings = {
+    'int': 'i',
+    'long': 'i',
+    'float': 'f',
+    'str': 's',
+    'date': 'D',
+    'datetime': 'D',
+    'recodedate': 'D',
+}
+
+chunk_sections = {'i': 2, 'f': 2, 's': 3, 'D': 3, 'p': 1}
+
+def _nulls(data):
+    """
+    Returns a list of null flags for data, or None if there are
+    no nulls.
+    """
+    nulls = [v is None for v in data]
+    if True not in nulls:
+        return None
+    return nulls
+
+def _filled(data, nulls, fill):
+    """
+    Returns data with the nulls replaced by fill
+    """
+    if nulls is None:
+        return data
+    data = list(data)
+    for i, null in enumerate(nulls):
+        if null:
+            data[i] = fill
+    return data
+
+def _encode_chunk(encoding, data):
+    """
+    Returns the list of sections for data in the given encoding,
+    raising TypeError, ValueError, AttributeError or OverflowError
+    if the data doesn't fit the encoding.
+    """
+    nulls = _nulls(data)
+    if nulls is None:
+        nullflags = ''
+    else:
+        nullflags = array.array('b', nulls).tostring()
+    if encoding in 'if':
+        filled = _filled(data, nulls, 0)
+        typecode = {'i': 'l', 'f': 'd'}[encoding]
+        return [array.array(typecode, filled).tostring(), nullflags]
+    elif encoding == 's':
+        filled = _filled(data, nulls, '')
+        heap = ''.join(filled)
+        if type(heap) is not str:
+            raise TypeError('non-str value')
+        offsets = Numeric.zeros(len(filled) + 1, Numeric.Int)
+        if filled:
+            offsets[1:] = Numeric.add.accumulate(Numeric.array(map(len, filled),
+                                                               Numeric.Int))
+        return [offsets.tostring(), heap, nullflags]
+    elif encoding == 'D':
+        absdate = array.array('l')
+        abstime = array.array('d')
+        for v in data:
+            if v is None:
+                absdate.append(0)
+                abstime.append(0.0)
+            elif type(v) is not mx.DateTime.DateTimeType:
+                raise TypeError('non-DateTime value')
+            else:
+                absdate.append(v.absdate)
+                abstime.append(v.abstime)
+        return [absdate.tostring(), abstime.tostring(), nullflags]
+    raise ValueError('unknown chunk encoding %r' % encoding)
+
+def _null_indices(nullflags):
+    indices = []
+    i = nullflags.find('\x01')
+    while i >= 0:
+        indices.append(i)
+        i = nullflags.find('\x01', i + 1)
+    return indices
+
+def _decode_chunk(encoding, sections):
+    """
+    Returns the list of values from the sections of a chunk
+    """
+    if encoding == 'p':
+        return cPickle.loads(sections[0])
+    nullflags = sections[-1]
+    if encoding in 'if':
+        values = array.array({'i': 'l', 'f': 'd'}[encoding])
+        values.fromstring(sections[0])
+        values = values.tolist()
+    elif encoding == 's':
+        offsets = array.array('l')
+        offsets.fromstring(sections[0])
+        heap = sections[1]
+        values = [heap[offsets[i]:offsets[i+1]] 
+                  for i in xrange(len(offsets) - 1)]
+    elif encoding == 'D':
+        absdate = array.array('l')
+        absdate.fromstring(sections[0])
+        abstime = array.array('d')
+        abstime.fromstring(sections[1])
+        DateTimeFromAbsDateTime = mx.DateTime.DateTimeFromAbsDateTime
+        values = map(DateTimeFromAbsDateTime, absdate, abstime)
+    else:
+        raise ValueError('unknown chunk encoding %r' % encoding)
+    for i in _null_indices(nullflags):
+        values[i] = None
+    return values
+
+def encode_chunk(encoding, data, compress=False):
+    """
+    Returns a chunk record (header and sections) holding data,
+    falling back to the pickle encoding if the values don't fit
+    the given encoding.
+    """
+    sections = None
+    if encoding != 'p':
+        try:
+            sections = _encode_chunk(encoding, data)
+        except (TypeError, ValueError, AttributeError, OverflowError):
+            pass
+    if sections is None:
+        encoding = 'p'
+        sections = [cPickle.dumps(data, -1)]
+    record = [chunk_header.pack(chunk_magic, encoding, 
+                                compress and 'z' or '-', len(data))]
+    for section in sections:
+        if compress and section:
+            section = zlib.compress(section)
+        record.append(chunk_section.pack(len(section)))
+        record.append(section)
+    return ''.join(record)
+
+def write_chunk(filename, records):
+    """
+    Write a chunk file from a list of chunk records
+    """
+    f = open(filename, 'wb')
+    try:
+        for record in records:
+            f.write(record)
+    finally:
+        f.close()
+
+def parse_chunk(buf, sections=True):
+    """
+    Returns a list of (encoding, count, sections) for the chunk
+    records in buf (a string or mmap). Sections are uncompressed,
+    or None if sections is False.
+    """
+    records = []
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        magic, encoding, compressed, count = \
+            chunk_header.unpack(buf[pos:pos + chunk_header.size])
+        if magic != chunk_magic:
+            raise Error('not a chunk record')
+        pos += chunk_header.size
+        record_sections = []
+        for i in xrange(chunk_sections[encoding]):
+            length, = chunk_section.unpack(buf[pos:pos + chunk_section.size])
+            pos += chunk_section.size
+            if sections:
+                section = buf[pos:pos + length]
+                if compressed == 'z' and section:
+                    section = zlib.decompress(section)
+                record_sections.append(section)
+            pos += length
+        if not sections:
+            record_sections = None
+        records.append((encoding, count, record_sections))
+    return records
+
+def read_chunk(filename, sections=True):
+    """
+    Returns the records of a chunk file (see parse_chunk)
+    """
+    f = open(filename, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        try:
+            return parse_chunk(m, sections)
+        except Error:
+            raise Error('%s: not a chunk file' % filename)
+    finally:
+        m.close()
+
+def decode_chunk(records):
+    """
+    Returns the list of values held by a list of chunk records
+    """
+    values = []
+    for encoding, count, sections in records:
+        values.extend(_decode_chunk(encoding, sections))
+    return values
+
+
+class ChunkedColumnData:
+    """
+    The data of one column of a ChunkingLoader, iterable as a
+    sequence of values. Chunks are removed as they are read.
+    numeric_chunks() allows numeric chunks to be bulk copied.
+    """
+    def __init__(self, loader, col):
+        self.loader = loader
+        self.col = col
+
+    def __iter__(self):
+        for chunkid, rows in self.loader.chunks:
+            for v in self.loader.get_chunk(self.col.name, chunkid):
+                yield v
+
+    def numeric_chunks_ok(self, typecode):
+        """
+        True if every chunk is stored as raw typecode values
+        """
+        encoding = {'l': 'i', 'd': 'f'}.get(typecode)
+        if encoding is None or array.array(typecode).itemsize != \
+                                Numeric.zeros(0, typecode).itemsize():
+            return False
+        for chunkid, rows in self.loader.chunks:
+            records = self.loader.get_records(self.col.name, chunkid, 
+                                              sections=False, remove=False)
+            for record_encoding, count, sections in records:
+                if record_encoding != encoding:
+                    return False
+        return True
+
+    def numeric_chunks(self):
+        """
+        Yields the raw values and null flags of each chunk record
+        (check numeric_chunks_ok() first).
+        """
+        for chunkid, rows in self.loader.chunks:
+            for encoding, count, sections in \
+                    self.loader.get_records(self.col.name, chunkid):
+                yield sections[0], sections[-1]
+
 
 class ChunkingLoader:
     """
     "Rotate" row-wise data to column-wise.
 
-    Do rotation on disk if number of rows is excessive
+    Rows are accumulated in per-column lists, and every chunkrows
+    rows (default compact_rows) are compacted into typed chunk
+    records held in memory. Only if the records exceed the memory
+    budget (soom.load_membudget bytes by default), or the process
+    grows by more than the budget, are they spilled to chunk files
+    on disc, one file per column holding all the records then in
+    memory - so datasets that fit in the budget are rotated without
+    any file I/O, and larger ones are written in the largest chunks
+    the budget allows.
+
+    Chunk records use a typed binary format for int, float, str and
+    date columns, and are only compressed if compress_chunks is
+    True (see the Dataset compress_chunks option).
+
+    If soom.nproc > 1 and the data source can be split (see
+    DataSourceBase.get_ranges()), each part of the source is
+    read and written to chunks by a separate process, and the
+    chunks are then concatenated in source order.
     """
-    compress_chunk = True
+    compact_rows = 10000
 
-    def __init__(self, columns, basepath):
+    def __init__(self, columns, basepath, compress_chunks=False, 
+                 membudget=None):
+        if membudget is None:
+            membudget = soom.load_membudget
         self.basepath = basepath
+        self.compress_chunks = compress_chunks
+        self.membudget = membudget
         self.columns = []
-        self.numchunks = 0
+        self.chunks = []                # (chunk id, rows) in row order
+        self.memrecords = {}            # (colname, chunk id) -> record
+        self.memchunks = 0              # trailing chunks held in memory
+        self.membytes = 0
+        self.colbytes = {}              # colname -> bytes compacted
+        self.mem_baseline = soom.mem_usage()
+        self.chunk_prefix = ''
+        self.chunk_rownum = 0
         self.rownum = 0
         for col in columns:
             if col.name != 'row_ordinal':               # XXX
@@ -42,40 +348,120 @@ class ChunkingLoader:
         return os.path.join(self.basepath, 
                             '%s_chunk_%s.SOOMchunk' % (colname, chunknum))
 
+    def _encode(self, col, data):
+        encoding = chunk_encodings.get(col.datatype.name, 'p')
+        return encode_chunk(encoding, data, self.compress_chunks)
+
+    def _write_chunk(self, col, chunkid, data):
+        write_chunk(self._chunk_filename(col.name, chunkid), 
+                    [self._encode(col, data)])
+
+    def over_budget(self):
+        """
+        True if the chunk records held in memory exceed the budget,
+        or the process has grown by more than the budget since the
+        last spill.
+        """
+        if self.membytes > self.membudget:
+            return True
+        usage = soom.mem_usage()
+        if usage is not None and self.mem_baseline is not None:
+            return usage - self.mem_baseline > self.membudget
+        return False
+
     def flush(self):
-        starttime = time.time()
+        """
+        Compact the rows accumulated since the last flush into
+        chunk records, spilling to disc if over budget.
+        """
+        if self.rownum == self.chunk_rownum:
+            return
+        chunkid = '%s%d' % (self.chunk_prefix, len(self.chunks))
         for col, data in self.columns:
-            fn = self._chunk_filename(col.name, self.numchunks)
-            f = open(fn, 'wb')
-            try:
-                if self.compress_chunk:
-                    f.write(zlib.compress(cPickle.dumps(data, -1)))
-                else:
-                    cPickle.dump(data, f, -1)
-            finally:
-                f.close()
+            record = self._encode(col, data)
+            self.memrecords[(col.name, chunkid)] = record
+            self.membytes += len(record)
+            self.colbytes[col.name] = \
+                self.colbytes.get(col.name, 0) + len(record)
             del data[:]
+        self.chunks.append((chunkid, self.rownum - self.chunk_rownum))
+        self.memchunks += 1
+        self.chunk_rownum = self.rownum
+        if self.over_budget():
+            self.spill()
+
+    def spill(self):
+        """
+        Write the chunk records held in memory to disc, as a single
+        chunk per column.
+        """
+        if not self.memchunks:
+            return
+        starttime = time.time()
+        memchunks = self.chunks[-self.memchunks:]
+        chunkid = memchunks[0][0]
+        rows = 0
+        for memchunkid, chunk_rows in memchunks:
+            rows += chunk_rows
+        for col, data in self.columns:
+            records = [self.memrecords.pop((col.name, memchunkid))
+                       for memchunkid, chunk_rows in memchunks]
+            write_chunk(self._chunk_filename(col.name, chunkid), records)
+        self.chunks[-self.memchunks:] = [(chunkid, rows)]
+        self.memchunks = 0
+        self.membytes = 0
         soom.mem_report()
-        soom.info('chunk flush took %.3f seconds' % (time.time() - starttime))
-        self.numchunks += 1
+        self.mem_baseline = soom.mem_usage()
+        soom.info('chunk spill of %d rows (%.1f bytes per row) took %.3f seconds' % (rows, self.row_bytes(), time.time() - starttime))
 
-    def get_chunk(self, colname, chunknum):
-        filename = self._chunk_filename(colname, chunknum)
-        f = open(filename, 'rb')
-        try:
-            if self.compress_chunk:
-                return cPickle.loads(zlib.decompress(f.read()))
+    def row_bytes(self):
+        """
+        Estimated bytes per row of compacted chunk records
+        """
+        if not self.rownum:
+            return 0.0
+        total = 0
+        for nbytes in self.colbytes.values():
+            total += nbytes
+        return float(total) / self.rownum
+
+    def get_records(self, colname, chunkid, sections=True, remove=True):
+        """
+        Returns the records of a chunk, from memory or disc (see
+        parse_chunk), removing the chunk unless remove is False.
+        """
+        key = colname, chunkid
+        if key in self.memrecords:
+            if remove:
+                record = self.memrecords.pop(key)
             else:
-                return cPickle.load(f)
+                record = self.memrecords[key]
+            return parse_chunk(record, sections)
+        filename = self._chunk_filename(colname, chunkid)
+        try:
+            return read_chunk(filename, sections)
         finally:
-            f.close()
-            os.remove(filename)
+            if remove:
+                os.remove(filename)
+
+    def get_chunk(self, colname, chunkid):
+        return decode_chunk(self.get_records(colname, chunkid))
 
     def loadrows(self, datasource, chunkrows = 0, rowlimit = 0):
+        if soom.nproc > 1:
+            ranges = datasource.get_ranges(soom.nproc)
+            if ranges:
+                return self.loadrows_parallel(datasource, ranges, 
+                                              chunkrows, rowlimit)
+        return self.loadrows_serial(datasource, chunkrows, rowlimit)
+
+    def loadrows_serial(self, datasource, chunkrows = 0, rowlimit = 0):
         source_rownum = 0
         starttime = time.time()
         if not rowlimit:
             rowlimit = -1
+        if not chunkrows:
+            chunkrows = self.compact_rows
         for row in datasource:
             source_rownum += 1
             for col, data in self.columns:
@@ -83,7 +469,7 @@ class ChunkingLoader:
             self.rownum += 1
             if source_rownum == rowlimit:
                 break
-            if chunkrows and source_rownum and source_rownum % chunkrows == 0:
+            if source_rownum % chunkrows == 0:
                 self.flush()
             if source_rownum and source_rownum % 1000 == 0:
                 soom.info('%s (%d total) rows read from source %s (%.1f per sec)' %\
@@ -93,11 +479,114 @@ class ChunkingLoader:
         soom.info('%s rows read from DataSource %s, in %.3f seconds (%d rows total)' % (source_rownum, datasource.name, time.time() - starttime, self.rownum))
         return source_rownum
 
-    def unchunk_columns(self):
-        def _col_generator(self, col):
-            for chunknum in xrange(self.numchunks):
-                for v in self.get_chunk(col.name, chunknum):
-                    yield v
+    def _part_filename(self, partnum):
+        return os.path.join(self.basepath, 'part_%d.SOOMchunkinfo' % partnum)
 
+    def _load_part(self, datasource, partnum, range, chunkrows, rowlimit):
+        """
+        Load one range of the source into chunk files (in a child
+        process)
+        """
+        datasource.open_range(range)
+        self.chunk_prefix = '%dp%d_' % (len(self.chunks), partnum)
+        self.chunks = []
+        self.chunk_rownum = self.rownum = 0
+        # Each process gets an equal share of the budget
+        self.membudget = self.membudget / soom.nproc
+        try:
+            rows = self.loadrows_serial(datasource, chunkrows, rowlimit)
+            self.spill()
+        except:
+            # The parent only knows of the chunks listed in the part file
+            for chunkid, chunk_rows in self.chunks:
+                self._discard_chunk(chunkid)
+            raise
+        f = open(self._part_filename(partnum), 'wb')
+        try:
+            cPickle.dump((self.chunks, rows), f, -1)
+        finally:
+            f.close()
+
+    def loadrows_parallel(self, datasource, ranges, chunkrows, rowlimit):
+        """
+        Fork a process to load each of the source ranges, then add
+        their chunks in source order, truncating at rowlimit.
+        """
+        starttime = time.time()
+        for col, data in self.columns:
+            assert not data
+        # Chunks held in memory must precede the part chunks
+        self.spill()
+        pids = []
+        for partnum, range in enumerate(ranges):
+            pid = os.fork()
+            if not pid:
+                try:
+                    try:
+                        self._load_part(datasource, partnum, range, 
+                                        chunkrows, rowlimit)
+                        os._exit(0)
+                    except:
+                        print >> sys.stderr, 'While loading part %d of %r:' %\
+                            (partnum, datasource.name)
+                        import traceback
+                        traceback.print_exc()
+                finally:
+                    os._exit(1)
+            pids.append(pid)
+        failed = 0
+        for pid in pids:
+            while 1:
+                try:
+                    pid, status = os.waitpid(pid, 0)
+                except OSError, (eno, estr):
+                    if eno == errno.EINTR:
+                        continue
+                    raise
+                break
+            if not os.WIFEXITED(status) or os.WEXITSTATUS(status):
+                failed += 1
+        source_rownum = 0
+        for partnum in xrange(len(ranges)):
+            filename = self._part_filename(partnum)
+            try:
+                f = open(filename, 'rb')
+            except IOError:
+                continue
+            try:
+                chunks, rows = cPickle.load(f)
+            finally:
+                f.close()
+                os.remove(filename)
+            for chunkid, chunk_rows in chunks:
+                if failed or (rowlimit and source_rownum >= rowlimit):
+                    self._discard_chunk(chunkid)
+                    continue
+                if rowlimit and source_rownum + chunk_rows > rowlimit:
+                    chunk_rows = rowlimit - source_rownum
+                    self._truncate_chunk(chunkid, chunk_rows)
+                self.chunks.append((chunkid, chunk_rows))
+                source_rownum += chunk_rows
+        if failed:
+            raise Error('%d of %d processes loading DataSource %s failed' %
+                        (failed, len(ranges), datasource.name))
+        self.rownum += source_rownum
+        self.chunk_rownum = self.rownum
+        soom.info('%s rows read from DataSource %s by %d processes, in %.3f seconds (%d rows total)' % (source_rownum, datasource.name, len(ranges), time.time() - starttime, self.rownum))
+        return source_rownum
+
+    def _discard_chunk(self, chunkid):
+        for col, data in self.columns:
+            try:
+                os.remove(self._chunk_filename(col.name, chunkid))
+            except OSError:
+                pass
+
+    def _truncate_chunk(self, chunkid, rows):
+        for col, data in self.columns:
+            self._write_chunk(col, chunkid, 
+                              self.get_chunk(col.name, chunkid)[:rows])
+
+    def unchunk_columns(self):
         for col, data in self.columns:
-            yield col, _col_generator(self, col)
+            yield col, ChunkedColumnData(self, col)
@@ -15,25 +15,42 @@
 # $Id: Discrete.py 2626 2007-03-09 04:35:54Z andrewm $
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/ColTypes/Discrete.py,v $
 
+import os
 import time
 import sets
-import operator
+import bisect
+import cPickle
 
 import Numeric, MA
 import soomfunc
-from soomarray import ArrayDict
+import soomarray
+from soomarray import ArrayDict, Bitmap
+from SOOMv0 import Utils
 from SOOMv0.common import *
 from SOOMv0.Soom import soom
 from SOOMv0.ColTypes.base import DatasetColumnBase
 
+index_encodings = ('auto', 'vector', 'bitmap')
+
 class _DiscreteDatasetColumn(DatasetColumnBase):
-    loadables = ['data', 'inverted']
+    loadables = ['data', 'inverted', 'sortedkeys']
+    _sortedkeys = None
+    # How inverted index row ids are stored: 'vector' (Numeric.Int
+    # arrays), 'bitmap' (compressed bitmaps) or 'auto' (whichever is
+    # smaller for each value)
+    index_encoding = 'auto'
 
     def __init__(self, parent_dataset, name, 
-                 all_value=None, all_label=None, 
+                 all_value=None, all_label=None, index_encoding=None,
                  **kwargs):
         DatasetColumnBase.__init__(self, parent_dataset, name, **kwargs)
         self._inverted = {}
+        self._sortedkeys = None
+        if index_encoding is not None:
+            if index_encoding not in index_encodings:
+                raise Error('column %r: index_encoding must be one of %s' %
+                            (self.name, ', '.join(index_encodings)))
+            self.index_encoding = index_encoding
         if all_label is None:
             all_label = '<All>'
         self.all_label = all_label
@@ -106,6 +123,16 @@ class _DiscreteDatasetColumn(DatasetColumnBase):
             for value in uniquevalues:
                 inverted = Numeric.compress(Numeric.where(Numeric.equal(self._data,value),1,0),ordinals)
                 inverted_dict[value] = inverted
+        elif hasattr(self._data, 'codes') and not self.is_multivalue():
+            # Dictionary encoded - group the rows by code
+            codes = self._data.codes()
+            order = Numeric.argsort(codes)
+            bounds = Numeric.searchsorted(Numeric.take(codes, order),
+                        Numeric.arrayrange(len(self._data.code_to_obj) + 1))
+            for code, value in enumerate(self._data.code_to_obj):
+                start, end = bounds[code], bounds[code + 1]
+                if end > start:
+                    inverted_dict[value] = Numeric.sort(order[start:end])
         else:
             # loop over each element
             for rownum, value in enumerate(self._data):
@@ -122,27 +149,47 @@ class _DiscreteDatasetColumn(DatasetColumnBase):
                     row_array = soomfunc.unique(Numeric.sort(row_array))
                 inverted_dict[value] = row_array
         self._inverted = inverted_dict
+        self._sortedkeys = None
         soom.info('Building inverted index for column %s in dataset %s took %.3f seconds' % (self.name, self.parent_dataset.name, time.time() - starttime))
 
-    def _store_inverted(self, inverted=None):
+    def _store_inverted(self, inverted=None, base=0):
         """
         Stores the passed inverted index as a memory-mapped dict
-        of NumPy ID vectors
+        of NumPy ID vectors. If base is non-zero, the index is of
+        rows appended to the base existing rows, and is merged into
+        the existing index.
         """
         indexfilename = None
         inverted_blob = {}
         if self.parent_dataset.backed:
             indexfilename = self.object_path('SOOMblobstore', 'inverted',
                                              mkdirs=True)
-            inverted_blob = ArrayDict(indexfilename, 'w+')
-        # now write out the Numpy array for each value in the column to a file
+            self.unload_inverted()
+            if base and os.path.exists(indexfilename):
+                Utils.unshare_file(indexfilename)
+                inverted_blob = ArrayDict(indexfilename, 'r+')
+            else:
+                Utils.remove_file(indexfilename)
+                inverted_blob = ArrayDict(indexfilename, 'w+')
+        elif base:
+            raise Error('column %r: rows can only be appended to disc '
+                        'backed datasets' % self.name)
+        # now write out the Numpy array for each value in the column to a
+        # file - in one update(), so the file is grown once
+        vectors = []
         for value, rownums in inverted.iteritems():
             # TO DO: need to determine the smallest Numpy integer type required
             # to hold all the row ids
             row_array = Numeric.array(rownums, Numeric.Int)
             if self.datatype.name == 'tuple':
                 row_array = soomfunc.unique(Numeric.sort(row_array))
-            inverted_blob[value] = row_array
+            if base and inverted_blob.has_key(value):
+                # Appended row ids all follow the existing ones
+                row_array = Numeric.concatenate((inverted_blob[value], 
+                                                 row_array))
+            vectors.append((value, self._encode_rows(row_array)))
+        inverted_blob.update(vectors)
+        del vectors
         if self.heterosourcecols is not None:
             # we need to assemble an output translation dict
             self.outtrans = {}
@@ -158,13 +205,92 @@ class _DiscreteDatasetColumn(DatasetColumnBase):
                         newdesc = clabel + ":" + cdesc
                         getattr(self.parent_dataset,colname).outtrans[keytuple] = newdesc
         del inverted                # Not needed anymore
+        self._store_sortedkeys(inverted_blob.keys())
         if indexfilename:
-            inverted_blob = None           # Closes and flushes to disk
+            inverted_blob.close()
+            inverted_blob = None
         self._inverted = inverted_blob
 
-    def _inverted_gen(self, src):
+    def _build_sortedkeys(self, keys):
+        """
+        The index keys in order, and (for the prefix operators)
+        their formatted forms in order, with the corresponding keys.
+        """
+        keys = list(keys)
+        keys.sort()
+        formatted = [(self.do_format(v), v) for v in keys]
+        formatted.sort()
+        return {
+            'keys': keys,
+            'format_str': self.format_str,
+            'formatted': [f for f, v in formatted],
+            'formatted_keys': [v for f, v in formatted],
+        }
+
+    def _sortedkeys_filename(self, mkdirs=False):
+        return self.object_path('SOOMpickle', 'keys', mkdirs=mkdirs)
+
+    def _store_sortedkeys(self, keys):
+        sortedkeys = self._build_sortedkeys(keys)
+        if self.parent_dataset.backed:
+            filename = self._sortedkeys_filename(mkdirs=True)
+            Utils.remove_file(filename)
+            f = open(filename, 'wb')
+            try:
+                cPickle.dump(sortedkeys, f, -1)
+            finally:
+                f.close()
+            self._sortedkeys = None
+        else:
+            self._sortedkeys = sortedkeys
+
+    def load_sortedkeys(self):
+        if self._sortedkeys is not None:
+            return
+        sortedkeys = None
+        if self.parent_dataset.backed:
+            try:
+                f = open(self._sortedkeys_filename(), 'rb')
+            except IOError:
+                # Stored by an earlier version
+                pass
+            else:
+                try:
+                    sortedkeys = cPickle.load(f)
+                finally:
+                    f.close()
+        if sortedkeys is None:
+            sortedkeys = self._build_sortedkeys(self.inverted.keys())
+        elif sortedkeys['format_str'] != self.format_str:
+            sortedkeys = self._build_sortedkeys(sortedkeys['keys'])
+        self._sortedkeys = sortedkeys
+
+    def unload_sortedkeys(self):
+        self._sortedkeys = None
+
+    def get_sortedkeys(self):
+        if self._sortedkeys is None:
+            self.load_sortedkeys()
+        return self._sortedkeys
+    sortedkeys = property(get_sortedkeys)
+
+    def _encode_rows(self, row_array):
+        """
+        Choose the representation of an inverted index row id
+        vector according to the column's index_encoding.
+        """
+        if self.index_encoding == 'vector' or len(row_array) == 0:
+            return row_array
+        bitmap = Bitmap.fromids(row_array)
+        if (self.index_encoding == 'bitmap' or
+            bitmap.nbytes() < len(row_array) * row_array.itemsize()):
+            return bitmap
+        return row_array
+
+    def _inverted_gen(self, src, base=0):
         inverted = {}
         for rownum, value in enumerate(src):
+            rownum += base
             if type(value) is tuple:
                 for v in value:
                     if v is not None or not self.ignorenone:
@@ -178,127 +304,283 @@ class _DiscreteDatasetColumn(DatasetColumnBase):
                                 (self.name, value, type(value), e))
                 row_nums.append(rownum)
             yield value
-        self._store_inverted(inverted)
+        self._store_inverted(inverted, base)
 
-    def get_store_chain(self, data, mask=None):
-        src = DatasetColumnBase.get_store_chain(self, data, mask)
-        src = self._inverted_gen(src)
+    def get_store_chain(self, data, mask=None, base=0):
+        src = DatasetColumnBase.get_store_chain(self, data, mask, base)
+        src = self._inverted_gen(src, base)
         return src
 
-    def _op_general(self, op, value, filter_keys=[], prefix = False):
-        # handle the general case for an operator combining vectors of results
-        # for each operator.
-        #
+    def _match_keys(self, op, value, filter_keys=[], prefix = False):
+        # handle the general case for an operator, returning the index
+        # keys (column values) that satisfy it.
+        if not callable(op):
+            # Comparisons select a contiguous run of the sorted keys
+            sortedkeys = self.sortedkeys
+            if prefix:
+                value = self.do_format(value)
+                keys = _key_range(op, sortedkeys['formatted_keys'],
+                                  sortedkeys['formatted'], value, len(value))
+            else:
+                keys = _key_range(op, sortedkeys['keys'], 
+                                  sortedkeys['keys'], value)
+            if filter_keys:
+                filter_keys = sets.Set(filter_keys)
+                keys = [v for v in keys if v in filter_keys]
+            return keys
         # We use sets.Set() in here because numpy intersect doesn't handle
         # anything but numeric types, and we may be comparing strings, etc.
-        if not callable(op):
-            op = getattr(operator, op)
         possible_keys = sets.Set(self.inverted.keys())
         if filter_keys:
             possible_keys = possible_keys.intersection(sets.Set(filter_keys))
         if prefix:
             value = self.do_format(value)
-            rows = [self.inverted[v] 
-                    for v in possible_keys 
+            return [v for v in possible_keys 
                     if op(self.do_format(v)[:len(value)], value)]
         else:
-            rows = [self.inverted[v] 
-                    for v in possible_keys 
-                    if op(v, value)]
+            return [v for v in possible_keys if op(v, value)]
+
+    def _key_rows(self, keys):
+        # combine the row id vectors for the given index keys
+        rows = [self.inverted[v] for v in keys]
         if len(rows) == 1:
             vectors = rows[0]
         elif len(rows) > 1:
-            vectors = soomfunc.union(*rows)
+            vectors = soomarray.union(*rows)
         else:
             vectors = []
         return vectors
 
+    def _op_general(self, op, value, filter_keys=[], prefix = False,
+                    keys_only = False):
+        keys = self._match_keys(op, value, filter_keys, prefix)
+        if keys_only:
+            return keys
+        return self._key_rows(keys)
+
+    def match_keys(self, op, value, filter_keys=()):
+        """
+        Returns the index keys (column values) selected by filter
+        operator "op", rather than the matching rows.
+        """
+        return self.filter_op(op, value, filter_keys, keys_only=True)
+
+    def filter_estimate(self, op, value):
+        """
+        The number of rows selected is the sum of the row id vector
+        lengths of the selected keys (exact, except for multivalue
+        columns, where a row may appear under several keys).
+        """
+        inverted = self.inverted
+        return sum([len(inverted[v]) for v in self.match_keys(op, value)])
+
+    def filter_op_rows(self, op, value, rows, filter_keys=()):
+        """
+        Only rows in "rows" are of interest. If "rows" is small
+        compared to the row id vectors of the selected keys, each
+        key's vector is probed for the surviving rows, and only the
+        keys still present contribute to the result - otherwise the
+        union of the vectors is intersected with "rows".
+        """
+        if len(rows) == 0:
+            return []
+        keys = self.match_keys(op, value, filter_keys)
+        if not keys:
+            return []
+        inverted = self.inverted
+        if len(keys) * len(rows) >= sum([len(inverted[v]) for v in keys]):
+            return soomarray.intersect(self._key_rows(keys), rows)
+        if not self.is_multivalue():
+            rows = Numeric.asarray(rows, Numeric.Int)
+            coded = self.take_codes(rows)
+            if coded is not None:
+                # Look the rows' codes up in a table of selected codes
+                codes, obj_to_code = coded
+                selected = Numeric.zeros(max([0] + obj_to_code.values()) + 1, 
+                                         Numeric.Int)
+                for v in keys:
+                    code = obj_to_code.get(v)
+                    if code is not None:
+                        selected[code] = 1
+                return Numeric.compress(Numeric.take(selected, codes), rows)
+        found = []
+        for v in keys:
+            vector = soomarray.intersect(inverted[v], rows)
+            if len(vector):
+                found.append(vector)
+        if len(found) == 1:
+            return found[0]
+        elif len(found) > 1:
+            return soomarray.union(*found)
+        return []
+
     def describe(self, detail=ALL_DETAIL):
         d = DatasetColumnBase.describe(self, detail)
         if detail >= SOME_DETAIL:       # Don't load .inverted otherwise
             d.add('data', SOME_DETAIL, 'Cardinality', self.cardinality())
+        d.add('data', SOME_DETAIL, 'Index encoding', self.index_encoding)
         d.add('data', SOME_DETAIL, 'Label for <All>', self.all_label)
         d.add('data', SOME_DETAIL, 'Value for <All>', str(self.all_value))
         return d
 
     # special case for operator equal as we don't have to step through whole
     # list if we have a match
-    def op_equal(self, value, filter_keys):
+    def op_equal(self, value, filter_keys, keys_only=False):
+        if keys_only:
+            if self.inverted.has_key(value):
+                return [value]
+            return []
         return self.inverted.get(value, [])
 
-    def op_between(self, value, filter_keys):
+    def op_between(self, value, filter_keys, keys_only=False):
         try:
             start, end = value
         except (ValueError, TypeError):
             raise ExpressionError('between(start, end)')
-        possible_keys = sets.Set(self.inverted.keys())
-        if filter_keys:
-            possible_keys = possible_keys.intersection(sets.Set(filter_keys))
-        rows = [self.inverted[v] 
-                for v in possible_keys 
-                if start <= v < end]
-        if len(rows) == 0:
-            vectors = []
-        elif len(rows) == 1:
-            vectors = rows[0]
-        else:
-            vectors = soomfunc.union(*rows)
-        return vectors
+        keys = self.sortedkeys['keys']
+        keys = keys[bisect.bisect_left(keys, start):
+                    bisect.bisect_left(keys, end)]
+        return self._selected(keys, filter_keys, keys_only)
 
-    def op_less_than(self, value, filter_keys):
-        return self._op_general('lt', value, filter_keys)
+    def op_less_than(self, value, filter_keys, keys_only=False):
+        return self._op_general('lt', value, filter_keys, 
+                                keys_only=keys_only)
 
-    def op_less_equal(self, value, filter_keys):
-        return self._op_general('le', value, filter_keys)
+    def op_less_equal(self, value, filter_keys, keys_only=False):
+        return self._op_general('le', value, filter_keys, 
+                                keys_only=keys_only)
 
-    def op_greater_than(self, value, filter_keys):
-        return self._op_general('gt', value, filter_keys)
+    def op_greater_than(self, value, filter_keys, keys_only=False):
+        return self._op_general('gt', value, filter_keys, 
+                                keys_only=keys_only)
 
-    def op_greater_equal(self, value, filter_keys):
-        return self._op_general('ge', value, filter_keys)
+    def op_greater_equal(self, value, filter_keys, keys_only=False):
+        return self._op_general('ge', value, filter_keys, 
+                                keys_only=keys_only)
 
-    def op_not_equal(self, value, filter_keys):
-        return self._op_general('ne', value, filter_keys)
+    def op_not_equal(self, value, filter_keys, keys_only=False):
+        return self._op_general('ne', value, filter_keys, 
+                                keys_only=keys_only)
 
-    def op_equal_col(self, value, filter_keys):
-        return self._op_general('eq', value, filter_keys, prefix=True)
+    def op_equal_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('eq', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
-    def op_not_equal_col(self, value, filter_keys):
-        return self._op_general('ne', value, filter_keys, prefix=True)
+    def op_not_equal_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('ne', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
-    def op_less_than_col(self, value, filter_keys):
-        return self._op_general('lt', value, filter_keys, prefix=True)
+    def op_less_than_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('lt', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
-    def op_less_equal_col(self, value, filter_keys):
-        return self._op_general('le', value, filter_keys, prefix=True)
+    def op_less_equal_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('le', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
-    def op_greater_than_col(self, value, filter_keys):
-        return self._op_general('gt', value, filter_keys, prefix=True)
+    def op_greater_than_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('gt', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
-    def op_greater_equal_col(self, value, filter_keys):
-        return self._op_general('ge', value, filter_keys, prefix=True)
+    def op_greater_equal_col(self, value, filter_keys, keys_only=False):
+        return self._op_general('ge', value, filter_keys, prefix=True,
+                                keys_only=keys_only)
 
     def _assert_value_is_list(self, value):
         if type(value) not in (list, tuple):
             raise ExpressionError('"in" operator must be followed by a list')
 
-    def op_in(self, value, filter_keys):
+    def _selected(self, keys, filter_keys, keys_only):
+        # the rows (or keys) for keys selected other than by _match_keys
+        if filter_keys:
+            filter_keys = sets.Set(filter_keys)
+            keys = [v for v in keys if v in filter_keys]
+        if keys_only:
+            return keys
+        return self._key_rows(keys)
+
+    def _in_keys(self, value):
+        inverted = self.inverted
+        return [v for v in dict.fromkeys(value) if inverted.has_key(v)]
+
+    def _in_col_keys(self, value):
+        # each value is a prefix (optionally ending in "*"), selecting a
+        # contiguous run of the sorted keys
+        keys = self.sortedkeys['keys']
+        found = {}
+        for prefix in value:
+            prefix = str(prefix)
+            if prefix.endswith('*'):
+                prefix = prefix[:-1]
+            try:
+                found.update(dict.fromkeys(_key_range('eq', keys, keys, 
+                                                      prefix, len(prefix))))
+            except TypeError:
+                # Not all keys are strings
+                return [v for v in keys if has_in_col_value_list(v, value)]
+        return found.keys()
+
+    def _not_keys(self, keys):
+        keys = sets.Set(keys)
+        return [v for v in self.sortedkeys['keys'] if v not in keys]
+
+    def op_in(self, value, filter_keys, keys_only=False):
         self._assert_value_is_list(value)
-        return self._op_general(lambda v, value: v in value, 
-                                 value, filter_keys)
+        return self._selected(self._in_keys(value), filter_keys, keys_only)
 
-    def op_not_in(self, value, filter_keys):
+    def op_not_in(self, value, filter_keys, keys_only=False):
         self._assert_value_is_list(value)
-        return self._op_general(lambda v, value: v not in value, 
-                                 value, filter_keys)
+        return self._selected(self._not_keys(self._in_keys(value)), 
+                              filter_keys, keys_only)
 
-    def op_in_col(self, value, filter_keys):
+    def op_in_col(self, value, filter_keys, keys_only=False):
         self._assert_value_is_list(value)
-        return self._op_general(has_in_col_value_list, value, filter_keys)
+        return self._selected(self._in_col_keys(value), 
+                              filter_keys, keys_only)
 
-    def op_not_in_col(self, value, filter_keys):
+    def op_not_in_col(self, value, filter_keys, keys_only=False):
         self._assert_value_is_list(value)
-        return self._op_general(lambda v, value: not has_in_col_value_list(v, value), value, filter_keys)
+        return self._selected(self._not_keys(self._in_col_keys(value)), 
+                              filter_keys, keys_only)
+
+def _bound(order, value, width, upper):
+    # bisect "order", comparing only the first "width" characters
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        v = order[mid][:width]
+        if v < value or (upper and v == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _key_range(op, keys, order, value, width=None):
+    """
+    Returns the keys satisfying comparison "op" (lt, le, gt, ge,
+    eq or ne) with value - "order" is the sorted form of each key
+    compared, parallel to "keys". If "width" is given, only that
+    many leading characters of each are compared.
+    """
+    if width is None:
+        lower = bisect.bisect_left(order, value)
+        upper = bisect.bisect_right(order, value)
+    else:
+        lower = _bound(order, value, width, False)
+        upper = _bound(order, value, width, True)
+    if op == 'lt':
+        return keys[:lower]
+    elif op == 'le':
+        return keys[:upper]
+    elif op == 'gt':
+        return keys[upper:]
+    elif op == 'ge':
+        return keys[lower:]
+    elif op == 'eq':
+        return keys[lower:upper]
+    elif op == 'ne':
+        return keys[:lower] + keys[upper:]
+    raise ValueError('unknown comparison %r' % op)
 
 # test whether v is in value_list for "in:" operator.  Tests whether v is the
 # leading string in any value in value_list.  Values can end in "*" which is
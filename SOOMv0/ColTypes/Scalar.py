@@ -15,61 +15,260 @@
 # $Id: Scalar.py 2626 2007-03-09 04:35:54Z andrewm $
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/ColTypes/Scalar.py,v $
 
+import os
+import time
+
 import Numeric, MA
-import soomfunc
+from soomarray import ArrayDict
+from SOOMv0 import Utils
+from SOOMv0.common import *
+from SOOMv0.Soom import soom
 from SOOMv0.ColTypes.base import DatasetColumnBase
 
 class _ScalarDatasetColumn(DatasetColumnBase):
+    loadables = ['data', 'sortindex']
+    # If true, a permutation of the row ids in value order is kept with
+    # the column, and range filters are answered by binary search
+    sort_index = False
+    _sortindex = None
+
+    def __init__(self, parent_dataset, name, sort_index=None, **kwargs):
+        DatasetColumnBase.__init__(self, parent_dataset, name, **kwargs)
+        if sort_index is not None:
+            self.sort_index = bool(sort_index)
+        self._sortindex = None
 
     def is_scalar(self):
         return True
 
-    def _op_general(self, op, value, filter_keys=[]):
-        # handle the general case for an operator combining vectors of results
-        # for each operator.
+    def describe(self, detail=ALL_DETAIL):
+        d = DatasetColumnBase.describe(self, detail)
+        d.add('data', SOME_DETAIL, 'Sort index', yesno(self.sort_index))
+        return d
+
+    def _build_sortindex(self, data):
+        """
+        Returns the ids of the non-missing rows, ordered by value
+        """
+        if self.datatype.is_numeric or self.datatype.is_datetime:
+            data = self.datatype.ordinals(data)
+            if MA.isMaskedArray(data):
+                rows = Numeric.nonzero(Numeric.logical_not(
+                                            MA.getmaskarray(data)))
+                values = Numeric.take(data.filled(), rows)
+                return Numeric.take(rows, Numeric.argsort(values))
+            return Numeric.argsort(Numeric.asarray(data))
+        order = [(v, i) for i, v in enumerate(data) if v is not None]
+        order.sort()
+        return Numeric.array([i for v, i in order], Numeric.Int)
+
+    def _store_finish(self, store_data, store_mask, datafilename):
+        DatasetColumnBase._store_finish(self, store_data, store_mask,
+                                        datafilename)
+        self._sortindex = None
+        if self.sort_index:
+            self._store_sortindex()
+
+    def _store_sortindex(self):
+        starttime = time.time()
+        order = self._build_sortindex(self.data)
+        if self.parent_dataset.backed:
+            filename = self.object_path('SOOMblobstore', 'sortindex',
+                                        mkdirs=True)
+            Utils.remove_file(filename)
+            sortindex = ArrayDict(filename, 'w+')
+            sortindex['order'] = order
+            sortindex.close()
+            self._sortindex = None
+        else:
+            self._sortindex = {'order': order}
+        soom.info('Building sort index for column %s in dataset %s took '
+                  '%.3f seconds' % (self.name, self.parent_dataset.name, 
+                                    time.time() - starttime))
+
+    def load_sortindex(self):
+        if self._sortindex is not None:
+            return
+        if not self.sort_index:
+            self._sortindex = {}
+        elif self.parent_dataset.backed:
+            filename = self.object_path('SOOMblobstore', 'sortindex')
+            if os.path.exists(filename):
+                self._sortindex = ArrayDict(filename, 'r')
+            else:
+                # Stored before the index was enabled
+                self._sortindex = {}
+        else:
+            self._sortindex = {'order': self._build_sortindex(self.data)}
+
+    def unload_sortindex(self):
+        self._sortindex = None
+
+    def get_sortindex(self):
+        """
+        The row ids of the non-missing rows in value order, or None
+        if the column has no sort index.
+        """
+        if self._sortindex is None:
+            self.load_sortindex()
+        return self._sortindex.get('order')
+    sortindex = property(get_sortindex)
+
+    def _sortindex_ranges(self, order, op, value):
+        # returns the (start, end) slices of the sort index selected
+        # by the operator, found by binary search.
+        data = self.datatype.ordinals(self.data)
+        if op == 'op_between':
+            try:
+                start, end = value
+            except (ValueError, TypeError):
+                raise ExpressionError('between(start, end)')
+            start = self.datatype.as_ordinal(start)
+            end = self.datatype.as_ordinal(end)
+        else:
+            value = self.datatype.as_ordinal(value)
+        def bound(v, upper):
+            lo, hi = 0, len(order)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                x = data[order[mid]]
+                if x < v or (upper and x == v):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        if op == 'op_between':
+            return [(bound(start, False), bound(end, False))]
+        lower = bound(value, False)
+        upper = bound(value, True)
+        if op == 'op_less_than':
+            return [(0, lower)]
+        elif op == 'op_less_equal':
+            return [(0, upper)]
+        elif op == 'op_greater_than':
+            return [(upper, len(order))]
+        elif op == 'op_greater_equal':
+            return [(lower, len(order))]
+        elif op == 'op_equal':
+            return [(lower, upper)]
+        elif op == 'op_not_equal':
+            return [(0, lower), (upper, len(order))]
+
+    def _sortindex_rows(self, op, value):
+        # Answer the operator from the sort index, if there is one
+        order = self.sortindex
+        if order is None:
+            return None
+        parts = [order[start:end] 
+                 for start, end in self._sortindex_ranges(order, op, value)
+                 if end > start]
+        if not parts:
+            return Numeric.array([], Numeric.Int)
+        # Back into row order, to combine with other filter results
+        return Numeric.sort(Numeric.concatenate(parts))
+
+    # Numeric functions for the filter operators
+    _numeric_ops = {
+        'op_less_than': 'less',
+        'op_less_equal': 'less_equal',
+        'op_greater_than': 'greater',
+        'op_greater_equal': 'greater_equal',
+        'op_not_equal': 'not_equal',
+        'op_equal': 'equal',
+    }
+    # Rows sampled by filter_estimate()
+    estimate_sample = 1000
+
+    def _op_map(self, op, value, data):
+        # returns a vector of 0/1 for the rows of "data" satisfying the
+        # operator.
         #
         # NB: use of filled() in Numeric ops is a dangerous hack and may give
         # wrong answers if columns contains values <= 0
-        if type(self.data) is MA.MaskedArray:
-            numeric_fn = getattr(MA, op)
-            resmap = numeric_fn(self.data, value).filled()
+        data = self.datatype.ordinals(data)
+        if op == 'op_between':
+            try:
+                start, end = value
+            except (ValueError, TypeError):
+                raise ExpressionError('between(start, end)')
+            return Numeric.logical_and(self._op_map('op_greater_equal', 
+                                                    start, data),
+                                       self._op_map('op_less_than', 
+                                                    end, data))
+        value = self.datatype.as_ordinal(value)
+        if type(data) is MA.MaskedArray:
+            numeric_fn = getattr(MA, self._numeric_ops[op])
+            return numeric_fn(data, value).filled()
         else:
-            numeric_fn = getattr(Numeric, op)
-            resmap = numeric_fn(self.data, value)
-        return Numeric.nonzero(resmap)
+            numeric_fn = getattr(Numeric, self._numeric_ops[op])
+            return numeric_fn(data, value)
+
+    def _op_general(self, op, value, filter_keys=[]):
+        # handle the general case for an operator combining vectors of results
+        # for each operator.
+        rows = self._sortindex_rows(op, value)
+        if rows is not None:
+            return rows
+        return Numeric.nonzero(self._op_map(op, value, self.data))
+
+    def filter_op_rows(self, op, value, rows, filter_keys=()):
+        """
+        Only the values of the surviving "rows" are compared
+        """
+        if op not in self._numeric_ops and op != 'op_between':
+            return DatasetColumnBase.filter_op_rows(self, op, value, rows, 
+                                                    filter_keys)
+        if len(rows) == 0:
+            return []
+        if (self.sortindex is not None 
+                and self.filter_estimate(op, value) < len(rows)):
+            return DatasetColumnBase.filter_op_rows(self, op, value, rows, 
+                                                    filter_keys)
+        rows = Numeric.asarray(rows, Numeric.Int)
+        return Numeric.compress(self._op_map(op, value, 
+                                             self.take_ordinals(rows)), 
+                                rows)
+
+    def filter_estimate(self, op, value):
+        """
+        The rows selected are counted exactly from the sort index,
+        if there is one, otherwise estimated from an evenly spaced
+        sample of the column.
+        """
+        if op not in self._numeric_ops and op != 'op_between':
+            return None
+        order = self.sortindex
+        if order is not None:
+            return sum([max(0, end - start) for start, end in 
+                        self._sortindex_ranges(order, op, value)])
+        size = len(self)
+        if size == 0:
+            return 0
+        step = max(1, size // self.estimate_sample)
+        sample = self.take_ordinals(Numeric.arrayrange(0, size, step))
+        matched = Numeric.sum(self._op_map(op, value, sample))
+        return int(matched * size // len(sample))
 
     def op_less_than(self, value, filter_keys):
-        return self._op_general('less', value, filter_keys)
+        return self._op_general('op_less_than', value, filter_keys)
 
     def op_less_equal(self, value, filter_keys):
-        return self._op_general('less_equal', value, filter_keys)
+        return self._op_general('op_less_equal', value, filter_keys)
 
     def op_greater_than(self, value, filter_keys):
-        return self._op_general('greater', value, filter_keys)
+        return self._op_general('op_greater_than', value, filter_keys)
 
     def op_greater_equal(self, value, filter_keys):
-        return self._op_general('greater_equal', value, filter_keys)
+        return self._op_general('op_greater_equal', value, filter_keys)
 
     def op_not_equal(self, value, filter_keys):
-        return self._op_general('not_equal', value, filter_keys)
+        return self._op_general('op_not_equal', value, filter_keys)
 
     def op_equal(self, value, filter_keys):
-        return self._op_general('equal', value, filter_keys)
+        return self._op_general('op_equal', value, filter_keys)
 
     def op_between(self, value, filter_keys):
-        try:
-            start, end = value
-        except (ValueError, TypeError):
-            raise ExpressionError('between(start, end)')
-        if type(self.data) is MA.MaskedArray:
-            resmap_ge = greater_equal(self.data, start).filled()
-            resmap_lt = less(self.data, end).filled()
-        else:
-            resmap_ge = Numeric.greater_equal(self.data, start)
-            resmap_lt = Numeric.less(self.data, end)
-        vectors = soomfunc.intersect(Numeric.nonzero(resmap_ge), 
-                                     NUmeric.nonzero(resmap_lt))
-        return vectors
+        return self._op_general('op_between', value, filter_keys)
 
 
 class ScalarDatasetColumn(_ScalarDatasetColumn):
@@ -27,6 +27,7 @@ import bisect
 from soomarray import ArrayVocab
 from soomfunc import strip_word
 
+from SOOMv0 import Utils
 from SOOMv0.common import *
 from SOOMv0.Soom import soom
 from SOOMv0.ColTypes.base import DatasetColumnBase
@@ -46,16 +47,23 @@ class SearchableTextDatasetColumn(DatasetColumnBase):
         """
         DatasetColumnBase.__init__(self, *args, **kw)
         self.entries_cache = {}
-        self.wordidx_filename = self.object_path('SOOMstringvocab', 'wordidx',
-                                         mkdirs=True)
-        self.occurrences_filename = self.object_path('SOOMpackeddata', 'occurrences',
-                                         mkdirs=True)
         self._wordidx = None
         self._occurrences = None
 
-    def _wordidx_gen(self, src):
+    # The index files belong to the current dataset generation (these
+    # were once attributes fixed when the column was created).
+    def get_wordidx_filename(self):
+        return self.object_path('SOOMstringvocab', 'wordidx', mkdirs=True)
+    wordidx_filename = property(get_wordidx_filename)
+
+    def get_occurrences_filename(self):
+        return self.object_path('SOOMpackeddata', 'occurrences', mkdirs=True)
+    occurrences_filename = property(get_occurrences_filename)
+
+    def _wordidx_gen(self, src, base=0):
         # Keep a count of the occurrences of each word.
         for rownum, value in enumerate(src):
+            rownum += base
             if value:
                 words = {}
                 for wordnum, match in enumerate(self.WORD_RE.finditer(value)):
@@ -65,15 +73,15 @@ class SearchableTextDatasetColumn(DatasetColumnBase):
             yield value
         self._store_wordidx()
 
-    def get_store_chain(self, data, mask=None):
-        self.create_wordidx()
+    def get_store_chain(self, data, mask=None, base=0):
+        self.create_wordidx(append=bool(base))
         src = iter(data)
         if mask is not None:
             src = self._mask_gen(src, mask)
         if self.missingvalues:
             src = self._missing_gen(src, self.missingvalues)
-        src = self._storedata_gen(src)
-        src = self._wordidx_gen(src)
+        src = self._storedata_gen(src, base)
+        src = self._wordidx_gen(src, base)
         return src
 
     def _store_wordidx(self):
@@ -84,18 +92,31 @@ class SearchableTextDatasetColumn(DatasetColumnBase):
             raise Error('Searchable text requires a "backed" dataset')
         self.flush()
 
-    def create_wordidx(self):
+    def create_wordidx(self, append=False):
         """
-        Open the word index files read-write and prepare them
+        Open the word index files read-write and prepare them (if
+        append is True, words from appended rows are added to the
+        existing index files).
         """
         if not self.parent_dataset.backed:
             raise NotImplementedError
+        if append and self._wordidx is not None:
+            # Opened read-only
+            self.unload_wordidx()
         if self._wordidx is None:
             starttime = time.time()
-            self._wordidx = ArrayVocab(self.wordidx_filename, 'c')
-            self._occurrences = file(self.occurrences_filename, 'wb+')
-            # create an empty block 0
-            self._occurrences.write("\0" * self.BLOCK_SIZE)
+            if append and os.path.exists(self.occurrences_filename):
+                Utils.unshare_file(self.wordidx_filename)
+                Utils.unshare_file(self.occurrences_filename)
+                self._wordidx = ArrayVocab(self.wordidx_filename, 'c')
+                self._occurrences = file(self.occurrences_filename, 'rb+')
+            else:
+                Utils.remove_file(self.wordidx_filename)
+                Utils.remove_file(self.occurrences_filename)
+                self._wordidx = ArrayVocab(self.wordidx_filename, 'c')
+                self._occurrences = file(self.occurrences_filename, 'wb+')
+                # create an empty block 0
+                self._occurrences.write("\0" * self.BLOCK_SIZE)
             elapsed = time.time() - starttime
             soom.info('creation of %r index took %.3f seconds.' % (self.name, elapsed))
 
@@ -115,6 +136,11 @@ class SearchableTextDatasetColumn(DatasetColumnBase):
                         (self.name, len(self._wordidx), blocks, elapsed))
     load_occurrences = load_wordidx
 
+    def unload_wordidx(self):
+        self._wordidx = None
+        self._occurrences = None
+    unload_occurrences = unload_wordidx
+
     def get_wordidx(self):
         if self._wordidx is None:
             self.load_wordidx()
@@ -287,7 +313,7 @@ class SearchableTextDatasetColumn(DatasetColumnBase):
         """
         first_block, last_block = self.get_blocks(word, space_needed)
         #print word, "has a first block of", first_block, "and a last block of", last_block
-        entries, space_left = self.entries_cache.get(last_block)
+        entries, space_left = self.entries_cache.get(last_block, (None, None))
         #print "\tentries cache said", space_left, "entries left"
         if entries is None:
             last_block, size, link, used, entries = self.load_block(last_block)
@@ -21,6 +21,7 @@ import time
 import itertools
 
 import MA, Numeric
+import soomarray
 
 from SOOMv0.common import *
 from SOOMv0.Soom import soom
@@ -217,7 +218,7 @@ class SimpleDatasetColumnBase(AbstractDatasetColumnBase):
         d.add('out', SOME_DETAIL, 'Format String', self.format_str)
         return d
 
-    def filter_op(self, op, value, filter_keys):
+    def filter_op(self, op, value, filter_keys, **kwargs):
         """
         Execute comparisons from expression parser for DatasetFilter.
 
@@ -239,7 +240,27 @@ class SimpleDatasetColumnBase(AbstractDatasetColumnBase):
             raise ExpressionError('%r operator not supported on %s column %r' %
                                   (op_name, self.coltype, self.name))
         else:
-            return opmeth(value, filter_keys)
+            return opmeth(value, filter_keys, **kwargs)
+
+    def filter_op_rows(self, op, value, rows, filter_keys=()):
+        """
+        As for filter_op(), but only rows in the (sorted) "rows"
+        vector are of interest - the result is the subset of "rows"
+        that match the condition. Column types that can probe
+        individual rows more cheaply than evaluating the whole
+        column override this.
+        """
+        result = self.filter_op(op, value, filter_keys)
+        if len(result) == 0 or len(rows) == 0:
+            return []
+        return soomarray.intersect(result, rows)
+
+    def filter_estimate(self, op, value):
+        """
+        Estimate the number of rows filter_op() would return, or
+        None if the column can't estimate it cheaply.
+        """
+        return None
 
 
 class DatasetColumnBase(SimpleDatasetColumnBase):
@@ -277,7 +298,8 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
     def get_metadata(self):
         m = SimpleDatasetColumnBase.get_metadata(self)
         for attr in self.loadables:
-            del m['_' + attr]
+            # (may be absent from columns saved by earlier versions)
+            m.pop('_' + attr, None)
         return m
 
     def __getstate__(self):
@@ -374,6 +396,24 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
     def take(self, rows):
         return self.datatype.take(self.data, rows)
 
+    def take_ordinals(self, rows):
+        """
+        The values at rows, in a form that can be compared a vector
+        at a time (see DataTypes)
+        """
+        return self.datatype.take_ordinals(self.data, rows)
+
+    def take_codes(self, rows):
+        """
+        If the data is stored as integer codes plus a dictionary
+        (see soomarray.RecodeBlobArray), returns the codes at rows
+        and the value to code dictionary, otherwise None.
+        """
+        data = self.data
+        if not hasattr(data, 'take_codes'):
+            return None
+        return data.take_codes(rows), data.obj_to_code
+
     def __len__(self):
         return len(self.data)
 
@@ -429,10 +469,13 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
                 value = None
             yield value
 
-    def _multisrc_gen(self, multisourcecols):
+    def _multisrc_gen(self, multisourcecols, base=0):
         srcs = []
         for colname in multisourcecols:
-            srcs.append(self.parent_dataset[colname].data)
+            data = self.parent_dataset[colname].data
+            if base:
+                data = data[base:]
+            srcs.append(data)
         return itertools.izip(*srcs)
 
     def _tuple_gen(self, src, ignorenone):
@@ -447,17 +490,44 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
         for value in src:
             yield tuple([v for v in value if v not in missingvalues])
 
-    def _storedata_gen(self, src):
-        # If persisent, set data file name
+    def _get_store_arrays(self, base=0):
+        """
+        Returns the data file name (if backed), and the array and
+        mask the column data is to be stored in. If base is
+        non-zero, rows are being appended to the base rows already
+        stored.
+        """
         datafilename = None
         if self.parent_dataset.backed:
             datafilename = self.object_path(self.datatype.file_extension,
                                             mkdirs=True)
         ds_len = len(self.parent_dataset)
-        store_data = self.datatype.get_array(datafilename, ds_len)
+        if not base:
+            return (datafilename, self.datatype.get_array(datafilename, ds_len),
+                    self.datatype.get_mask(ds_len))
+        if not datafilename:
+            raise Error('column %r: rows can only be appended to disc '
+                        'backed datasets' % self.name)
+        self.unload_data()
+        existing = 0
+        if self.datatype.data_exists(datafilename):
+            existing = len(self.data)
+            self.unload_data()
+        store_data, store_mask = self.datatype.get_append_array(datafilename,
+                                                                ds_len)
+        # A column added since the rows were first loaded
+        maskval = self.datatype.masked_value
+        for rownum in xrange(existing, base):
+            store_data[rownum] = maskval
+            if store_mask is not None:
+                store_mask[rownum] = 1
+        return datafilename, store_data, store_mask
+
+    def _storedata_gen(self, src, base=0):
+        datafilename, store_data, store_mask = self._get_store_arrays(base)
         maskval = self.datatype.masked_value
-        store_mask = self.datatype.get_mask(ds_len)
         for rownum, value in enumerate(src):
+            rownum += base
             if value is None:
                 store_value = maskval
                 if store_mask is not None:
@@ -472,6 +542,43 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
                             (self.name, rownum, value, 
                             self.datatype.name))
             yield value
+        self._store_finish(store_data, store_mask, datafilename)
+
+    def _bulk_store_ok(self, data, mask):
+        """
+        Numeric columns loaded from typed chunks (see ChunkingLoader)
+        can be copied a chunk at a time if there is no per-value
+        processing to do (subclasses that extend the store chain,
+        eg to build indexes, always process values).
+        """
+        store_chain = self.__class__.get_store_chain.im_func
+        return (mask is None and self.datatype.is_numeric
+                and store_chain is DatasetColumnBase.get_store_chain.im_func
+                and hasattr(data, 'numeric_chunks')
+                and not (self.multisourcecols or self.heterosourcecols
+                         or self.calculatedby or self.missingvalues)
+                and not self.is_multivalue()
+                and data.numeric_chunks_ok(self.datatype.numeric_type))
+
+    def _bulk_storedata(self, data, base=0):
+        datafilename, store_data, store_mask = self._get_store_arrays(base)
+        ds_len = len(self.parent_dataset)
+        typecode = self.datatype.numeric_type
+        rownum = base
+        for values, nullflags in data.numeric_chunks():
+            values = Numeric.fromstring(values, typecode)
+            end = rownum + len(values)
+            if end > ds_len:
+                raise Error('column %r has more than %d rows' % 
+                            (self.name, ds_len))
+            store_data[rownum:end] = values
+            if nullflags:
+                store_mask[rownum:end] = Numeric.fromstring(nullflags, 
+                                                            MA.MaskType)
+            rownum = end
+        self._store_finish(store_data, store_mask, datafilename)
+
+    def _store_finish(self, store_data, store_mask, datafilename):
         # If have a mask, but no values masked, use Numeric rather than MA
         if store_mask is not None and not Numeric.sometrue(store_mask):
             store_mask = None
@@ -484,14 +591,15 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
             if format_str:
                 self.format_str = format_str
 
-    def get_store_chain(self, data, mask=None):
+    def get_store_chain(self, data, mask=None, base=0):
         """
         Return a chain of generators for processing the src data,
-        which can either be a list or an iterable.
+        which can either be a list or an iterable. If base is
+        non-zero, the data is appended to the base existing rows.
         """
         multisourcecols = self.multisourcecols or self.heterosourcecols
         if multisourcecols:
-            src = self._multisrc_gen(multisourcecols)
+            src = self._multisrc_gen(multisourcecols, base)
         else:
             src = iter(data)
         if MA.isMaskedArray(data) and mask is None:
@@ -508,19 +616,21 @@ class DatasetColumnBase(SimpleDatasetColumnBase):
                                             self.calculatedargs)
             if self.missingvalues:
                 src = self._missing_gen(src, self.missingvalues)
-        src = self._storedata_gen(src)
+        src = self._storedata_gen(src, base)
         return src
 
-    def store_column(self, data, mask=None): 
+    def store_column(self, data, mask=None, base=0): 
         st = time.time()
         # The chain of generators returned by get_store_chain does the actual
         # processing.
-        if not getattr(self, 'trace_load', False):
-            for value in self.get_store_chain(data, mask):
+        if self._bulk_store_ok(data, mask):
+            self._bulk_storedata(data, base)
+        elif not getattr(self, 'trace_load', False):
+            for value in self.get_store_chain(data, mask, base):
                 pass
         else:
             tracer = store_trace()
-            for value in self.get_store_chain(data, mask):
+            for value in self.get_store_chain(data, mask, base):
                 tracer.flush()
             tracer.done()
         soom.info('Stored data for column %s in dataset %s (%.3fs)' %
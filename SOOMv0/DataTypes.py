@@ -23,8 +23,9 @@ Object hierarchy is:
                 IntDataType
                 LongDataType
             FloatDataType
-        StrDataType
-        TupleDataType
+        _HeapBaseDataType
+            StrDataType
+            TupleDataType
         RecodeDataType
         _DateTimeBaseDataType
             DateDataType
@@ -42,10 +43,22 @@ Object hierarchy is:
     soomarray_type      Types that use soomarray for storage use the
                         given soomarray class.
     file_extension      Extension used on persistent data files.
+    legacy_type         soomarray class used by older versions, if
+                        the storage format has changed (data in the
+                        old format is read, and rewritten in the new
+                        format when the column is next stored).
+    legacy_file_extension
+                        Extension of legacy_type data files.
 
     get_array(filename, size) 
                         Return an array-like object of the appropriate type.
     get_mask(size)      Return a numpy mask, for types that use numpy
+    get_append_array(filename, size)
+                        Return an array-like object and mask (as above)
+                        holding any existing data from filename, for
+                        appending rows.
+    data_exists(filename)
+                        Has data been stored in filename?
     as_pytype(value)    Cast value to an appropriate pytype or 
                         raise ValueError
     store_data(data, mask, filename)
@@ -55,6 +68,12 @@ Object hierarchy is:
     load_data(filename) return pointer to persistent storage object
     take(data, want)    extract the values associated with record ids in
                         "want" list.
+    ordinals(data)      Return the values as a Numeric (or MA) vector
+                        that can be compared with as_ordinal(value) -
+                        the data itself, except for date and time types.
+    as_ordinal(value)   Convert a value to compare with ordinals(data).
+    take_ordinals(data, want)
+                        ordinals() of the values at record ids "want".
 
 $Id: DataTypes.py 2626 2007-03-09 04:35:54Z andrewm $
 $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/DataTypes.py,v $
@@ -66,10 +85,13 @@ import mx
 import math
 # implements memory-mapped Numpy arrays stored in BLOBs
 from soomarray import ArrayDict, ArrayFile, ArrayString, ArrayTuple,\
-                      ArrayDateTime, ArrayDate, ArrayTime, get_recode_array
+                      ArrayHeapString, ArrayHeapTuple,\
+                      ArrayDateTime, ArrayDate, ArrayTime, get_recode_array,\
+                      ArrayDateTimeOrdinal, ArrayDateOrdinal, ArrayTimeOrdinal
 import Numeric
 import MA
-from SOOMv0 import common
+from SOOMv0 import common, Utils
+from SOOMv0.Soom import soom
 
 class _BaseDataType:
     pytype = None
@@ -77,6 +99,8 @@ class _BaseDataType:
     default_coltype = 'categorical'
     masked_value = None
     soomarray_type = None
+    legacy_type = None
+    legacy_file_extension = None
     default_format_str = '%s'
     is_numeric = False
     is_datetime = False
@@ -95,6 +119,33 @@ class _BaseDataType:
     def get_mask(self, size):
         return None                     # No mask needed for this type
 
+    def get_append_array(self, filename, size):
+        if os.path.exists(filename):
+            Utils.unshare_file(filename)
+            return self.soomarray_type(filename, 'w'), self.get_mask(size)
+        return self.get_array(filename, size), self.get_mask(size)
+
+    def _legacy_filename(self, filename):
+        return '%s.%s' % (os.path.splitext(filename)[0], 
+                          self.legacy_file_extension)
+
+    def _legacy_data(self, filename):
+        """
+        If filename has not been written, but data was saved in the
+        legacy format, return the legacy array.
+        """
+        if self.legacy_type is None or os.path.exists(filename):
+            return None
+        legacy_filename = self._legacy_filename(filename)
+        if not os.path.exists(legacy_filename):
+            return None
+        return self.legacy_type(legacy_filename, 'r')
+
+    def data_exists(self, filename):
+        return (os.path.exists(filename) 
+                or (self.legacy_type is not None and
+                    os.path.exists(self._legacy_filename(filename))))
+
     def as_pytype(self, value):
         if self.pytype is None:
             return value
@@ -130,6 +181,15 @@ class _BaseDataType:
         else:
             return [data[i] for i in want]
 
+    def ordinals(self, data):
+        return data
+
+    def as_ordinal(self, value):
+        return value
+
+    def take_ordinals(self, data, want):
+        return self.ordinals(self.take(data, want))
+
     def __str__(self):
         return self.name                # Historical
 
@@ -144,6 +204,19 @@ class _NumericBaseDataType(_BaseDataType):
     def get_mask(self, size):
         return Numeric.zeros(size, typecode=MA.MaskType)
 
+    def get_append_array(self, filename, size):
+        data = self.get_array(filename, size)
+        mask = self.get_mask(size)
+        if os.path.exists(filename):
+            existing = self.load_data(filename)
+            n = len(existing)
+            if MA.isMaskedArray(existing):
+                data[:n] = existing.filled()
+                mask[:n] = MA.getmaskarray(existing)
+            else:
+                data[:n] = Numeric.asarray(existing)
+        return data, mask
+
     def store_data(self, data, mask, filename = None):
         if mask is None:
             data = Numeric.array(data, typecode=self.numeric_type)
@@ -156,8 +229,7 @@ class _NumericBaseDataType(_BaseDataType):
                 pass
             data_blob = ArrayDict(filename, 'w+')
             data_blob['data'] = data
-            del data_blob               # this writes the data to disc - 
-                                        # we really need a .sync() method...
+            data_blob.close()
             return None                 # Flag for load on demand
         else:
             return data
@@ -216,18 +288,127 @@ class FloatDataType(_NumericBaseDataType):
             return '%10.10g'
         return '%%%d.%df' % (width, decimals)
 
-class StrDataType(_BaseDataType):
+class _HeapBaseDataType(_BaseDataType):
+    """
+    Variable length values stored in a soomarray heap array. Data
+    saved by older versions (in a bsddb based legacy_type array) is
+    still read, and is migrated when the column is next written.
+    """
+    def get_array(self, filename, size):
+        if filename:
+            Utils.remove_file(self._legacy_filename(filename))
+        return _BaseDataType.get_array(self, filename, size)
+
+    def get_append_array(self, filename, size):
+        legacy = self._legacy_data(filename)
+        if legacy is None:
+            return _BaseDataType.get_append_array(self, filename, size)
+        data = self.get_array(filename, size)
+        for i, value in enumerate(legacy[:]):
+            data[i] = value
+        del legacy
+        Utils.remove_file(self._legacy_filename(filename))
+        return data, self.get_mask(size)
+
+    def store_data(self, data, mask, filename = None):
+        if filename:
+            data.flush()
+            return None                 # Flag load on demand
+        else:
+            return data
+
+    def load_data(self, filename):
+        legacy = self._legacy_data(filename)
+        if legacy is not None:
+            return legacy
+        return self.soomarray_type(filename, 'r')
+
+class StrDataType(_HeapBaseDataType):
+    """
+    Columns with few distinct values (no more than
+    soom.recode_threshold) are stored as a recode array - integer
+    codes plus a dictionary of values - rather than a heap.
+    """
     name = 'str'
     masked_value = ''
-    soomarray_type = ArrayString
-    file_extension = 'SOOMstringarray'
+    soomarray_type = ArrayHeapString
+    file_extension = 'SOOMstrheap'
+    legacy_type = ArrayString
+    legacy_file_extension = 'SOOMstringarray'
+    recode_file_extension = 'SOOMrecodearray'
+
+    def _recode_filename(self, filename):
+        return '%s.%s' % (os.path.splitext(filename)[0], 
+                          self.recode_file_extension)
+
+    def _is_low_cardinality(self, values):
+        threshold = soom.recode_threshold
+        if not threshold:
+            return False
+        distinct = {}
+        for value in values:
+            distinct[value] = None
+            if len(distinct) > threshold:
+                return False
+        return True
+
+    def get_array(self, filename, size):
+        if filename:
+            Utils.remove_file(self._recode_filename(filename))
+        return _HeapBaseDataType.get_array(self, filename, size)
+
+    def get_append_array(self, filename, size):
+        recode_filename = self._recode_filename(filename)
+        if not os.path.exists(recode_filename):
+            return _HeapBaseDataType.get_append_array(self, filename, size)
+        existing = get_recode_array(0, recode_filename)[:]
+        data = self.get_array(filename, size)
+        for i, value in enumerate(existing):
+            data[i] = value
+        return data, self.get_mask(size)
+
+    def data_exists(self, filename):
+        return (_HeapBaseDataType.data_exists(self, filename)
+                or os.path.exists(self._recode_filename(filename)))
 
-class TupleDataType(_BaseDataType):
+    def store_data(self, data, mask, filename = None):
+        if filename:
+            values = data.values
+            if data.base is not None:
+                # Rows appended to a stored heap
+                values = None
+        else:
+            values = data
+        if values is None or not self._is_low_cardinality(values):
+            return _HeapBaseDataType.store_data(self, data, mask, filename)
+        if filename:
+            recode_filename = self._recode_filename(filename)
+        else:
+            recode_filename = None
+        recoded = get_recode_array(len(values), recode_filename, 'w')
+        for i, value in enumerate(values):
+            recoded[i] = value
+        if filename:
+            recoded.close()
+            data.discard()
+            Utils.remove_file(filename)
+            return None                 # Flag load on demand
+        return recoded
+
+    def load_data(self, filename):
+        recode_filename = self._recode_filename(filename)
+        if os.path.exists(recode_filename):
+            return get_recode_array(0, recode_filename)
+        return _HeapBaseDataType.load_data(self, filename)
+
+class TupleDataType(_HeapBaseDataType):
     name = 'tuple'
     pytype = None
     masked_value = ()
-    soomarray_type = ArrayTuple
-    file_extension = 'SOOMtuplearray'
+    soomarray_type = ArrayHeapTuple
+    file_extension = 'SOOMtupleheap'
+    legacy_type = ArrayTuple
+    legacy_file_extension = 'SOOMtuplearray'
     is_multivalue = True
 
 class RecodeDataType(_BaseDataType):
@@ -235,8 +416,14 @@ class RecodeDataType(_BaseDataType):
     file_extension = 'SOOMrecodearray'
 
     def get_array(self, filename, size):
+        if filename:
+            Utils.remove_file(filename)
         return get_recode_array(size, filename, 'w')
 
+    def get_append_array(self, filename, size):
+        Utils.unshare_file(filename)
+        return get_recode_array(size, filename, 'w'), None
+
     def load_data(self, filename):
         return get_recode_array(0, filename)
 
@@ -257,32 +444,114 @@ class _DateTimeBaseDataType(_BaseDataType):
         except AttributeError:
             return str(v)
 
+    # Values are stored as a (memory mapped) vector of ordinals, and
+    # only converted to mx.DateTime objects as they are fetched.
+    def get_array(self, filename, size):
+        if filename:
+            Utils.remove_file(self._legacy_filename(filename))
+        return self.soomarray_type(size)
+
+    def get_append_array(self, filename, size):
+        data = self.soomarray_type(size)
+        existing = self._legacy_data(filename)
+        if existing is not None:
+            Utils.remove_file(self._legacy_filename(filename))
+        elif os.path.exists(filename):
+            existing = self.load_data(filename)
+        if isinstance(existing, self.soomarray_type):
+            n = len(existing)
+            data.data[:n] = existing.data
+            if existing.mask is None:
+                data.mask[:n] = 0
+            else:
+                data.mask[:n] = existing.mask
+        elif existing is not None:
+            for i, value in enumerate(existing[:]):
+                data[i] = value
+        return data, None
+
+    def store_data(self, data, mask, filename = None):
+        if not Numeric.sometrue(data.mask):
+            data.mask = None
+        if filename:
+            Utils.remove_file(filename)
+            data_blob = ArrayDict(filename, 'w+')
+            data_blob['data'] = data.ordinals()
+            data_blob.close()
+            return None                 # Flag for load on demand
+        else:
+            return data
+
+    def load_data(self, filename):
+        legacy = self._legacy_data(filename)
+        if legacy is not None:
+            return legacy
+        return self.soomarray_type(data=ArrayDict(filename, 'r')['data'])
+
+    def ordinals(self, data):
+        if isinstance(data, self.soomarray_type):
+            return data.ordinals()
+        if hasattr(data, 'typecode'):
+            return data                 # Already ordinals
+        # Values from a legacy array, or taken from a filtered column
+        array = self.soomarray_type(len(data))
+        for i, value in enumerate(data):
+            array[i] = value
+        return array.ordinals()
+
+    def as_ordinal(self, value):
+        try:
+            return self.soomarray_type.to_ordinal(value)
+        except TypeError:
+            return value
+
+    def take_ordinals(self, data, want):
+        if isinstance(data, self.soomarray_type):
+            return data.take_ordinals(want)
+        return _BaseDataType.take_ordinals(self, data, want)
+
 class DateDataType(_DateTimeBaseDataType):
     name = 'date'
-    soomarray_type = ArrayDate
-    file_extension = 'SOOMdatearray'
+    soomarray_type = ArrayDateOrdinal
+    file_extension = 'SOOMdateordinal'
+    legacy_type = ArrayDate
+    legacy_file_extension = 'SOOMdatearray'
     default_format_str = '%Y-%m-%d'
 
 class TimeDataType(_DateTimeBaseDataType):
     name = 'time'
-    soomarray_type = ArrayTime
-    file_extension = 'SOOMtimearray'
+    soomarray_type = ArrayTimeOrdinal
+    file_extension = 'SOOMtimeordinal'
+    legacy_type = ArrayTime
+    legacy_file_extension = 'SOOMtimearray'
     default_format_str = '%H:%M:%S'
 
 class DateTimeDataType(_DateTimeBaseDataType):
     name = 'datetime'
-    soomarray_type = ArrayDateTime
-    file_extension = 'SOOMdatetimearray'
+    soomarray_type = ArrayDateTimeOrdinal
+    file_extension = 'SOOMdatetimeordinal'
+    legacy_type = ArrayDateTime
+    legacy_file_extension = 'SOOMdatetimearray'
     default_coltype = 'scalar'
     default_format_str = '%Y-%m-%d %H:%M:%S'
 
 class RecodeDateDataType(DateDataType):
     name = 'recodedate'
     file_extension = 'SOOMrecodearray'
+    legacy_type = None
+
+    def store_data(self, data, mask, filename = None):
+        return _BaseDataType.store_data(self, data, mask, filename)
 
     def get_array(self, filename, size):
+        if filename:
+            Utils.remove_file(filename)
         return get_recode_array(size, filename, 'w')
 
+    def get_append_array(self, filename, size):
+        Utils.unshare_file(filename)
+        return get_recode_array(size, filename, 'w'), None
+
     def load_data(self, filename):
         return get_recode_array(0, filename)
 
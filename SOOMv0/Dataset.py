@@ -28,14 +28,14 @@ import time
 import tempfile
 import fcntl
 import errno
-import shutil
 from mx import DateTime
 from MA import Numeric
 from SOOMv0.Soom import soom
 from SOOMv0 import Utils
 from SOOMv0.BaseDataset import BaseDataset
 from SOOMv0.DatasetSummary import Summarise
-from SOOMv0.DatasetColumn import get_dataset_col
+from SOOMv0.SummaryCache import SummaryCache
+from SOOMv0.DatasetColumn import get_dataset_col, is_dataset_col
 from SOOMv0.Filter import DatasetFilters, sliced_ds
 from SOOMv0.ChunkingLoader import ChunkingLoader
 from soomarray import ArrayDict
@@ -46,14 +46,19 @@ from SOOMv0.common import *
 __all__ = 'Dataset',
 
 class Dataset(BaseDataset):
+    compress_chunks = False
+    appending = False
+    append_base = None
+
     def __init__(self, name, 
                  label=None, desc=None, path=None,
                  backed = False, 
                  rowsas = 'dict', 
-                 generations = 24, **kwargs):
+                 generations = 24, compress_chunks = False, **kwargs):
         self.generation = 0
         self.locked = False
         self.generations = generations
+        self.compress_chunks = compress_chunks
         self.path = path
         BaseDataset.__init__(self, name, label, desc, **kwargs)
         self.backed = backed
@@ -63,6 +68,7 @@ class Dataset(BaseDataset):
     def __getstate__(self):
         odict = self.__dict__.copy() # copy the dict since we may be changing it
         odict['locked'] = False
+        odict['appending'] = False
         odict['filters'] = None
         return odict
 
@@ -115,13 +121,64 @@ class Dataset(BaseDataset):
         if self.backed:
             self.assert_locked()
         BaseDataset.clear(self)
+        if self.backed:
+            SummaryCache(self).clear()
         self.date_created = DateTime.now()
         self.generation += 1
+        self.append_base = None
+        self._retire_generations()
+
+    def copy_generation(self):
+        """
+        Start a new generation sharing the current generation's
+        rows, columns, indexes and metadata. Column files are hard
+        linked rather than copied - new files are only written for
+        columns that are stored (eg, by derivedcolumn()) in the new
+        generation.
+        """
+        if not self.backed:
+            raise Error('only disc backed datasets have generations')
+        self.assert_locked()
+        self.unload()
+        src_gendir = os.path.join(self.path, self.name, str(self.generation))
+        self.generation += 1
+        self.append_base = None
+        gendir = os.path.join(self.path, self.name, str(self.generation))
+        Utils.remove_tree(gendir)
+        if os.path.isdir(src_gendir):
+            Utils.link_tree(src_gendir, gendir, 
+                            exclude=('summaries', 'filtercache'))
+        self._retire_generations()
+
+    def append_generation(self):
+        """
+        Start a new generation sharing the current generation (see
+        copy_generation()), to which the rows from subsequent
+        loaddata() calls are appended.
+        """
+        if not self.backed:
+            raise Error('rows can only be appended to disc backed datasets')
+        self.copy_generation()
+        self.append_base = self.generation - 1, self.length
+        self.appending = True
+
+    def _retire_generations(self):
+        """
+        Remove generations older than the number to be retained.
+        Files shared (hard linked) with later generations are not
+        freed until the last generation using them is removed.
+        """
         if self.backed:
             if self.generation - self.generations >= 0:
                 gendir = os.path.join(self.path, self.name,
                                     str(self.generation - self.generations))
-                shutil.rmtree(gendir, ignore_errors=True)
+                if os.path.isdir(gendir):
+                    freed, shared = Utils.remove_tree(gendir)
+                    soom.info('Dataset %r generation %d removed, %d bytes '
+                              'freed, %d bytes still in use by later '
+                              'generations' % (self.name, 
+                                    self.generation - self.generations,
+                                    freed, shared))
 
     def rename_dataset(self, newname):
         self.assert_locked()
@@ -202,6 +259,34 @@ class Dataset(BaseDataset):
         d.add('ds', SOME_DETAIL, 'Created by SOOM version', self.soom_version)
         return d
 
+    def addcolumn(self, name, **kwargs):
+        """
+        When appending (see append_generation()), adding a column
+        that already exists updates the given attributes of the
+        existing column, and leaves the rest (and the column data)
+        unchanged.
+        """
+        if (self.appending and not is_dataset_col(name) 
+            and self.has_column(name)):
+            col = self.get_column(name)
+            new_col = get_dataset_col(self, name, **kwargs)
+            if (new_col.__class__ is not col.__class__ 
+                or new_col.datatype.name != col.datatype.name):
+                raise Error('column %r is %s %s, can not append %s %s' %
+                            (name, col.coltype, col.datatype.name,
+                             new_col.coltype, new_col.datatype.name))
+            attrs = [attr for attr in kwargs if attr not in 
+                        ('coltype', 'datatype')]
+            if 'outtrans' in attrs:
+                attrs.append('use_outtrans')
+            for attr in attrs:
+                setattr(col, attr, getattr(new_col, attr))
+            self._columns_changed()
+            return col
+        col = BaseDataset.addcolumn(self, name, **kwargs)
+        self._columns_changed()
+        return col
+
     def __getitem__(self, index):
         if type(index) is int:
             return dict([(col.name, col.do_outtrans(col[index]))
@@ -214,6 +299,21 @@ class Dataset(BaseDataset):
             except KeyError:
                 raise KeyError(index)
 
+    def delete_column(self, name):
+        BaseDataset.delete_column(self, name)
+        self._columns_changed()
+
+    def rename_column(self, oldname, newname):
+        BaseDataset.rename_column(self, oldname, newname)
+        self._columns_changed()
+
+    def _columns_changed(self):
+        # Cached filter results may no longer be valid (filters don't
+        # exist yet when BaseDataset.__init__ adds the first column)
+        filters = getattr(self, 'filters', None)
+        if filters is not None:
+            filters.cache.clear()
+
     def unload(self):
         """Unload data and inverted forks for all columns."""
         for col in self.get_columns():
@@ -250,11 +350,12 @@ class Dataset(BaseDataset):
         """
         if not self.locked:
             raise Error('dataset must be locked for this operation')
-        if self.length > 0:
+        if self.length > 0 and not self.appending:
             raise Error('dataset must be empty for this operation')
         chunkdir = self.object_path('chunks', mkdirs=True)
         Utils.helpful_mkdir(chunkdir)
-        self._chunking_loader = ChunkingLoader(self.get_columns(), chunkdir)
+        self._chunking_loader = ChunkingLoader(self.get_columns(), chunkdir,
+                                               self.compress_chunks)
 
     def finalise(self):
         """
@@ -263,12 +364,16 @@ class Dataset(BaseDataset):
         form as Numpy arrays.
         """
         starttime = time.time() # a slowish operation so lets time it
-        self.length = self._chunking_loader.rownum
+        base = 0
+        if self.appending:
+            # the length before any rows were appended
+            base = self.append_base[1]
+        self.length = base + self._chunking_loader.rownum
         nproc = soom.nproc
         if nproc < 2:
             for col, data in self._chunking_loader.unchunk_columns():
                 try:
-                    col.store_column(data)
+                    col.store_column(data, base=base)
                 except:
                     print >> sys.stderr, 'While processing column %r:' % col.name
                     raise
@@ -284,7 +389,7 @@ class Dataset(BaseDataset):
                 if not pid:
                     try:
                         try:
-                            col.store_column(data)
+                            col.store_column(data, base=base)
                             os._exit(0)
                         except:
                             print >> sys.stderr, 'While processing column %r:' % col.name
@@ -303,6 +408,10 @@ class Dataset(BaseDataset):
                     raise
 
         del self._chunking_loader
+        if self.appending:
+            # Named filters only need to be applied to the new rows
+            self.filters.refilter()
+            self.appending = False
         stoptime = time.time() # how long did that take?
         elapsed = stoptime - starttime
 
@@ -315,8 +424,11 @@ class Dataset(BaseDataset):
         if initialise: # if we should initialise the DataSet object, then do so
             self.initialise()
         datasource.register_dataset_types(self.get_columns())
-        self.length = self._chunking_loader.loadrows(datasource, 
-                                                    chunkrows, rowlimit)
+        rownum = self._chunking_loader.loadrows(datasource, 
+                                                chunkrows, rowlimit)
+        if not self.appending:
+            # when appending, finalise() sets the length
+            self.length = rownum
         if finalise: # this is the last data source to be added to this DataSet
             self.finalise() # invoke finalise method
         # yup TO DO: parallelisation of data set loading
@@ -18,12 +18,14 @@
 import time
 import sets
 from SOOMv0 import Utils
+from SOOMv0 import Stats
 from SOOMv0 import SummaryStats
 from SOOMv0.common import *
 from SOOMv0.Soom import soom
 from SOOMv0.SummaryProp import calc_props
 import MA, Numeric
 import soomfunc
+import soomarray
 
 class DatasetTakeCol:
     """
@@ -31,7 +33,7 @@ class DatasetTakeCol:
     """
     def __init__(self, col, cellrows):
         if len(col.data) > 0 and len(cellrows) > 0:
-            self.data = col.take(cellrows)
+            self.data = col.take(Numeric.asarray(cellrows))
         else:
             self.data = []
         self.name = col.name
@@ -158,6 +160,8 @@ class condcol:
             res.append(repr(coalesce))
         for suppress in self.suppress:
             res.append(repr(suppress))
+        if self.order:
+            res.append(repr(self.order))
         return 'condcol(%s)' % (', '.join(res))
 
 class SummCondCol:
@@ -185,7 +189,7 @@ class SummCondCol:
                             v_rows = self.vector.pop(v)
                             agv_rows = self.vector.get(agv)
                             if agv_rows is not None:
-                                v_rows = soomfunc.union(agv_rows, v_rows)
+                                v_rows = soomarray.union(agv_rows, v_rows)
                             self.vector[agv] = v_rows
                 elif coalesce.values:
                     if coalesce.value is None:
@@ -208,7 +212,7 @@ class SummCondCol:
                     elif len(valrows) == 1:
                         self.vector[newvalue] = valrows[0]
                     else:
-                        self.vector[newvalue] = soomfunc.union(*valrows)
+                        self.vector[newvalue] = soomarray.union(*valrows)
                     if coalesce.label:
                         self.outtrans[newvalue] = coalesce.label
                     else:
@@ -310,6 +314,182 @@ class SummCondCols(list):
         return '%s(%s)' % (self.__class__.__name__, 
                            ', '.join([c.name for c in self]))
 
+class SummaryCubeLevel(object):
+    """
+    The cells of one combination of conditioning columns within
+    a SummaryCube. The CellGroups and DatasetTake are only built
+    if a stat method needs them - when the level has been rolled
+    up from the full level, "counts" and "partials" are already
+    known.
+    """
+    def __init__(self, cube, subset):
+        self.cube = cube
+        self.subset = subset
+        self.partials = {}
+        self._groups = None
+        self._extract = None
+
+    def get_groups(self):
+        if self._groups is None:
+            self._groups = Stats.CellGroups(*self.cube.cells(self.subset))
+        return self._groups
+    groups = property(get_groups)
+
+    def get_extract(self):
+        if self._extract is None:
+            rows = Numeric.take(self.cube.rows, self.groups.order)
+            self._extract = DatasetTake(self.cube.dataset, rows)
+        return self._extract
+    extract = property(get_extract)
+
+    def yield_rows(self):
+        return self.cube.yield_rows(self.subset, self.counts)
+
+class SummaryCube:
+    """
+    Summary helper that gives each row a dense code for its value
+    in each conditioning column (the position of the value in the
+    condcol's veckey_pairs). The codes for any subset of the
+    conditioning columns can then be combined into a single
+    mixed-radix cell number per row, and every cell of a summary
+    level calculated in one pass over the rows, rather than with
+    one intersection per cell.
+
+    Every row is coded for every condcol, so lower levels are
+    simply sums over axes of the full level (as per
+    CrossTab.sum_axis), and are rolled up from it rather than
+    recalculated.
+
+    Rows are numbered as in the condcol vectors, so multivalue
+    columns (where a row can appear under several values) can't
+    be coded.
+    """
+    def __init__(self, dataset, condcols, zeros):
+        self.dataset = dataset
+        self.veckey_pairs = condcols.veckey_pairs(zeros)
+        self.radices = [len(pairs) for pairs in self.veckey_pairs]
+        size = 0
+        for pairs in self.veckey_pairs:
+            for value, rows, suppress, condcol in pairs:
+                if len(rows):
+                    size = max(size, rows[-1] + 1)
+        codes = []
+        covered = Numeric.ones(size, Numeric.Int)
+        for pairs in self.veckey_pairs:
+            code = Numeric.zeros(size, Numeric.Int) - 1
+            for i, (value, rows, suppress, condcol) in enumerate(pairs):
+                if len(rows):
+                    Numeric.put(code, rows, i)
+            codes.append(code)
+            covered = Numeric.logical_and(covered, 
+                                          Numeric.greater_equal(code, 0))
+        self.rows = Numeric.nonzero(covered)
+        self.codes = [Numeric.take(code, self.rows) for code in codes]
+
+    def applicable(cls, condcols):
+        if not condcols:
+            return False
+        for col in condcols.cols():
+            if col.is_multivalue():
+                return False
+        return True
+    applicable = classmethod(applicable)
+
+    def subsets(self, levels):
+        """
+        Yields tuples of condcol indices for the requested levels,
+        in the same order as Utils.combinations().
+        """
+        indices = range(len(self.radices))
+        for level in range(len(indices) + 1):
+            if level in levels:
+                for subset in Utils.xcombinations(indices, level):
+                    yield tuple(subset)
+
+    def cells(self, subset):
+        """
+        Returns a vector of the cell number of each row for the
+        given subset of condcols, and the number of cells. Cells
+        are numbered in Utils.cross() order.
+        """
+        cells = Numeric.zeros(len(self.rows), Numeric.Int)
+        ncells = 1
+        for i in subset:
+            cells = cells * self.radices[i] + self.codes[i]
+            ncells *= self.radices[i]
+        return cells, ncells
+
+    def rollup(self, vector, subset, ufunc=Numeric.add):
+        """
+        Reduce a vector with an element for each cell of the full
+        level to the cells of the given subset of condcols.
+        """
+        data = Numeric.reshape(vector, self.radices)
+        axes = range(len(self.radices))
+        axes.reverse()
+        for axis in axes:
+            if axis not in subset:
+                data = ufunc.reduce(data, axis)
+        return Numeric.ravel(data)
+
+    def rollup_partials(self, partials, subset):
+        rolled = {}
+        for name, (ufunc, vector) in partials.items():
+            rolled[name] = ufunc, self.rollup(vector, subset, ufunc)
+        return rolled
+
+    def levels(self, levels, stat_methods):
+        """
+        Yields a SummaryCubeLevel for each combination of condcols
+        in the requested levels. If more than one is requested,
+        the cell counts and the partial aggregates of decomposable
+        stat methods are calculated once for the full level, and
+        rolled up for the others.
+        """
+        subsets = list(self.subsets(levels))
+        full = SummaryCubeLevel(self, tuple(range(len(self.radices))))
+        rollup = len(subsets) > 1 and 0 not in self.radices
+        if rollup:
+            full_counts = full.groups.counts
+            full_partials = stat_methods.calc_partials(full.groups, 
+                                                       full.extract)
+        for subset in subsets:
+            if subset == full.subset:
+                level = full
+            else:
+                level = SummaryCubeLevel(self, subset)
+            if rollup:
+                level.counts = self.rollup(full_counts, subset)
+                for statcolname, partials in full_partials.items():
+                    level.partials[statcolname] = \
+                        self.rollup_partials(partials, subset)
+            else:
+                level.counts = level.groups.counts
+            yield level
+
+    def yield_rows(self, subset, counts):
+        row = SummaryRow()
+        row.level = len(subset)
+        row.extract = None
+        type_string = ['0'] * len(self.radices)
+        for i in subset:
+            type_string[i] = '1'
+        row.type_string = type_string
+        items = Utils.cross(*[self.veckey_pairs[i] for i in subset])
+        for cell, item in enumerate(items):
+            row.suppress = False
+            colnames = []
+            colvalues = []
+            for var_val, var_rows, suppress, condcol in item:
+                colnames.append(condcol.name)
+                colvalues.append(var_val)
+                if suppress:
+                    row.suppress = True
+            row.count = counts[cell]
+            row.colnames = tuple(colnames)
+            row.colvalues = tuple(colvalues)
+            yield row
+
 class TempSummaryColumn:
     """
     Temporary column object for results of summarisation
@@ -429,41 +609,158 @@ class Summarise:
         elif self.levels is None:
             self.levels = [len(self.condcols)]
 
+    def _walk_cells(self, pairs, count_only):
+        """
+        Yields (indices, rows) for each cell of the cross product of
+        the condcol veckey_pairs lists in "pairs", in Utils.cross()
+        order. Each cell is intersected with the rows of its parent
+        prefix, which are kept on a stack, so each cell costs one
+        intersection, and peak memory is bounded by the depth times
+        the largest vector. If count_only, the final level is only
+        counted, and "rows" is the cell frequency.
+        """
+        depth = len(pairs)
+        indices = [0] * depth
+        def walk(d, prefix):
+            last = (d == depth - 1)
+            for i, pair in enumerate(pairs[d]):
+                indices[d] = i
+                rows = pair[1]
+                if d > 0 and len(prefix) == 0:
+                    rows = prefix
+                elif d > 0 and count_only and last:
+                    rows = soomarray.intersect_count(prefix, rows)
+                elif d > 0:
+                    rows = soomarray.intersect(prefix, rows)
+                if last:
+                    if count_only and type(rows) is not int:
+                        rows = len(rows)
+                    yield tuple(indices), rows
+                else:
+                    for cell in walk(d + 1, rows):
+                        yield cell
+        return walk(0, None)
+
+    def _cells(self, pairs, need_rows):
+        """
+        Yields (item, cellrows, count) for each cell of the cross
+        product of the condcol veckey_pairs lists in "pairs", in
+        Utils.cross() order. If the cell rows are not needed, the
+        columns are nested most selective (smallest average vector)
+        first so the prefixes shrink quickly, and the counts are
+        then returned in the usual order.
+        """
+        depth = len(pairs)
+        if depth == 0:
+            yield [], None, None
+            return
+        if need_rows or depth < 2:
+            for indices, rows in self._walk_cells(pairs, not need_rows):
+                item = [pairs[d][i] for d, i in enumerate(indices)]
+                if need_rows:
+                    yield item, rows, len(rows)
+                else:
+                    yield item, None, rows
+            return
+        order = []
+        for d, pair in enumerate(pairs):
+            total = 0
+            for value, rows, suppress, condcol in pair:
+                total += len(rows)
+            order.append((float(total) / max(len(pair), 1), d))
+        order.sort()
+        order = [d for size, d in order]
+        counts = {}
+        key = [0] * depth
+        for indices, count in self._walk_cells([pairs[d] for d in order], 
+                                               True):
+            for d, i in zip(order, indices):
+                key[d] = i
+            counts[tuple(key)] = count
+        for indices in Utils.cross(*[range(len(pair)) for pair in pairs]):
+            item = [pairs[d][i] for d, i in enumerate(indices)]
+            yield item, None, counts[tuple(indices)]
+
     def yield_rows(self):
         row = SummaryRow()
         isect_time = 0.0
-        for item in Utils.combinations(*self.condcols.veckey_pairs(self.zeros)):
-            row.level = len(item)
-            row.suppress = False
-            if row.level in self.levels:
-                row.type_string = ['0'] * len(self.condcols)
-                colnames = []
-                colvalues = []
-                intersect_rows = []
-                for var_val, var_rows, suppress, condcol in item:
-                    row.type_string[condcol.index] = '1'
-                    intersect_rows.append(var_rows)
-                    colnames.append(condcol.name)
-                    colvalues.append(var_val)
-                    if suppress:
-                        row.suppress = True
-                isect_start = time.time()
-                if len(intersect_rows) == 0:
-                    row.count = len(self.filtered_ds)
-                    row.extract = self.filtered_ds
-                else:
-                    if len(intersect_rows) == 1:
-                        cellrows = intersect_rows[0]
+        # Frequency-only summaries just need the size of each cell
+        need_rows = self.stat_methods.needs_rows()
+        veckey_pairs = self.condcols.veckey_pairs(self.zeros)
+        for level in range(len(veckey_pairs) + 1):
+            if level not in self.levels:
+                continue
+            for subset in Utils.xcombinations(range(len(veckey_pairs)), 
+                                              level):
+                cells = self._cells([veckey_pairs[i] for i in subset], 
+                                    need_rows)
+                while True:
+                    isect_start = time.time()
+                    try:
+                        item, cellrows, count = cells.next()
+                    except StopIteration:
+                        break
+                    isect_time += time.time() - isect_start
+                    row.level = level
+                    row.suppress = False
+                    row.type_string = ['0'] * len(self.condcols)
+                    colnames = []
+                    colvalues = []
+                    for var_val, var_rows, suppress, condcol in item:
+                        row.type_string[condcol.index] = '1'
+                        colnames.append(condcol.name)
+                        colvalues.append(var_val)
+                        if suppress:
+                            row.suppress = True
+                    if not item:
+                        row.count = len(self.filtered_ds)
+                        row.extract = self.filtered_ds
                     else:
-                        cellrows = soomfunc.intersect(*intersect_rows)
-                    row.count = len(cellrows)
-                    row.extract = DatasetTake(self.dataset, cellrows)
-                isect_time += time.time() - isect_start
-                row.colnames = tuple(colnames)
-                row.colvalues = tuple(colvalues)
-                yield row
+                        row.count = count
+                        if need_rows:
+                            row.extract = DatasetTake(self.dataset, cellrows)
+                        else:
+                            row.extract = None
+                    row.colnames = tuple(colnames)
+                    row.colvalues = tuple(colvalues)
+                    yield row
         soom.info('Summarise intersect() time: %.3f' % isect_time)
 
+    def use_cube(self):
+        """
+        Use the SummaryCube engine if the condcols can be coded
+        and all the stat methods can calculate whole levels at once.
+        """
+        return (SummaryCube.applicable(self.condcols) 
+                and self.stat_methods.cells_okay())
+
+    def yield_cube_levels(self):
+        cube_start = time.time()
+        cube = SummaryCube(self.dataset, self.condcols, self.zeros)
+        for level in cube.levels(self.levels, self.stat_methods):
+            yield level
+        soom.info('Summarise cube time: %.3f' % (time.time() - cube_start))
+
+    def _add_row(self, summaryset, row):
+        row_ordinal = len(summaryset['_freq_'].data)
+        summaryset['_freq_'].data.append(row.count)
+        summaryset['_level_'].data.append(row.level)
+        summaryset['_type_'].data.append(''.join(row.type_string))
+        summaryset['_condcols_'].data.append(row.colnames)
+        for colname, colvalue in zip(row.colnames, row.colvalues):
+            summaryset[colname].data.append(colvalue)
+        if row.suppress:
+            summaryset.suppressed_rows.append(row_ordinal)
+        if row.level != len(self.condcols):
+            mtvals = []
+            for condcol in self.condcols:
+                if condcol.name not in row.colnames:
+                    colvalue = condcol.col.all_value
+                    summaryset[condcol.name].data.append(colvalue)
+                mtvals.append(summaryset[condcol.name].data[-1])
+            summaryset.marginal_total_idx[tuple(mtvals)] = row_ordinal
+            summaryset.marginal_total_rows.append(row_ordinal)
+
     def as_dict(self):
         start_time = time.time()
 
@@ -482,32 +779,16 @@ class Summarise:
                                             'tuple', 'categorical')
         for condcol in self.condcols:
             summaryset.addcolumnfromcondcol(condcol)
-        _freq = summaryset['_freq_'].data
-        _level = summaryset['_level_'].data
-        _type = summaryset['_type_'].data
-        _condcols = summaryset['_condcols_'].data
         self.stat_methods.add_statcols(self.dataset, summaryset)
-        row_ordinal = -1
-        for row in self.yield_rows():
-            row_ordinal += 1
-            _freq.append(row.count)
-            _level.append(row.level)
-            _type.append(''.join(row.type_string))
-            _condcols.append(row.colnames)
-            for colname, colvalue in zip(row.colnames, row.colvalues):
-                summaryset[colname].data.append(colvalue)
-            if row.suppress:
-                summaryset.suppressed_rows.append(row_ordinal)
-            if row.level != len(self.condcols):
-                mtvals = []
-                for condcol in self.condcols:
-                    if condcol.name not in row.colnames:
-                        colvalue = condcol.col.all_value
-                        summaryset[condcol.name].data.append(colvalue)
-                    mtvals.append(summaryset[condcol.name].data[-1])
-                summaryset.marginal_total_idx[tuple(mtvals)] = row_ordinal
-                summaryset.marginal_total_rows.append(row_ordinal)
-            self.stat_methods.calc(summaryset, row.extract)
+        if self.use_cube():
+            for level in self.yield_cube_levels():
+                for row in level.yield_rows():
+                    self._add_row(summaryset, row)
+                self.stat_methods.calc_cells(summaryset, level)
+        else:
+            for row in self.yield_rows():
+                self._add_row(summaryset, row)
+                self.stat_methods.calc(summaryset, row.extract)
 
         if self.proportions:
             allvals = [col.all_value for col in self.condcols.cols()]
@@ -541,11 +822,23 @@ Options include:
     permanent               resulting summary dataset should
                             be written to disk.
     proportions
+    nocache                 don't use the summary cache
 
 '''
     from SOOMv0.Dataset import SummarisedDataset
+    from SOOMv0.SummaryCache import SummaryCache
 
     starttime = time.time()
+    cache = cache_key = None
+    if not kwargs.pop('nocache', False):
+        cache = SummaryCache.get(self)
+    if cache is not None:
+        cache_key = cache.key(self, args, kwargs)
+    if cache_key:
+        sumset = cache.load(cache_key)
+        if sumset is not None:
+            return sumset
+
     # Method argument parsing
     label = kwargs.pop('label', None)
 #    datasetpath = kwargs.pop('datasetpath', soom.default_object_path)
@@ -582,4 +875,6 @@ Options include:
     sumset.stat_methods = summarise.stat_methods
     sumset.nonprintcols = ('_level_', '_type_', '_condcols_')
     soom.info('summary dict into dataset took %.3f' % (time.time() - starttime))
+    if cache_key:
+        cache.save(cache_key, sumset)
     return sumset
@@ -80,11 +80,19 @@ class Datasets:
             ds.unload()
             soom.info('Dataset %r unloaded.' % dsname)
 
-    def makedataset(self, dsname, path=None, **kwargs):
+    def makedataset(self, dsname, path=None, append=False, keep=False,
+                    **kwargs):
         """
         Factory function to create a new DataSet instance (inheriting
         metadata from any existing dataset with the same name). The
         returned dataset is locked for update.
+
+        If keep is True and the dataset exists, the new generation
+        retains the existing rows, columns and indexes (sharing
+        their files with the previous generation), so individual
+        columns can be added or rederived. If append is True, rows
+        loaded with loaddata() are also appended to the existing
+        rows.
         """
         kwargs['backed'] = True
         try:
@@ -95,7 +103,12 @@ class Datasets:
             soom.info('Dataset %r created.' % dsname)
         else:
             ds.lock()
-            ds.new_generation()
+            if append:
+                ds.append_generation()
+            elif keep:
+                ds.copy_generation()
+            else:
+                ds.new_generation()
         self.datasets[dsname.lower()] = ds
         return ds
 
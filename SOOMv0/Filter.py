@@ -16,6 +16,7 @@
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/Filter.py,v $
 
 import os
+import re
 import new
 import time
 import errno
@@ -23,18 +24,95 @@ import cPickle
 
 import Numeric, RandomArray
 # implements memory-mapped Numpy arrays stored in BLOBs
+import soomarray
 from soomarray import ArrayDict, MmapArray
-import soomfunc
 
 from SOOMv0 import soomparse, Utils
 from SOOMv0.Soom import soom
 from SOOMv0.common import *
 from SOOMv0.PrintDataset import DSFormatter
+from SOOMv0.FilterCache import FilterCache
 from SOOMv0.BaseDataset import BaseDataset
 from SOOMv0.ColTypes.RowOrdinal import FilteredRowOrdinalColumn
 
 from SOOMv0.DatasetColumn import column_types
 
+class FilteredInverted(object):
+    """
+    The inverted index of a filtered column - maps each value of
+    the source column to the filtered record ids with that value.
+
+    Each value's record ids are only computed when first asked
+    for, and then remembered, so the index is cheap to obtain and
+    the keys (and their number) come straight from the source
+    column. If the filter keeps most records, the vectors are
+    computed by removing the excluded records rather than by
+    intersecting with the included ones.
+    """
+    __slots__ = ('src_col', 'record_ids', 'vectors', 'excluded')
+
+    def __init__(self, src_col, record_ids):
+        self.src_col = src_col
+        self.record_ids = record_ids
+        self.vectors = {}
+        self.excluded = None
+
+    def _filter(self, vector):
+        record_ids = self.record_ids
+        if self.excluded is None:
+            size = len(self.src_col.parent_dataset)
+            if len(record_ids) * 2 > size:
+                self.excluded = soomarray.complement(record_ids, size)
+            else:
+                self.excluded = False
+        if self.excluded is False:
+            return soomarray.intersect(vector, record_ids)
+        if len(self.excluded) == 0:
+            return vector
+        return soomarray.difference(vector, self.excluded)
+
+    def __getitem__(self, value):
+        try:
+            return self.vectors[value]
+        except KeyError:
+            vector = self._filter(self.src_col.inverted[value])
+            self.vectors[value] = vector
+            return vector
+
+    def get(self, value, default=None):
+        try:
+            return self[value]
+        except KeyError:
+            return default
+
+    def has_key(self, value):
+        return self.src_col.inverted.has_key(value)
+    __contains__ = has_key
+
+    def keys(self):
+        return self.src_col.inverted.keys()
+
+    def __len__(self):
+        return len(self.src_col.inverted)
+
+    def __iter__(self):
+        return iter(self.keys())
+    iterkeys = __iter__
+
+    def values(self):
+        return [self[value] for value in self.keys()]
+
+    def items(self):
+        return [(value, self[value]) for value in self.keys()]
+
+    def itervalues(self):
+        for value in self.keys():
+            yield self[value]
+
+    def iteritems(self):
+        for value in self.keys():
+            yield value, self[value]
+
 class FilteredColumnMixin(object):
     """
     A column proxy that presents a filtered view of the target
@@ -42,29 +120,42 @@ class FilteredColumnMixin(object):
     right, rather it is intended to be a lightweight layer on top of
     a column object (either a real column, or another filter proxy).
     """
-    __slots__ = ('_src_col','_all_record_ids')
+    __slots__ = ('_src_col','_all_record_ids','_filtered_inverted')
 
     def __init__(self, src_col, record_ids):
         self._src_col = src_col
         self._all_record_ids = record_ids
+        self._filtered_inverted = None
 
     def get_data(self):
         return self._src_col.take(self._all_record_ids)
     data = property(get_data)
 
     def get_inverted(self):
-        inverted = {}
-        for value in self._src_col.inverted.keys():
-            inverted[value] = soomfunc.intersect(self._src_col.inverted[value], 
-                                                 self._all_record_ids)
-        return inverted
+        if self._filtered_inverted is None:
+            self._filtered_inverted = FilteredInverted(self._src_col, 
+                                                       self._all_record_ids)
+        return self._filtered_inverted
     inverted = property(get_inverted)
 
+    def get_sortindex(self):
+        # The source column's sort index is in terms of its own rows
+        return None
+    sortindex = property(get_sortindex)
+
     def describe(self, detail=ALL_DETAIL):
         return self._src_col.describe(detail)
 
     def take(self, rows):
-        return self._src_col.take(Numeric.take(self._record_ids, rows))
+        return self._src_col.take(Numeric.take(self._all_record_ids, rows))
+
+    def take_ordinals(self, rows):
+        return self._src_col.take_ordinals(Numeric.take(self._all_record_ids, 
+                                                        rows))
+
+    def take_codes(self, rows):
+        return self._src_col.take_codes(Numeric.take(self._all_record_ids, 
+                                                     rows))
     
     def __len__(self):
         return len(self._all_record_ids)
@@ -89,10 +180,15 @@ for coltype in column_types:
 def get_filtered_col(col, record_ids):
     cls = filter_coltypes_map[col.__class__]
     inst = cls(col, record_ids)
+    # Shallow - attribute values (labels, outtrans, etc) are shared
+    # with the source column, not copied
     inst.__dict__.update(col.__dict__)
     return inst
 
 class FilteredDataset(BaseDataset):
+    # Names of parent columns whose proxies have not yet been created
+    _pending = ()
+
     def __init__(self, parent_dataset, record_ids, filter_label=None, **kwargs):
         m = parent_dataset.get_metadata()
         m.update(kwargs)
@@ -105,10 +201,62 @@ class FilteredDataset(BaseDataset):
         self.record_ids = record_ids
         self.filter_label = filter_label
         self.addcolumn(FilteredRowOrdinalColumn(self, record_ids))
-        for col in parent_dataset.get_columns():
-            if col.name == 'row_ordinal':
-                continue
-            self.addcolumn(get_filtered_col(col, self.record_ids))
+        # Column proxies are created as the columns are used
+        self._pending = [name for name in parent_dataset.get_column_names()
+                         if name != 'row_ordinal']
+
+    def _proxy_column(self, name):
+        col = get_filtered_col(self.parent_dataset.get_column(name), 
+                               self.record_ids)
+        self._column_dict[name] = col
+        return col
+
+    def _proxy_columns(self):
+        # Create any remaining proxies, in the parent's column order
+        if self._pending:
+            pending, self._pending = self._pending, ()
+            extra = self._column_ord[1:]
+            cols = []
+            for name in pending:
+                col = self._column_dict.get(name)
+                if col is None:
+                    col = self._proxy_column(name)
+                cols.append(col)
+            self._column_ord = self._column_ord[:1] + cols + extra
+
+    def get_column(self, name):
+        try:
+            return self._column_dict[name]
+        except KeyError:
+            if name not in self._pending:
+                raise ColumnNotFound('Unknown column %r' % (name,))
+            return self._proxy_column(name)
+
+    def has_column(self, name):
+        return name in self._column_dict or name in self._pending
+
+    def get_columns(self, names=None):
+        if names is None:
+            self._proxy_columns()
+        return BaseDataset.get_columns(self, names)
+
+    def get_column_names(self):
+        if not self._pending:
+            return BaseDataset.get_column_names(self)
+        return ([self._column_ord[0].name] + self._pending + 
+                [col.name for col in self._column_ord[1:]])
+
+    def addcolumn(self, name, **kwargs):
+        self._proxy_columns()
+        return BaseDataset.addcolumn(self, name, **kwargs)
+
+    def delete_column(self, name):
+        self._proxy_columns()
+        BaseDataset.delete_column(self, name)
+
+    def rename_column(self, oldname, newname):
+        self._proxy_columns()
+        BaseDataset.rename_column(self, oldname, newname)
 
 #    def __getattr__(self, name):
 #        if name[0] == '_':
@@ -162,6 +310,7 @@ class DatasetFilters:
     def __init__(self, dataset):
         self.dataset = dataset
         self.filters = {}
+        self.cache = FilterCache(dataset)
 
     def load_metadata(self):
         # Parent dataset has just been loaded, scan for applicable filters
@@ -203,6 +352,13 @@ class DatasetFilters:
     def filter(self, **kwargs):
         return filter_dataset(self.dataset, filters=self, **kwargs)
 
+    def refilter(self):
+        """
+        Bring all filters up to date with the dataset generation
+        """
+        for filter in self.filters.values():
+            filter.load(verbose=0)
+
 
 def filter_dataset(dataset, expr=None, name=None, label=None, 
                    kwargs=None, filters=None):
@@ -315,14 +471,31 @@ class DatasetFilter(object):
         if self.path:
             return os.path.join(self.path, 'record_ids.SOOMblobstore')
 
-    def filter(self):
+    def filter(self, base=0):
+        """
+        Evaluate the filter. If base is non-zero, only rows from
+        base on are evaluated, and the matching rows are added to
+        the existing record ids (which must all be less than base).
+        """
         starttime = time.time()
-        parser = soomparse.SoomFilterParse(self.parent_dataset, self.expr)
+        dataset = self.parent_dataset
+        rows = None
+        if base:
+            rows = Numeric.arrayrange(base, len(dataset))
+        parser = soomparse.SoomFilterParse(dataset, self.expr, rows=rows,
+                                           cache=FilterCache.get(dataset))
         record_ids = parser.filter()
         # Empty filter?
         if record_ids is None or len(record_ids) == 0:
             record_ids = []
-        self.record_ids = Numeric.array(record_ids, typecode=Numeric.Int)
+        record_ids = Numeric.array(record_ids, typecode=Numeric.Int)
+        if base:
+            if self.record_ids is None:
+                self.load_record_ids()
+            record_ids = Numeric.concatenate((Numeric.array(self.record_ids),
+                                              record_ids))
+            self.unload()
+        self.record_ids = record_ids
         del record_ids
         self.generation = self.parent_dataset.generation
         self.length = len(self.record_ids)
@@ -332,9 +505,7 @@ class DatasetFilter(object):
             # initialise a BLOB dict to hold filter record ID vector
             self.filter_blob = ArrayDict(filename, 'w+')
             self.filter_blob['vector'] = self.record_ids
-            # this syncs the data to disc - EVIL - relying on cyclic GC to
-            # reap immediately.
-            del self.filter_blob
+            self.filter_blob.close()
             # re-instate the reference to the BLOBstore
             self.filter_blob = ArrayDict(filename, 'r')
             self.record_ids = self.filter_blob['vector']
@@ -351,9 +522,32 @@ class DatasetFilter(object):
                            filter_label=self.label or self.expr, 
                            desc=self.desc)
 
+    def refilter(self):
+        """
+        Re-evaluate the filter for a new dataset generation - if
+        the generation only appended rows to the filtered
+        generation, only the appended rows need to be evaluated.
+        """
+        append_base = getattr(self.parent_dataset, 'append_base', None)
+        if (append_base and append_base[0] == self.generation
+            and (self.record_ids is not None or self.backed)
+            and not self._uses_searchabletext()):
+            self.filter(base=append_base[1])
+        else:
+            self.filter()
+
+    def _uses_searchabletext(self):
+        # Text searches return row ids from the whole column, so can't
+        # be evaluated on the appended rows alone.
+        for col in self.parent_dataset.get_columns():
+            if (col.is_searchabletext() 
+                and re.search(r'\b%s\b' % re.escape(col.name), self.expr)):
+                return True
+        return False
+
     def __len__(self):
         if self.generation != self.parent_dataset.generation:
-            self.filter()
+            self.refilter()
         return self.length
 
     def describe(self):
@@ -386,19 +580,22 @@ class DatasetFilter(object):
         and does nothing if it has.
         """
         if self.generation != self.parent_dataset.generation:
-            self.filter()
+            self.refilter()
         elif self.record_ids is None and self.backed:
-            filename = self._blobstore_filename()
-            starttime = time.time()
-            try:
-                self.filter_blob = ArrayDict(filename, 'r+')
-            except IOError, e:
-                raise IOError, "couldn't open filter \"%s\" blobstore: %s" %\
-                    (self.name, e)
-            self.record_ids = self.filter_blob["vector"]
-            elapsed = time.time() - starttime
-            if verbose: 
-                print "load_filter(): memory mapping of \"%s\" containing %d elements took %.3f seconds." % (self.name, len(self.record_ids), elapsed)
+            self.load_record_ids(verbose)
+
+    def load_record_ids(self, verbose=0):
+        filename = self._blobstore_filename()
+        starttime = time.time()
+        try:
+            self.filter_blob = ArrayDict(filename, 'r+')
+        except IOError, e:
+            raise IOError, "couldn't open filter \"%s\" blobstore: %s" %\
+                (self.name, e)
+        self.record_ids = self.filter_blob["vector"]
+        elapsed = time.time() - starttime
+        if verbose: 
+            print "load_filter(): memory mapping of \"%s\" containing %d elements took %.3f seconds." % (self.name, len(self.record_ids), elapsed)
 
     def unload(self):
         self.filter_blob = None
@@ -0,0 +1,243 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Analysis". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004,2005 Health Administration Corporation.
+#   All Rights Reserved.
+#
+# $Id$
+# $Source$
+
+"""
+Cache of evaluated filter expressions.
+
+Filter results (record id vectors) are cached per dataset, keyed by
+the normalised form of the expression (see the FilterPlan key()
+methods), so terms written in a different order, or with a
+different spelling of an operator, still hit the cache.
+Subexpressions are cached as they are evaluated: once "a and b" has
+been evaluated, "a and c" starts from the cached result for "a".
+
+Results are held in memory, up to soom.filter_cache_size bytes.
+For disc backed datasets, results larger than mmap_threshold bytes
+are written to the "filtercache" directory of the current
+generation and memory mapped, up to soom.filter_cache_disk_size
+bytes. In both cases, the least recently used entries are discarded
+first. The cache is cleared when the dataset moves to a new
+generation, or its columns change.
+"""
+
+import os
+import md5
+import errno
+import shutil
+
+from soomarray import ArrayDict, MmapArray, Bitmap
+from SOOMv0 import Utils
+from SOOMv0.Soom import soom
+
+__all__ = 'FilterCache',
+
+def _nbytes(vector):
+    if isinstance(vector, Bitmap):
+        return vector.nbytes()
+    return len(vector) * vector.itemsize()
+
+class _Entry:
+    __slots__ = ('used', 'nbytes', 'vector', 'store', 'filename')
+
+    def __init__(self, used, vector, store=None, filename=None):
+        self.used = used
+        self.nbytes = _nbytes(vector)
+        self.vector = vector
+        self.store = store
+        self.filename = filename
+
+class FilterCache:
+    """
+    Filter result cache for a dataset. Use FilterCache.get() to
+    obtain one - returns None if caching is disabled.
+    """
+    mmap_threshold = 1024 * 1024
+    suffix = '.SOOMblobstore'
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.entries = {}
+        self.generation = dataset.generation
+        self.clock = 0
+        self.hits = self.misses = 0
+
+    def get(cls, dataset):
+        if not soom.filter_cache_size:
+            return None
+        filters = getattr(dataset, 'filters', None)
+        if filters is None:
+            return None
+        cache = filters.cache
+        if cache.generation != dataset.generation:
+            cache.clear()
+            cache.generation = dataset.generation
+        return cache
+    get = classmethod(get)
+
+    def _path(self):
+        dataset = self.dataset
+        if (dataset.backed and getattr(dataset, 'path', None)
+            and not getattr(dataset, 'appending', False)):
+            return dataset.object_path('filtercache', gen=True)
+        return None
+
+    def _filename(self, key):
+        path = self._path()
+        if path:
+            return os.path.join(path, md5.new(key).hexdigest() + self.suffix)
+
+    def lookup(self, key):
+        """
+        Returns the cached result for the normalised expression
+        key, or None.
+        """
+        self.clock += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        entry.used = self.clock
+        self.hits += 1
+        return entry.vector
+
+    def _load(self, key):
+        # Saved by an earlier session?
+        filename = self._filename(key)
+        if not filename or not os.path.exists(filename):
+            return None
+        try:
+            store = ArrayDict(filename, 'r')
+            vector = store['vector']
+        except Exception, e:
+            soom.warning('filter cache %s unreadable: %s' % (filename, e))
+            return None
+        entry = self.entries[key] = _Entry(self.clock, vector, store, filename)
+        return entry
+
+    def store(self, key, vector):
+        """
+        Add the result for the normalised expression key to the
+        cache, then discard least recently used entries to keep
+        within the memory and disc budgets.
+        """
+        self.clock += 1
+        if key in self.entries:
+            return
+        entry = _Entry(self.clock, vector)
+        if (entry.nbytes >= self.mmap_threshold
+            and soom.filter_cache_disk_size
+            and not isinstance(vector, MmapArray)):
+            entry = self._save(key, vector) or entry
+        self.entries[key] = entry
+        self.evict()
+
+    def _save(self, key, vector):
+        filename = self._filename(key)
+        if not filename:
+            return None
+        try:
+            Utils.helpful_mkdir(os.path.dirname(filename))
+            store = ArrayDict(filename, 'w+')
+            store['vector'] = vector
+            store.close()
+            store = ArrayDict(filename, 'r')
+            return _Entry(self.clock, store['vector'], store, filename)
+        except (IOError, OSError), e:
+            soom.info('Filter cache not writable: %s' % e)
+            self._remove(filename)
+            return None
+
+    def _remove(self, filename):
+        try:
+            os.unlink(filename)
+        except OSError, (eno, estr):
+            if eno != errno.ENOENT:
+                raise
+
+    def _usage(self):
+        memory = disc = 0
+        for entry in self.entries.itervalues():
+            if entry.filename:
+                disc += entry.nbytes
+            else:
+                memory += entry.nbytes
+        return memory, disc
+
+    def evict(self):
+        memory, disc = self._usage()
+        entries = [(entry.used, key, entry)
+                   for key, entry in self.entries.iteritems()]
+        entries.sort()
+        for used, key, entry in entries:
+            if entry.filename:
+                if disc <= soom.filter_cache_disk_size:
+                    continue
+                disc -= entry.nbytes
+                del self.entries[key]
+                entry.vector = entry.store = None
+                self._remove(entry.filename)
+            else:
+                if memory <= soom.filter_cache_size:
+                    continue
+                memory -= entry.nbytes
+                del self.entries[key]
+
+    def clear(self):
+        """
+        Discard all cached results (the hit and miss counts are
+        retained)
+        """
+        entries, self.entries = self.entries, {}
+        for entry in entries.itervalues():
+            if entry.filename:
+                entry.vector = entry.store = None
+                self._remove(entry.filename)
+        path = self._path()
+        if path:
+            # Including any saved by earlier sessions
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        """
+        Returns a dictionary describing the cache: number of
+        entries, hits, misses, hit_rate, and bytes held in memory
+        and on disc.
+        """
+        memory, disc = self._usage()
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = 0.0
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate,
+            'memory_bytes': memory,
+            'disc_bytes': disc,
+        }
+
+    def _display_hook(self):
+        stats = self.stats()
+        print 'Filter cache for dataset %r:' % self.dataset.name
+        print '    %d entries, %d bytes in memory, %d bytes on disc' %\
+            (stats['entries'], stats['memory_bytes'], stats['disc_bytes'])
+        print '    %d hits, %d misses (%.1f%% hit rate)' %\
+            (stats['hits'], stats['misses'], stats['hit_rate'] * 100)
@@ -0,0 +1,299 @@
+# vim: set ts=4 sw=4 et:
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Analysis". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004,2005 Health Administration Corporation.
+#   All Rights Reserved.
+#
+# $Id$
+# $Source$
+
+import Numeric
+import soomarray
+from SOOMv0 import Search
+
+# A filter expression tree is built up by the parser, then planned and
+# evaluated against the dataset.
+#
+# Each node can estimate the number of rows it will select (from the
+# inverted index vector lengths of discrete columns, or a sample of
+# scalar columns), and the terms of a conjunction are evaluated most
+# selective first. The running result is passed down the tree as "rows",
+# so later terms only probe the rows that survived the earlier ones (see
+# filter_op_rows() on the column types) - a conjunction costs time roughly
+# in proportion to its most selective term, rather than its least.
+#
+# Results are row id vectors (or soomarray Bitmaps), and "rows" is either
+# None (all rows) or a sorted row id vector.
+#
+# Each node also has a normalised key - the same for equivalent
+# expressions however they were written - under which its result is
+# cached when a FilterCache is supplied. Cached subexpressions are
+# reused, rather than evaluated, and are free when planning.
+#
+# Negation is never materialised until the final result is required.
+# A node whose "negated" attribute is true returns the rows it does
+# NOT select (relative to "rows", or all rows), so "a and not b"
+# becomes a difference against the running result, De Morgan forms
+# such as "not a and not b" become the complement of a union, and a
+# double negation cancels out. Only a filter that is negative overall
+# pays for a complement, once, at the end.
+
+# Operators whose value is a set of alternatives
+_set_ops = ('op_in', 'op_not_in', 'op_in_col', 'op_not_in_col')
+
+def _rows(result):
+    # soomfunc insists all arguments have the same typecode
+    if len(result) == 0:
+        return Numeric.array([], Numeric.Int)
+    if isinstance(result, list):
+        return Numeric.array(result, Numeric.Int)
+    return result
+
+def _union(results):
+    if len(results) == 1:
+        return results[0]
+    return _rows(soomarray.union(*results))
+
+def _intersect(results):
+    if len(results) == 1:
+        return results[0]
+    return _rows(soomarray.intersect(*results))
+
+_plain_types = (str, unicode, int, long, float, bool, type(None))
+# search expressions (the value of "contains") define their own repr
+_repr_types = _plain_types + (Search.Disjunction, Search.Conjunction,
+                              Search.Phrase, Search.Word)
+
+def _key_value(value):
+    # A stable form of value for keys - the repr of some objects
+    # (mx.DateTime, for example) includes their address
+    if type(value) in (list, tuple):
+        items = ', '.join([_key_value(v) for v in value])
+        if type(value) is tuple:
+            return '(%s)' % items
+        return '[%s]' % items
+    if isinstance(value, _repr_types):
+        return repr(value)
+    return '%s(%s)' % (value.__class__.__name__, value)
+
+def _lookup(node, cache):
+    if cache is None:
+        return None
+    return cache.lookup(node.result_key())
+
+_unknown = object()
+
+def _evaluate(node, dataset, rows, filter_keys, cache, cached=_unknown):
+    # "cached" is the result of an earlier _lookup(), if already done
+    if cache is None or filter_keys:
+        return node.evaluate(dataset, rows, filter_keys, cache)
+    if cached is _unknown:
+        cached = _lookup(node, cache)
+    if cached is not None:
+        if rows is None:
+            return cached
+        return _rows(soomarray.intersect(cached, rows))
+    result = node.evaluate(dataset, rows, filter_keys, cache)
+    if rows is None:
+        # Only complete results are cached
+        cache.store(node.result_key(), result)
+    return result
+
+def _sorted_keys(nodes):
+    keys = dict.fromkeys([node.key() for node in nodes]).keys()
+    keys.sort()
+    return keys
+
+def _flatten(cls, nodes):
+    flat = []
+    for node in nodes:
+        if isinstance(node, cls):
+            flat.extend(node.nodes)
+        else:
+            flat.append(node)
+    return flat
+
+class _Node:
+    negated = False
+
+    def result_key(self):
+        # the key of the rows evaluate() returns
+        if self.negated:
+            return '(not %s)' % self.key()
+        return self.key()
+
+class Compare(_Node):
+    def __init__(self, col, op, value):
+        self.col = col
+        self.op = op
+        self.value = value
+        self._estimate = None
+
+    def key(self):
+        value = self.value
+        if self.op in _set_ops and type(value) in (list, tuple):
+            value = dict.fromkeys(value).keys()
+            value.sort()
+        return '%s %s %s' % (self.col.name, self.op, _key_value(value))
+
+    def estimate(self, dataset):
+        if self._estimate is None:
+            estimate = self.col.filter_estimate(self.op, self.value)
+            if estimate is None:
+                estimate = len(dataset)
+            self._estimate = estimate
+        return self._estimate
+
+    def evaluate(self, dataset, rows=None, filter_keys=(), cache=None):
+        if rows is None:
+            result = self.col.filter_op(self.op, self.value, filter_keys)
+        else:
+            result = self.col.filter_op_rows(self.op, self.value, rows,
+                                             filter_keys)
+        return _rows(result)
+
+    def __str__(self):
+        return '%s %s %r' % (self.col.name, self.op, self.value)
+
+class And(_Node):
+    def __init__(self, *nodes):
+        self.nodes = _flatten(And, nodes)
+        # negated only if every term is
+        self.negated = True
+        for node in self.nodes:
+            if not node.negated:
+                self.negated = False
+
+    def key(self):
+        return '(and %s)' % ' '.join(_sorted_keys(self.nodes))
+
+    def estimate(self, dataset):
+        return min([node.estimate(dataset) for node in self.nodes])
+
+    def plan(self, dataset, cache=None):
+        # most selective first, otherwise in the order given, and
+        # negated terms (which remove rows from the result) last.
+        # Returns a list of (node, cached result or None).
+        order = []
+        for i, node in enumerate(self.nodes):
+            cached = _lookup(node, cache)
+            if node.negated:
+                estimate = 0
+            elif cached is None:
+                estimate = node.estimate(dataset)
+            else:
+                estimate = len(cached)
+            order.append((node.negated, estimate, i, node, cached))
+        order.sort()
+        return [(node, cached) for negated, estimate, i, node, cached in order]
+
+    def evaluate(self, dataset, rows=None, filter_keys=(), cache=None):
+        exclude = []
+        for node, cached in self.plan(dataset, cache):
+            if rows is not None and len(rows) == 0:
+                return rows
+            result = _evaluate(node, dataset, rows, filter_keys, cache, cached)
+            if node.negated:
+                exclude.append(result)
+            else:
+                rows = result
+        if self.negated:
+            # not a and not b == not (a or b)
+            return _union(exclude)
+        if exclude and len(rows):
+            rows = _rows(soomarray.difference(rows, _union(exclude)))
+        return rows
+
+    def __str__(self):
+        return '(%s)' % ' and '.join(map(str, self.nodes))
+
+class Or(_Node):
+    def __init__(self, *nodes):
+        self.nodes = _flatten(Or, nodes)
+        # negated if any term is
+        for node in self.nodes:
+            if node.negated:
+                self.negated = True
+
+    def key(self):
+        return '(or %s)' % ' '.join(_sorted_keys(self.nodes))
+
+    def estimate(self, dataset):
+        return min(len(dataset),
+                   sum([node.estimate(dataset) for node in self.nodes]))
+
+    def evaluate(self, dataset, rows=None, filter_keys=(), cache=None):
+        include = []
+        exclude = []
+        for node in self.nodes:
+            result = _evaluate(node, dataset, rows, filter_keys, cache)
+            if node.negated:
+                exclude.append(result)
+            else:
+                include.append(result)
+        if not self.negated:
+            return _union(include)
+        # a or not b or not c == not ((b and c) and not a)
+        result = _intersect(exclude)
+        if include and len(result):
+            result = _rows(soomarray.difference(result, _union(include)))
+        return result
+
+    def __str__(self):
+        return '(%s)' % ' or '.join(map(str, self.nodes))
+
+class Not(_Node):
+    def __init__(self, node):
+        self.node = node
+        self.negated = not node.negated
+
+    def key(self):
+        return '(not %s)' % self.node.key()
+
+    def result_key(self):
+        return self.node.result_key()
+
+    def estimate(self, dataset):
+        return len(dataset) - self.node.estimate(dataset)
+
+    def evaluate(self, dataset, rows=None, filter_keys=(), cache=None):
+        # The rows the term selects are the rows this excludes, and
+        # vice versa
+        return _evaluate(self.node, dataset, rows, filter_keys, cache)
+
+    def __str__(self):
+        return 'not %s' % self.node
+
+def negate(node):
+    """
+    Returns the negation of node (cancelling a double negation)
+    """
+    if isinstance(node, Not):
+        return node.node
+    return Not(node)
+
+def evaluate(tree, dataset, rows=None, filter_keys=(), cache=None):
+    """
+    Evaluate the filter expression "tree" against "dataset",
+    returning the matching row ids. If "rows" is given, only
+    those rows are considered. If "cache" (a FilterCache) is
+    given, cached results for the expression and its
+    subexpressions are used, and new results added.
+    """
+    if rows is not None:
+        rows = _rows(rows)
+    result = _evaluate(tree, dataset, rows, filter_keys, cache)
+    if tree.negated:
+        if rows is None:
+            return _rows(soomarray.complement(result, len(dataset)))
+        return _rows(soomarray.difference(rows, result))
+    return result
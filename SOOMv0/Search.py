@@ -57,6 +57,9 @@ class Disjunction:
     def __str__(self):
         return "(%s)" % " | ".join(map(str, self.parts))
 
+    def __repr__(self):
+        return "Disjunction(%s)" % ", ".join(map(repr, self.parts))
+
 class Conjunction:
 
     # nearness masks
@@ -90,12 +93,16 @@ class Conjunction:
         raise NotImplementedError
 
     def __str__(self):
-        if nearness != self.DEFAULT_NEARNESS:
+        if self.nearness != self.DEFAULT_NEARNESS:
             op = "%s[%d]" % (self.op, self.nearness)
         else:
             op = self.op
         return "(%s %s %s)" % (self.lhs, op, self.rhs)
 
+    def __repr__(self):
+        return "Conjunction(%r, %r, %r, %r)" % (self.op, self.lhs, self.rhs,
+                                                self.nearness)
+
     def intersect(self, lhsrowwords, rhsrowwords):
         # find matching rows
         rows = soomfunc.intersect(lhsrowwords[0], rhsrowwords[0])
@@ -189,6 +196,9 @@ class Phrase:
     def __str__(self):
         return '"%s"' % ' '.join(map(str, self.words))
 
+    def __repr__(self):
+        return "Phrase(%s)" % ", ".join(map(repr, self.words))
+
 class Word:
     def __init__(self, word):
         self.word = soomfunc.strip_word(word)
@@ -234,3 +244,6 @@ class Word:
     def __str__(self):
         return self.word
 
+    def __repr__(self):
+        return "Word(%r)" % self.word
+
@@ -33,6 +33,24 @@ class Soom(object):
         row_ordinals            If True, row ordinal column is printed
         lazy_column_loading     If True, column data is loaded on demand,
                                 otherwise loaded with dataset.
+        nproc                   Number of processes used to load and
+                                store dataset columns.
+        load_membudget          Memory in bytes used to rotate rows to
+                                columns while loading before spilling
+                                to temporary chunk files.
+        summary_cache_size      Maximum size in bytes of the summary cache
+                                kept with each disc backed dataset (0 to
+                                disable).
+        filter_cache_size       Maximum size in bytes of the filter results
+                                cached in memory for each dataset (0 to
+                                disable).
+        filter_cache_disk_size  Maximum size in bytes of the (large) filter
+                                results cached on disc with each disc
+                                backed dataset.
+        recode_threshold        str columns with no more than this many
+                                distinct values are stored as integer
+                                codes plus a dictionary of values (0 to
+                                disable).
     """
 
     version_info = common.version_info
@@ -55,6 +73,11 @@ class Soom(object):
         self.searchpath = [self.default_object_path]
         self.writepath = None
         self.nproc = 1
+        self.load_membudget = 256 * 1024 * 1024
+        self.summary_cache_size = 64 * 1024 * 1024
+        self.filter_cache_size = 32 * 1024 * 1024
+        self.filter_cache_disk_size = 256 * 1024 * 1024
+        self.recode_threshold = 1000
         if os.access(self.searchpath[0], os.W_OK | os.X_OK):
             self.writepath = self.searchpath[0]
 
@@ -116,6 +139,11 @@ class Soom(object):
         print 'Informational messages (soom.messages): %s' % bool(self.messages)
         print 'Print row ordinals (soom.row_ordinals): %s' % bool(self.row_ordinals)
         print 'Lazy column loading (soom.lazy_column_loading): %s' % bool(self.lazy_column_loading)
+        print 'Load memory budget (soom.load_membudget): %d' % self.load_membudget
+        print 'Summary cache size (soom.summary_cache_size): %d' % self.summary_cache_size
+        print 'Filter cache size (soom.filter_cache_size): %d' % self.filter_cache_size
+        print 'Filter cache disc size (soom.filter_cache_disk_size): %d' % self.filter_cache_disk_size
+        print 'Recode threshold (soom.recode_threshold): %d' % self.recode_threshold
 
     def init_logger(self):
         self.logger = logging.getLogger('SOOM')
@@ -165,17 +193,33 @@ class Soom(object):
     if sys.platform == 'linux2':
         _pagesize = os.sysconf('SC_PAGESIZE')
         _lastsz = 0
+        def _statm(self):
+            f = open('/proc/%d/statm' % os.getpid())
+            try:
+                return [int(n) * self._pagesize for n in f.read().split()]
+            finally:
+                f.close()
+
+        def mem_usage(self):
+            """
+            Returns the resident size of the process in bytes, or
+            None if not known.
+            """
+            try:
+                return self._statm()[1]
+            except (IOError, IndexError, ValueError):
+                return None
+
         def mem_report(self):
             if self.messages:
-                f = open('/proc/%d/statm' % os.getpid())
-                try:
-                    statm = [int(n) * self._pagesize for n in f.read().split()]
-                finally:
-                    f.close()
+                statm = self._statm()
                 delta = statm[0] - self._lastsz
                 self._lastsz = statm[0]
-                self.info('mem delta: %dk, total: %dk' % (delta / 1024, self._lastsz / 1024))
+                self.info('mem delta: %dk, total: %dk, resident: %dk' % (delta / 1024, self._lastsz / 1024, statm[1] / 1024))
     else:
+        def mem_usage(self):
+            return None
+
         def mem_report(self):
             pass
     if 0:
@@ -26,18 +26,25 @@ __all__ = 'CSVDataSource', 'HeaderCSVDataSource'
 class CSVDataSource(TextDataSourceBase):
     """
     Iterable class to load DataSource into a DataSet from a CSV file
+
+    Quoted CSV fields may contain line breaks, so the file is only
+    split for parallel loading if parallel=True is given.
     """
+    parallel_default = False
 
     def __init__(self, name, columns, filename, **kwargs):
         # Separate csv.reader args from data source args:
-        readerkw = {}
+        self.readerkw = {}
         for arg in dir(csv.Dialect):
             if arg.startswith('_') or arg not in kwargs:
                 continue
-            readerkw[arg] = kwargs.pop(arg)
+            self.readerkw[arg] = kwargs.pop(arg)
         TextDataSourceBase.__init__(self, name, columns, filename, **kwargs)
         self.type = 'comma-separated values text file'
-        self.csv_reader = csv.reader(self.get_file_iter(), **readerkw)
+        self.open()
+
+    def open(self):
+        self.csv_reader = csv.reader(self.get_file_iter(), **self.readerkw)
         self.skip_header_rows(self.csv_reader)
 
     def next_rowdict(self):
@@ -62,10 +69,18 @@ class HeaderCSVDataSource(CSVDataSource):
     file where the first line of the csv file defines column names.
     """
 
+    header_lines = 1
+
     def __init__(self, name, columns = [], **kwargs):
         CSVDataSource.__init__(self, name, columns, **kwargs)
         self.col_map = None
 
+    def get_ranges(self, nparts):
+        # The ranges are read without the header line
+        if self.col_map is None:
+            self.col_map = self.csv_reader.next()
+        return CSVDataSource.get_ranges(self, nparts)
+
     def next_rowdict(self):
         """Method to read a row from an initialised csv data source"""
         # read a line
@@ -24,9 +24,12 @@ class ColumnDataSource(TextDataSourceBase):
     def __init__(self, name, columns, **kwargs):
         TextDataSourceBase.__init__(self, name, columns, **kwargs)
         self.type = 'columnar text file'
+        self.open()
+        self.columns = columns
+
+    def open(self):
         self.file_iter = self.get_file_iter()
         self.skip_header_rows(self.file_iter)
-        self.columns = columns
 
     def next_rowdict(self):
         """Method to read a row from an initialised data source"""
@@ -24,6 +24,7 @@ a number of DataSourceColumn instances
 
 import sys
 import os
+import zlib
 from SOOMv0.Soom import soom
 from SOOMv0.DataSourceColumn import DataSourceColumn
 
@@ -98,6 +99,18 @@ class DataSourceBase:
             m.extend([' ' * 8 + l for l in str(col).split('\n')])
         return '\n'.join(m)
 
+    def get_ranges(self, nparts):
+        """
+        Returns a list of (at most nparts) ranges that split the
+        source for parallel loading, or None if the source can't
+        be split. Each range is read by a separate process after
+        calling open_range().
+        """
+        return None
+
+    def open_range(self, range):
+        raise NotImplementedError
+
     def __iter__(self):
         return self
 
@@ -132,6 +145,81 @@ class DataSourceBase:
                     continue
             return rowdict
 
+class _RangeFile:
+    """
+    Read-only file-like object restricted to the bytes from start
+    to end of a file (offsets are relative to start).
+    """
+    def __init__(self, filepath, start, end):
+        self.f = open(filepath, 'rb')
+        self.f.seek(start)
+        self.start = start
+        self.end = end
+
+    def tell(self):
+        return self.f.tell() - self.start
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            pos = self.start + offset
+        elif whence == 1:
+            pos = self.f.tell() + offset
+        else:
+            pos = self.end + offset
+        self.f.seek(min(max(pos, self.start), self.end))
+
+    def read(self, size=-1):
+        remain = self.end - self.f.tell()
+        if size < 0 or size > remain:
+            size = remain
+        return self.f.read(size)
+
+    def readline(self):
+        remain = self.end - self.f.tell()
+        if remain <= 0:
+            return ''
+        return self.f.readline(remain)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.f.close()
+
+def gzip_members(filepath):
+    """
+    Returns the offsets of the members of a (possibly concatenated)
+    gzip file, and the size of the file.
+    """
+    f = open(filepath, 'rb')
+    try:
+        offsets = [0]
+        pos = 0
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while 1:
+            buf = f.read(1 << 20)
+            if not buf:
+                break
+            while buf:
+                try:
+                    decomp.decompress(buf)
+                except zlib.error:
+                    # Trailing garbage (eg, padding) after the last member
+                    if len(offsets) > 1:
+                        offsets.pop()
+                    return offsets, pos
+                if decomp.unused_data:
+                    buf = decomp.unused_data
+                    pos = f.tell() - len(buf)
+                    offsets.append(pos)
+                    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    pos = f.tell()
+                    buf = ''
+        return offsets, pos
+    finally:
+        f.close()
+
 class TextDataSourceBase(DataSourceBase):
     """
     Hold common methods for accessing text file DataSources.  Note:
@@ -144,16 +232,30 @@ class TextDataSourceBase(DataSourceBase):
         path            path to file which contains source data
         header_rows     number of rows to skip in source data file
                         before actual data starts
+        parallel        if True, the file can be split at line
+                        boundaries and loaded by several processes
+                        (see soom.nproc) - records must not span
+                        lines. Plain and multi-member gzip files
+                        can be split.
+
+    Subclasses implement open(), which (re)opens the file via
+    get_file_iter().
 
     TODO: other sources such as XML and DBMS data in future.
     """
+    parallel_default = True
+    header_lines = 0                    # lines read after header_rows
 
     def __init__(self, name, columns, filename, path = None,
-                 header_rows = 0, **kwargs):
+                 header_rows = 0, parallel = None, **kwargs):
         DataSourceBase.__init__(self, name, columns, **kwargs)
         self.filename = filename
         self.path = path
         self.header_rows = header_rows
+        if parallel is None:
+            parallel = self.parallel_default
+        self.parallel = parallel
+        self.byte_range = None
         self.type = 'text file'
         if self.path:
             self.filepath = os.path.join(self.path, self.filename)
@@ -164,7 +266,83 @@ class TextDataSourceBase(DataSourceBase):
         return '%s\n    Filename: %s' % \
             (DataSourceBase.__str__(self), self.filepath)
 
+    def open(self):
+        raise NotImplementedError
+
+    def get_ranges(self, nparts):
+        """
+        Split the file into (start, end, skiplines) byte ranges, at
+        line boundaries for plain files, or member boundaries for
+        gzip files.
+        """
+        if not self.parallel or nparts < 2:
+            return None
+        if self.filename.endswith('.gz'):
+            return self._gzip_ranges(nparts)
+        if (self.filename.endswith('.zip') 
+            or os.path.dirname(self.filename).endswith('.zip')):
+            return None
+        return self._line_ranges(nparts)
+
+    def _line_ranges(self, nparts):
+        f = open(self.filepath, 'rb')
+        try:
+            for n in range(self.header_rows + self.header_lines):
+                f.readline()
+            start = f.tell()
+            f.seek(0, 2)
+            end = f.tell()
+            bounds = [start]
+            for i in range(1, nparts):
+                pos = start + (end - start) * i / nparts
+                if pos <= bounds[-1]:
+                    continue
+                # Advance to the start of the next line
+                f.seek(pos - 1)
+                f.readline()
+                pos = f.tell()
+                if bounds[-1] < pos < end:
+                    bounds.append(pos)
+        finally:
+            f.close()
+        if len(bounds) < 2:
+            return None
+        bounds.append(end)
+        return [(bounds[i], bounds[i+1], 0) for i in range(len(bounds) - 1)]
+
+    def _gzip_ranges(self, nparts):
+        offsets, end = gzip_members(self.filepath)
+        bounds = [0]
+        for i in range(1, nparts):
+            pos = end * i / nparts
+            for offset in offsets:
+                if offset >= pos:
+                    if offset > bounds[-1] and offset < end:
+                        bounds.append(offset)
+                    break
+        if len(bounds) < 2:
+            return None
+        bounds.append(end)
+        ranges = [(bounds[i], bounds[i+1], 0) for i in range(len(bounds) - 1)]
+        ranges[0] = (0, bounds[1], self.header_rows + self.header_lines)
+        return ranges
+
+    def open_range(self, range):
+        self.byte_range = range
+        self.open()
+
     def get_file_iter(self):
+        if self.byte_range is not None:
+            start, end, skiplines = self.byte_range
+            f = _RangeFile(self.filepath, start, end)
+            if self.filename.endswith('.gz'):
+                import gzip
+                f = gzip.GzipFile(fileobj=f, mode='rb')
+            i = iter(f)
+            for n in range(skiplines):
+                i.next()
+            return i
+
         def _zipiter(filepath, member=None):
             try:
                 import zipfile
@@ -197,6 +375,6 @@ class TextDataSourceBase(DataSourceBase):
                 return iter(open(self.filepath))
 
     def skip_header_rows(self, i):
-        if self.header_rows:
+        if self.header_rows and self.byte_range is None:
             for n in range(self.header_rows):
                 i.next()
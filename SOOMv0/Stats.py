@@ -15,6 +15,7 @@
 # $Id: Stats.py 2626 2007-03-09 04:35:54Z andrewm $
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/SOOMv0/Stats.py,v $
 
+import sys
 import Numeric, MA, math
 
 def mask_nonpositive_weights(wgtvector):
@@ -445,21 +446,531 @@ def wn(wgtvector,exclude_nonpositive_weights=False):
 
     return float(MA.add.reduce(wgtvector))
 
+class CellGroups:
+    """
+    Partitions the rows of a summary into cells, given a vector
+    of cell numbers (0 <= cell < ncells), one per row.
 
-def quantiles(datavector,p=None,defn=5):
+    The "order" attribute is a permutation that sorts the rows
+    by cell, retaining their original order within each cell, so
+    that the rows of each cell form a contiguous segment. Vectors
+    taken in that order can then be reduced per-cell with a single
+    segmented reduction, rather than one reduction per cell.
     """
-    Returns the p quantiles of the rank-1 passed array.
+    def __init__(self, cells, ncells):
+        n = len(cells)
+        if n and ncells * n < sys.maxint:
+            # Numeric.argsort is not stable, so make the key unique
+            key = cells * n + Numeric.arrayrange(n)
+            self.order = Numeric.argsort(key)
+        else:
+            self.order = Numeric.argsort(cells)
+        self.cells = Numeric.take(cells, self.order)
+        self.ncells = ncells
+        self.offsets = Numeric.searchsorted(self.cells,
+                                            Numeric.arrayrange(ncells + 1))
+        self.counts = self.offsets[1:] - self.offsets[:-1]
+        self.nonempty = Numeric.nonzero(self.counts)
+        self.starts = Numeric.take(self.offsets, self.nonempty)
+        self.sort_cache = {}
+
+    def __len__(self):
+        return self.ncells
+
+    def reduce(self, ufunc, vector, empty=0):
+        """
+        Apply the Numeric ufunc to the segment of the (cell
+        ordered, unmasked) vector belonging to each cell, returning
+        an array with one element per cell. Empty cells are set to
+        "empty".
+        """
+        vector = Numeric.asarray(vector)
+        result = Numeric.zeros(self.ncells, vector.typecode())
+        if empty:
+            result = result + empty
+        if len(self.starts):
+            Numeric.put(result, self.nonempty,
+                        ufunc.reduceat(vector, self.starts))
+        return result
+
+    def nonmissing(self, datavector):
+        """
+        Returns an array of the number of non-missing elements of
+        the (cell ordered) datavector in each cell.
+        """
+        if MA.isMaskedArray(datavector):
+            mask = datavector.mask()
+            if mask is not None:
+                return self.reduce(Numeric.add,
+                                   Numeric.logical_not(mask).astype(Numeric.Int))
+        return self.counts
+
+def cell_wn_partials(groups, wgtvector, exclude_nonpositive_weights=False):
+    """
+    Returns the partial aggregates for wn() in each cell of
+    groups (a CellGroups instance) - wgtvector is ordered by cell.
+
+    Partial aggregates are a dictionary of name: (ufunc, array)
+    pairs, where the ufunc merges the partials of several cells
+    into one (allowing lower summary levels to be derived from
+    higher ones). See wn_from_partials().
+    """
+    if not len(wgtvector):
+        return {
+            'n': (Numeric.add, Numeric.zeros(len(groups), Numeric.Int)),
+            'sumwgt': (Numeric.add, Numeric.zeros(len(groups), Numeric.Float)),
+        }
 
-    p is a list or tuple of values between 0 and 1, 
-    a tuple of corresponding quantiles is returned.
+    if exclude_nonpositive_weights:
+        wgtvector = mask_nonpositive_weights(wgtvector)
+    else:
+        wgtvector = zero_nonpositive_weights(wgtvector)
 
-    Optional arguments are:
-    1) definitions of quantiles are as used by SAS, defaults to
-    definition 1 (as does SAS).
-    See http://v9doc.sas.com/cgi-bin/sasdoc/cgigdoc?file=../proc.hlp/tw5520statapp-formulas.htm
-    Default is 5 as used by SAS
+    n = groups.nonmissing(wgtvector)
+    if MA.isMaskedArray(wgtvector):
+        wgtvector = wgtvector.filled(0.0)
+    sumwgt = groups.reduce(Numeric.add, wgtvector.astype(Numeric.Float))
+    return {
+        'n': (Numeric.add, n),
+        'sumwgt': (Numeric.add, sumwgt),
+    }
+
+def wn_from_partials(partials):
+    """
+    Returns a list of the wn() of each cell given the partial
+    aggregates from cell_wn_partials().
+    """
+    n = partials['n'][1]
+    sumwgt = partials['sumwgt'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(float(sumwgt[i]))
+        else:
+            result.append(0)
+    return result
+
+def cell_wn(groups, wgtvector, exclude_nonpositive_weights=False):
+    """
+    Per-cell version of wn() - the first argument is a CellGroups
+    instance, and wgtvector is ordered by cell. Returns a list of
+    the sum of the non-negative weights in each cell.
+    """
+    return wn_from_partials(cell_wn_partials(groups, wgtvector, 
+                            exclude_nonpositive_weights))
+
+
+def _cell_vector(vector):
+    # Empty extracts are presented as lists
+    if not len(vector):
+        return Numeric.zeros(0, Numeric.Float)
+    return vector
+
+def _cell_filled(datavector):
+    """
+    Returns the datavector with missing values replaced by zero,
+    and a vector of 1 for each non-missing element and 0 for
+    each missing element (or None if no elements are missing).
+    """
+    if MA.isMaskedArray(datavector):
+        mask = datavector.mask()
+        data = datavector.filled(0)
+        if mask is not None:
+            return data, Numeric.logical_not(mask).astype(Numeric.Int)
+        return data, None
+    return Numeric.asarray(datavector), None
+
+def _cell_wfilled(datavector, wgtvector, exclude_nonpositive_weights):
+    """
+    Weighted version of _cell_filled() - elements are missing if
+    either the data or the weight is missing. Returns the filled
+    data and weights, and the non-missing vector.
+    """
+    datavector = _cell_vector(datavector)
+    wgtvector = _cell_vector(wgtvector)
+    assert_same_shape(datavector, wgtvector)
+
+    if exclude_nonpositive_weights:
+        wgtvector = mask_nonpositive_weights(wgtvector)
+    else:
+        wgtvector = zero_nonpositive_weights(wgtvector)
+
+    datavector = mask_where_masked(datavector, wgtvector)
+    wgtvector = mask_where_masked(wgtvector, datavector)
+    data, valid = _cell_filled(datavector)
+    wgt, valid = _cell_filled(wgtvector)
+    return data, wgt.astype(Numeric.Float), valid
+
+def _cell_count(groups, valid):
+    if valid is None:
+        return groups.counts
+    return groups.reduce(Numeric.add, valid)
+
+def cell_nonmissing_partials(groups, datavector):
+    """
+    Returns the partial aggregates for nonmissing() and missing()
+    in each cell of groups (a CellGroups instance) - datavector is
+    ordered by cell.
+
+    Partial aggregates are a dictionary of name: (ufunc, array)
+    pairs, where the ufunc merges the partials of several cells
+    into one (allowing lower summary levels to be derived from
+    higher ones). The matching *_from_partials() function returns
+    a list of the statistic for each cell.
+    """
+    data, valid = _cell_filled(_cell_vector(datavector))
+    return {
+        'n': (Numeric.add, _cell_count(groups, valid)),
+        'size': (Numeric.add, groups.counts),
+    }
+
+def cell_wnonmissing_partials(groups, datavector, wgtvector,
+                              exclude_nonpositive_weights=False):
+    data, wgt, valid = _cell_wfilled(datavector, wgtvector, 
+                                     exclude_nonpositive_weights)
+    return {
+        'n': (Numeric.add, _cell_count(groups, valid)),
+        'size': (Numeric.add, groups.counts),
+    }
+
+def nonmissing_from_partials(partials):
+    n = partials['n'][1]
+    size = partials['size'][1]
+    result = []
+    for i in range(len(n)):
+        if size[i]:
+            result.append(n[i])
+        else:
+            result.append(None)
+    return result
+
+def missing_from_partials(partials):
+    n = partials['n'][1]
+    size = partials['size'][1]
+    result = []
+    for i in range(len(n)):
+        if size[i]:
+            result.append(size[i] - n[i])
+        else:
+            result.append(None)
+    return result
+
+def cell_sum_partials(groups, datavector):
+    """
+    Returns the partial aggregates for asum() and amean() - see
+    cell_nonmissing_partials().
+    """
+    data, valid = _cell_filled(_cell_vector(datavector))
+    return {
+        'n': (Numeric.add, _cell_count(groups, valid)),
+        'sum': (Numeric.add, groups.reduce(Numeric.add, data)),
+    }
+
+def sum_from_partials(partials):
+    n = partials['n'][1]
+    sum = partials['sum'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(sum[i])
+        else:
+            result.append(None)
+    return result
+
+def mean_from_partials(partials):
+    n = partials['n'][1]
+    sum = partials['sum'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(float(sum[i])/float(n[i]))
+        else:
+            result.append(None)
+    return result
+
+def cell_wsum_partials(groups, datavector, wgtvector, 
+                       exclude_nonpositive_weights=False):
+    """
+    Returns the partial aggregates for wsum() and wamean() - see
+    cell_nonmissing_partials().
+    """
+    data, wgt, valid = _cell_wfilled(datavector, wgtvector, 
+                                     exclude_nonpositive_weights)
+    return {
+        'n': (Numeric.add, _cell_count(groups, valid)),
+        'sum': (Numeric.add, groups.reduce(Numeric.add, data * wgt)),
+        'sumwgt': (Numeric.add, groups.reduce(Numeric.add, wgt)),
+    }
+
+wsum_from_partials = sum_from_partials
+
+def wamean_from_partials(partials):
+    n = partials['n'][1]
+    sum = partials['sum'][1]
+    sumwgt = partials['sumwgt'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i] and sumwgt[i] != 0.0:
+            result.append(float(sum[i])/float(sumwgt[i]))
+        else:
+            result.append(None)
+    return result
+
+def _cell_minmax_partials(groups, data, valid):
+    if valid is None:
+        present = data
+    else:
+        present = Numeric.compress(valid, data)
+    if len(present):
+        lo = Numeric.minimum.reduce(present)
+        hi = Numeric.maximum.reduce(present)
+    else:
+        lo = hi = 0
+    # Missing values (and empty cells) are given the value that can
+    # never win, so they are ignored when partials are merged.
+    mindata = maxdata = data
+    if valid is not None:
+        mindata = Numeric.where(valid, data, hi)
+        maxdata = Numeric.where(valid, data, lo)
+    return {
+        'n': (Numeric.add, _cell_count(groups, valid)),
+        'min': (Numeric.minimum, 
+                groups.reduce(Numeric.minimum, mindata, empty=hi)),
+        'max': (Numeric.maximum, 
+                groups.reduce(Numeric.maximum, maxdata, empty=lo)),
+    }
+
+def cell_minmax_partials(groups, datavector):
+    """
+    Returns the partial aggregates for aminimum(), amaximum() and
+    arange() - see cell_nonmissing_partials().
+    """
+    data, valid = _cell_filled(_cell_vector(datavector))
+    return _cell_minmax_partials(groups, data, valid)
+
+def cell_wminmax_partials(groups, datavector, wgtvector, 
+                          exclude_nonpositive_weights=False):
+    data, wgt, valid = _cell_wfilled(datavector, wgtvector, 
+                                     exclude_nonpositive_weights)
+    return _cell_minmax_partials(groups, data, valid)
+
+def minimum_from_partials(partials):
+    n = partials['n'][1]
+    min = partials['min'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(float(min[i]))
+        else:
+            result.append(None)
+    return result
+
+def maximum_from_partials(partials):
+    n = partials['n'][1]
+    max = partials['max'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(float(max[i]))
+        else:
+            result.append(None)
+    return result
+
+def range_from_partials(partials):
+    n = partials['n'][1]
+    min = partials['min'][1]
+    max = partials['max'][1]
+    result = []
+    for i in range(len(n)):
+        if n[i]:
+            result.append(float(max[i]) - float(min[i]))
+        else:
+            result.append(None)
+    return result
+
+def _cell_moments(groups, datavector, wgtvector=None,
+                  exclude_nonpositive_weights=False):
+    """
+    Returns arrays of the number of non-missing values, the sum of
+    the weights (the number of non-missing values if unweighted),
+    the (weighted) mean and the (weighted) sum of squares about the
+    mean of each cell.
+
+    The sums of squares are taken about each cell's own mean, so
+    unlike the partial aggregates these can't be merged.
+    """
+    if wgtvector is None:
+        data, valid = _cell_filled(_cell_vector(datavector))
+        wgt = None
+    else:
+        data, wgt, valid = _cell_wfilled(datavector, wgtvector, 
+                                         exclude_nonpositive_weights)
+    data = data.astype(Numeric.Float)
+    n = _cell_count(groups, valid)
+    if wgt is None:
+        sumwgt = n.astype(Numeric.Float)
+        sum = groups.reduce(Numeric.add, data)
+    else:
+        sumwgt = groups.reduce(Numeric.add, wgt)
+        sum = groups.reduce(Numeric.add, data * wgt)
+    mean = sum / Numeric.where(Numeric.equal(sumwgt, 0.0), 1.0, sumwgt)
+    squaresaboutmean = Numeric.power(data - Numeric.take(mean, groups.cells), 2)
+    if wgt is not None:
+        squaresaboutmean = wgt * squaresaboutmean
+    elif valid is not None:
+        squaresaboutmean = valid * squaresaboutmean
+    sumsquares = groups.reduce(Numeric.add, squaresaboutmean)
+    return n, sumwgt, mean, sumsquares
+
+def cell_variance(groups, datavector, df=None):
+    """
+    Per-cell version of variance() - the first argument is a
+    CellGroups instance and datavector is ordered by cell. Returns
+    a list of the variance of each cell.
+    """
+    if df not in ('DF','N'):
+        raise ValueError, 'DF argument must be DF or N'
+
+    n, sumwgt, mean, sumsquares = _cell_moments(groups, datavector)
+    result = []
+    for i in range(len(n)):
+        if n[i] < 1 or (n[i] < 2 and df == 'DF'):
+            result.append(None)
+        elif df == 'DF':
+            result.append(sumsquares[i]/float(n[i]-1))
+        else:
+            result.append(sumsquares[i]/float(n[i]))
+    return result
+
+def cell_wvariance(groups, datavector, wgtvector, df=None,
+                   exclude_nonpositive_weights=False):
     """
+    Per-cell version of wvariance().
+    """
+    if df not in ('WDF','WEIGHT'):
+        raise ValueError, 'DF argument must be WDF or WEIGHT'
+
+    n, sumwgt, mean, sumsquares = \
+        _cell_moments(groups, datavector, wgtvector, 
+                      exclude_nonpositive_weights)
+    result = []
+    for i in range(len(n)):
+        if df == 'WDF':
+            d = float(sumwgt[i]) - 1.0
+        else:
+            d = float(sumwgt[i])
+        if n[i] < 1 or sumwgt[i] == 0.0 or d <= 0:
+            result.append(None)
+        else:
+            result.append(float(sumsquares[i])/d)
+    return result
+
+def _cell_sqrt(values):
+    result = []
+    for value in values:
+        if value is None:
+            result.append(None)
+        else:
+            result.append(value**0.5)
+    return result
+
+def cell_samplevar(groups, datavector):
+    return cell_variance(groups, datavector, df='DF')
+
+def cell_populationvar(groups, datavector):
+    return cell_variance(groups, datavector, df='N')
+
+def cell_wsamplevar(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=False):
+    return cell_wvariance(groups, datavector, wgtvector, df='WDF',
+                exclude_nonpositive_weights=exclude_nonpositive_weights)
+
+def cell_wpopulationvar(groups, datavector, wgtvector, 
+                        exclude_nonpositive_weights=False):
+    return cell_wvariance(groups, datavector, wgtvector, df='WEIGHT',
+                exclude_nonpositive_weights=exclude_nonpositive_weights)
+
+def cell_sample_stddev(groups, datavector):
+    return _cell_sqrt(cell_samplevar(groups, datavector))
+
+def cell_population_stddev(groups, datavector):
+    return _cell_sqrt(cell_populationvar(groups, datavector))
+
+def cell_wsample_stddev(groups, datavector, wgtvector, 
+                        exclude_nonpositive_weights=False):
+    return _cell_sqrt(cell_wsamplevar(groups, datavector, wgtvector, 
+                exclude_nonpositive_weights=exclude_nonpositive_weights))
+
+def cell_wpopulation_stddev(groups, datavector, wgtvector, 
+                            exclude_nonpositive_weights=False):
+    return _cell_sqrt(cell_wpopulationvar(groups, datavector, wgtvector, 
+                exclude_nonpositive_weights=exclude_nonpositive_weights))
+
+def _cell_cv(stddevs, means):
+    result = []
+    for s, mean in zip(stddevs, means):
+        if s is None or mean is None or mean == 0:
+            result.append(None)
+        else:
+            result.append((100.0 * s)/float(mean))
+    return result
+
+def cell_sample_cv(groups, datavector):
+    return _cell_cv(cell_sample_stddev(groups, datavector),
+                    mean_from_partials(cell_sum_partials(groups, datavector)))
+
+def cell_population_cv(groups, datavector):
+    return _cell_cv(cell_population_stddev(groups, datavector),
+                    mean_from_partials(cell_sum_partials(groups, datavector)))
+
+def cell_wsample_cv(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=False):
+    partials = cell_wsum_partials(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=exclude_nonpositive_weights)
+    return _cell_cv(cell_wsample_stddev(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=exclude_nonpositive_weights),
+                    wamean_from_partials(partials))
+
+def cell_wpopulation_cv(groups, datavector, wgtvector, 
+                        exclude_nonpositive_weights=False):
+    partials = cell_wsum_partials(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=exclude_nonpositive_weights)
+    return _cell_cv(cell_wpopulation_stddev(groups, datavector, wgtvector, 
+                    exclude_nonpositive_weights=exclude_nonpositive_weights),
+                    wamean_from_partials(partials))
+
+def cell_stderr(groups, datavector):
+    """
+    Per-cell version of stderr().
+    """
+    n = nonmissing_from_partials(cell_nonmissing_partials(groups, datavector))
+    result = []
+    for s2, n in zip(cell_samplevar(groups, datavector), n):
+        if s2 is None or not n:
+            result.append(None)
+        else:
+            result.append(s2**0.5 / n**0.5)
+    return result
+
+def cell_wstderr(groups, datavector, wgtvector, 
+                 exclude_nonpositive_weights=False):
+    """
+    Per-cell version of wstderr().
+    """
+    n, sumwgt, mean, sumsquares = \
+        _cell_moments(groups, datavector, wgtvector, 
+                      exclude_nonpositive_weights)
+    result = []
+    for i in range(len(n)):
+        d = float(n[i]) - 1.0
+        if n[i] < 1 or sumwgt[i] == 0.0 or d <= 0:
+            result.append(None)
+        else:
+            s2 = float(sumsquares[i])/d
+            result.append(s2**0.5 / float(sumwgt[i])**0.5)
+    return result
 
+def _quantile_pvals(p):
     p_error = "p argument must be a number between 0 and 1 (inclusive), or a list or tuple of such numbers."
     pvals = []
     for p_val in p:
@@ -470,8 +981,9 @@ def quantiles(datavector,p=None,defn=5):
         if pval < 0.0 or pval > 1.0:
             raise ValueError, p_error
         pvals.append(pval) 
-    quantiles = [None] * len(pvals)
+    return pvals
 
+def _quantile_defn(defn):
     defn_error = "defn argument must be an integer between 1 and 5 inclusive"
     try:
         defn = int(defn)
@@ -479,13 +991,39 @@ def quantiles(datavector,p=None,defn=5):
         raise ValueError, defn_error
     if defn < 1 or defn > 5:
         raise ValueError, defn_error
+    return defn
 
+def quantiles(datavector,p=None,defn=5):
+    """
+    Returns the p quantiles of the rank-1 passed array.
+
+    p is a list or tuple of values between 0 and 1, 
+    a tuple of corresponding quantiles is returned.
+
+    Optional arguments are:
+    1) definitions of quantiles are as used by SAS, defaults to
+    definition 1 (as does SAS).
+    See http://v9doc.sas.com/cgi-bin/sasdoc/cgigdoc?file=../proc.hlp/tw5520statapp-formulas.htm
+    Default is 5 as used by SAS
+    """
+
+    pvals = _quantile_pvals(p)
+    defn = _quantile_defn(defn)
 
     if MA.isMaskedArray(datavector):
         datavector = datavector.compressed()
 
     datavector = Numeric.sort(datavector)
 
+    return _sorted_quantiles(datavector, pvals, defn)
+
+def _sorted_quantiles(datavector, pvals, defn):
+    """
+    Returns the pvals quantiles of the sorted, non-missing
+    datavector.
+    """
+    quantiles = [None] * len(pvals)
+
     n = datavector.shape[0]
     if n == 0:
         return tuple(quantiles)
@@ -594,22 +1132,12 @@ def wquantiles(datavector,wgtvector,p=None,exclude_nonpositive_weights=False):
     default (False) causes treats negative weights like zero weights
     and includes them in the calculations.
     """
-    p_error = "p argument must be a number between 0 and 1 (inclusive), or a list or tuple of such numbers."
-    pvals = []
-    for p_val in p:
-        try:
-            pval = float(p_val)
-        except:
-            raise ValueError, p_error 
-        if pval < 0.0 or pval > 1.0:
-            raise ValueError, p_error
-        pvals.append(pval) 
-    quantiles = [None] * len(pvals)
+    pvals = _quantile_pvals(p)
 
     assert_same_shape(datavector, wgtvector)
 
     if datavector.shape[0] == 0:
-        return quantiles
+        return [None] * len(pvals)
 
     if exclude_nonpositive_weights:
         wgtvector = mask_nonpositive_weights(wgtvector)
@@ -622,6 +1150,15 @@ def wquantiles(datavector,wgtvector,p=None,exclude_nonpositive_weights=False):
     datavector = Numeric.take(datavector,sort_arg)
     wgtvector = Numeric.take(wgtvector,sort_arg)
 
+    return _wsorted_quantiles(datavector, wgtvector, pvals)
+
+def _wsorted_quantiles(datavector, wgtvector, pvals):
+    """
+    Returns the pvals weighted quantiles of the non-missing
+    datavector and wgtvector, sorted by datavector.
+    """
+    quantiles = [None] * len(pvals)
+
     n = datavector.shape[0]
 
     if n == 1:
@@ -677,6 +1214,129 @@ def wquantile(datavector,wgtvector,p=None,exclude_nonpositive_weights=False):
 def wmedian(datavector,wgtvector,exclude_nonpositive_weights=False):
     return wquantile(datavector,wgtvector,p=0.5,exclude_nonpositive_weights=exclude_nonpositive_weights)
 
+def _cell_sorted(groups, datavector, wgtvector=None, 
+                 exclude_nonpositive_weights=False):
+    """
+    Returns the non-missing elements of the (cell ordered)
+    datavector (and wgtvector, or None), sorted by cell and then
+    by value, and an array of the offset of each cell's segment
+    (with a final entry for the end of the last segment).
+
+    The whole column is sorted once, rather than once per cell.
+    The result is cached on groups, as several quantiles of the
+    same column are usually requested for a summary level.
+    """
+    key = id(datavector), id(wgtvector), exclude_nonpositive_weights
+    try:
+        vectors, result = groups.sort_cache[key]
+    except KeyError:
+        pass
+    else:
+        if vectors[0] is datavector and vectors[1] is wgtvector:
+            return result
+
+    if wgtvector is None:
+        data, valid = _cell_filled(_cell_vector(datavector))
+        wgt = None
+    else:
+        data, wgt, valid = _cell_wfilled(datavector, wgtvector,
+                                         exclude_nonpositive_weights)
+    counts = _cell_count(groups, valid)
+    if valid is None:
+        keep = Numeric.arrayrange(len(data))
+    else:
+        keep = Numeric.nonzero(valid)
+    values = Numeric.take(data, keep)
+    cells = Numeric.take(groups.cells, keep)
+    n = len(values)
+    byvalue = Numeric.argsort(values)
+    if n and groups.ncells * n < sys.maxint:
+        # Regroup by cell without disturbing the value order within
+        # each cell (Numeric.argsort is not stable, so make the key
+        # unique).
+        sortkey = Numeric.take(cells, byvalue) * n + Numeric.arrayrange(n)
+        order = Numeric.take(byvalue, Numeric.argsort(sortkey))
+    else:
+        order = Numeric.argsort(cells)
+        starts = Numeric.searchsorted(Numeric.take(cells, order),
+                                      Numeric.arrayrange(groups.ncells + 1))
+        segments = []
+        for i in range(groups.ncells):
+            segment = order[starts[i]:starts[i+1]]
+            segments.append(Numeric.take(segment, 
+                    Numeric.argsort(Numeric.take(values, segment))))
+        if segments:
+            order = Numeric.concatenate(segments)
+    order = Numeric.take(keep, order)
+    offsets = Numeric.zeros(groups.ncells + 1, Numeric.Int)
+    offsets[1:] = Numeric.add.accumulate(counts)
+
+    data = Numeric.take(data, order)
+    if wgt is not None:
+        wgt = Numeric.take(wgt, order)
+    result = data, wgt, offsets
+    groups.sort_cache[key] = (datavector, wgtvector), result
+    return result
+
+def cell_quantiles(groups, datavector, p=None, defn=5):
+    """
+    Per-cell version of quantiles() - the first argument is a
+    CellGroups instance, and datavector is ordered by cell.
+    Returns a list of the tuple of p quantiles of each cell.
+    """
+    pvals = _quantile_pvals(p)
+    defn = _quantile_defn(defn)
+    data, wgt, offsets = _cell_sorted(groups, datavector)
+    result = []
+    for i in range(len(groups)):
+        result.append(_sorted_quantiles(data[offsets[i]:offsets[i+1]],
+                                        pvals, defn))
+    return result
+
+def cell_quantile(groups, datavector, p=None, defn=5):
+    """
+    Per-cell version of quantile() for a single p.
+    """
+    return [q[0] for q in cell_quantiles(groups, datavector, 
+                                          p=(p,), defn=defn)]
+
+def cell_median(groups, datavector, defn=5):
+    return cell_quantile(groups, datavector, p=0.5, defn=defn)
+
+def cell_wquantiles(groups, datavector, wgtvector, p=None,
+                    exclude_nonpositive_weights=False):
+    """
+    Per-cell version of wquantiles() - the first argument is a
+    CellGroups instance, and datavector and wgtvector are ordered
+    by cell. Returns a list of the tuple of p quantiles of each
+    cell.
+    """
+    pvals = _quantile_pvals(p)
+    data, wgt, offsets = _cell_sorted(groups, datavector, wgtvector,
+                                      exclude_nonpositive_weights)
+    result = []
+    for i in range(len(groups)):
+        start, end = offsets[i], offsets[i+1]
+        if start == end:
+            result.append(tuple([None] * len(pvals)))
+        else:
+            result.append(_wsorted_quantiles(data[start:end], 
+                                             wgt[start:end], pvals))
+    return result
+
+def cell_wquantile(groups, datavector, wgtvector, p=None,
+                   exclude_nonpositive_weights=False):
+    """
+    Per-cell version of wquantile() for a single p.
+    """
+    return [q[0] for q in cell_wquantiles(groups, datavector, wgtvector, 
+                p=(p,), exclude_nonpositive_weights=exclude_nonpositive_weights)]
+
+def cell_wmedian(groups, datavector, wgtvector, 
+                 exclude_nonpositive_weights=False):
+    return cell_wquantile(groups, datavector, wgtvector, p=0.5,
+                exclude_nonpositive_weights=exclude_nonpositive_weights)
+
 def variance(datavector,df=None):
     """ 
     Returns the sample or population variance - same as variance
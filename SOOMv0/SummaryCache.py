@@ -0,0 +1,251 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Analysis". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004,2005 Health Administration Corporation.
+#   All Rights Reserved.
+#
+# $Id$
+# $Source$
+
+"""
+Persistent cache of summary datasets.
+
+The SummarisedDataset produced by summ() is pickled into the
+"summaries" directory of the current generation of the (backed)
+source dataset, keyed by a digest of everything that determines
+the result: dataset name and generation, the filter, the
+conditioning columns (with their coalesce/suppress/order
+arguments), the stat methods and the summ() options. The cache
+is bounded to soom.summary_cache_size bytes, least recently used
+entries being discarded first, and is cleared when the dataset
+moves to a new generation.
+"""
+
+import os
+import md5
+import errno
+import shutil
+import cPickle
+import tempfile
+from MA import Numeric
+from SOOMv0 import Utils
+from SOOMv0 import SummaryStats
+from SOOMv0.DatasetSummary import condcol, CondColArg
+from SOOMv0.Soom import soom
+
+__all__ = 'SummaryCache',
+
+class Uncacheable(Exception): pass
+
+def _arg_key(arg):
+    if type(arg) in (unicode, str):
+        return repr(arg)
+    if isinstance(arg, SummaryStats.applyto):
+        return '[%s]' % ', '.join([_arg_key(m) for m in arg.stat_methods])
+    if isinstance(arg, SummaryStats._SummaryStatBase):
+        return _stat_key(arg)
+    if isinstance(arg, condcol):
+        args = arg.coalesce + arg.suppress
+        if arg.order:
+            args.append(arg.order)
+        for condcolarg in args:
+            if condcolarg.callable:
+                # The repr of a callable doesn't identify its behaviour
+                raise Uncacheable
+        return repr(arg)
+    if isinstance(arg, CondColArg):
+        # Misplaced condcol argument - let Summarise report it
+        raise Uncacheable
+    return repr(arg)
+
+def _stat_key(method):
+    params = [method.__class__.__name__]
+    for attr in ('srccolname', 'wgtcolname'):
+        if hasattr(method, attr):
+            value = getattr(method, attr)
+            if value is SummaryStats._UseDefault:
+                value = None
+            params.append('%s=%r' % (attr, value))
+    params.append(repr(method.args))
+    kwargs = method.kwargs.items()
+    kwargs.sort()
+    params.append(repr(kwargs))
+    return ', '.join(params)
+
+def _filter_key(dataset, root, kwargs):
+    key = []
+    if dataset is not root:
+        # A filtered (or sliced, or sampled) dataset
+        record_ids = Numeric.asarray(dataset.record_ids)
+        key.append('record_ids=%s' %
+                    md5.new(record_ids.astype(Numeric.Int).tostring()).hexdigest())
+    if kwargs.get('nofilter'):
+        key.append('nofilter')
+        return key
+    name = kwargs.get('filtername')
+    expr = kwargs.get('filterexpr')
+    if name and expr:
+        # Defines (and saves) a named filter as a side effect
+        raise Uncacheable
+    if name:
+        try:
+            filter = root.filters.filters[name]
+        except (KeyError, AttributeError):
+            raise Uncacheable
+        expr = filter.expr
+    if expr:
+        key.append('filterexpr=%r' % expr)
+        key.append('filterlabel=%r' % kwargs.get('filterlabel'))
+    return key
+
+class SummaryCache:
+    """
+    Summary cache for a dataset. Use SummaryCache.get() to obtain
+    one - datasets that are not disc backed, or are locked for
+    update, are not cached.
+    """
+    suffix = '.pickle'
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.path = dataset.object_path('summaries', gen=True)
+
+    def get(cls, dataset):
+        root = getattr(dataset, 'parent_dataset', dataset)
+        if (not soom.summary_cache_size or not getattr(root, 'backed', False)
+            or root.locked or not root.path or root.is_summarised()):
+            return None
+        return cls(root)
+    get = classmethod(get)
+
+    def key(self, dataset, args, kwargs):
+        """
+        Returns the cache key for summ(dataset, *args, **kwargs),
+        or None if the summary can't be cached.
+        """
+        key = ['dataset=%r' % self.dataset.name,
+               'generation=%r' % self.dataset.generation]
+        try:
+            key.extend(_filter_key(dataset, self.dataset, kwargs))
+            key.extend([_arg_key(arg) for arg in args])
+        except Uncacheable:
+            return None
+        options = [(k, v) for k, v in kwargs.items()
+                   if k not in ('filtername', 'filterexpr', 'filterlabel',
+                                'nofilter')]
+        options.sort()
+        for k, v in options:
+            if callable(v):
+                return None
+            key.append('%s=%r' % (k, v))
+        return md5.new('\0'.join(key)).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def load(self, key):
+        """
+        Returns the cached SummarisedDataset for key, or None
+        """
+        filename = self._filename(key)
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                sumset = cPickle.load(f)
+            except Exception, e:
+                soom.warning('summary cache %s unreadable: %s' % (filename, e))
+                return None
+        finally:
+            f.close()
+        try:
+            # Mark as recently used
+            os.utime(filename, None)
+        except OSError:
+            pass
+        soom.info('Summary cache hit: %s' % key)
+        return sumset
+
+    def save(self, key, sumset):
+        """
+        Adds the SummarisedDataset to the cache (if the generation
+        is still current), then discards the least recently used
+        entries to keep within soom.summary_cache_size.
+        """
+        if not os.path.isdir(os.path.dirname(self.path)):
+            # Generation has been retired
+            return
+        try:
+            Utils.helpful_mkdir(self.path)
+            fd, filename = tempfile.mkstemp('', '.soom', self.path)
+        except OSError, e:
+            soom.info('Summary cache not writable: %s' % e)
+            return
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                cPickle.dump(sumset, f, -1)
+            finally:
+                f.close()
+            os.rename(filename, self._filename(key))
+        except (cPickle.PicklingError, TypeError), e:
+            soom.info('Summary not cacheable: %s' % e)
+        except (IOError, OSError), e:
+            soom.warning('Summary cache write failed: %s' % e)
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+        self.evict()
+
+    def entries(self):
+        """
+        Returns a list of (mtime, size, filename) for the cache
+        entries, least recently used first.
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+        entries.sort()
+        return entries
+
+    def evict(self, limit=None):
+        if limit is None:
+            limit = soom.summary_cache_size
+        entries = self.entries()
+        total = 0
+        for mtime, size, filename in entries:
+            total += size
+        for mtime, size, filename in entries:
+            if total <= limit:
+                break
+            try:
+                os.unlink(filename)
+            except OSError, (eno, estr):
+                if eno != errno.ENOENT:
+                    raise
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -29,6 +29,8 @@ class _UseDefault: pass
 class _SummaryStatBase:
     usage = '(col, <weightcol=...>)'
     short_label = None
+    cellstatcol_fns = None
+    cellpartial_fns = None
 
     def __init__(self, srccolname, weightcol = _UseDefault, **kwargs):
         self.srccolname = srccolname
@@ -114,6 +116,87 @@ class _SummaryStatBase:
                               default_weightcol)
         summaryset[statcolname].data.append(statdata)
 
+    def needs_rows(self, default_weightcol):
+        """
+        Does this method need the rows of each cell (rather than
+        just the cell frequency)?
+        """
+        return True
+
+    def cells_okay(self, default_weightcol):
+        """
+        Can this method calculate all the cells of a summary level
+        in one call (see calc_cells)?
+        """
+        if self.partials_okay(default_weightcol):
+            return True
+        if not self.cellstatcol_fns:
+            return False
+        wgtcolname = self.select_weightcol(default_weightcol)
+        return self.cellstatcol_fns[bool(wgtcolname)] is not None
+
+    def _calc_cells(self, statcolname, summaryset, groups, colvectors, 
+                    default_weightcol):
+        col = colvectors[self.srccolname]
+        wgtcolname = self.select_weightcol(default_weightcol)
+        cellstatcol_fn, wgtd_cellstatcol_fn = self.cellstatcol_fns
+        if wgtcolname:
+            wgtcol = colvectors[wgtcolname]
+            return wgtd_cellstatcol_fn(groups, col.data, wgtcol.data,
+                                       *self.args, **self.kwargs)
+        else:
+            return cellstatcol_fn(groups, col.data, *self.args, **self.kwargs)
+
+    def calc_cells(self, statcolname, summaryset, groups, colvectors, 
+                   default_weightcol):
+        """
+        Calculate the statistic for every cell of a summary level:
+        "groups" is a Stats.CellGroups instance, and "colvectors"
+        returns column data ordered by cell.
+        """
+        if self.partials_okay(default_weightcol):
+            partials = self.calc_partials(statcolname, groups, colvectors, 
+                                          default_weightcol)
+            self.calc_from_partials(statcolname, summaryset, partials, 
+                                    default_weightcol)
+        else:
+            statdata = self._calc_cells(statcolname, summaryset, groups, 
+                                        colvectors, default_weightcol)
+            summaryset[statcolname].data.extend(statdata)
+
+    def partials_okay(self, default_weightcol):
+        """
+        Is this method decomposable - can it calculate mergeable
+        partial aggregates for each cell (see calc_partials)?
+        """
+        if not self.cellpartial_fns:
+            return False
+        wgtcolname = self.select_weightcol(default_weightcol)
+        return self.cellpartial_fns[bool(wgtcolname)] is not None
+
+    def calc_partials(self, statcolname, groups, colvectors, 
+                      default_weightcol):
+        """
+        Returns the partial aggregates of every cell of a summary
+        level, as a dictionary of name: (ufunc, array) pairs, where
+        the ufunc merges the partials of several cells.
+        """
+        col = colvectors[self.srccolname]
+        wgtcolname = self.select_weightcol(default_weightcol)
+        if wgtcolname:
+            wgtcol = colvectors[wgtcolname]
+            partial_fn, finish_fn = self.cellpartial_fns[1]
+            return partial_fn(groups, col.data, wgtcol.data, **self.kwargs)
+        else:
+            partial_fn, finish_fn = self.cellpartial_fns[0]
+            return partial_fn(groups, col.data, **self.kwargs)
+
+    def calc_from_partials(self, statcolname, summaryset, partials, 
+                           default_weightcol):
+        wgtcolname = self.select_weightcol(default_weightcol)
+        partial_fn, finish_fn = self.cellpartial_fns[bool(wgtcolname)]
+        summaryset[statcolname].data.extend(finish_fn(partials))
+
     def __repr__(self):
         params = []
         if hasattr(self, 'srccolname'):
@@ -122,7 +205,7 @@ class _SummaryStatBase:
             params.append('wgtcolname=%r' % self.wgtcolname)
         if hasattr(self, 'args'):
             for arg in self.args:
-                params.append(repr(a))
+                params.append(repr(arg))
         for k, v in self.kwargs.items():
             params.append('%s=%r' % (k, v))
         return '%s(%s)' % (self.__class__.__name__, ', '.join(params))
@@ -199,6 +282,39 @@ class freq(_SummaryStatBase):
             summaryset[statcolname].data.append(Stats.wn(wgtcol.data, 
                                                          **self.kwargs))
 
+    def needs_rows(self, default_weightcol):
+        # Unweighted, this is just the cell frequency
+        return bool(self.select_weightcol(default_weightcol))
+
+    def cells_okay(self, default_weightcol):
+        return True
+
+    def calc_cells(self, statcolname, summaryset, groups, colvectors, 
+                   default_weightcol):
+        wgtcolname = self.select_weightcol(default_weightcol)
+        if wgtcolname:
+            wgtcol = colvectors[wgtcolname]
+            summaryset[statcolname].data.extend(Stats.cell_wn(groups,
+                                                              wgtcol.data, 
+                                                              **self.kwargs))
+
+    def partials_okay(self, default_weightcol):
+        return True
+
+    def calc_partials(self, statcolname, groups, colvectors, 
+                      default_weightcol):
+        wgtcolname = self.select_weightcol(default_weightcol)
+        if wgtcolname:
+            wgtcol = colvectors[wgtcolname]
+            return Stats.cell_wn_partials(groups, wgtcol.data, **self.kwargs)
+        return {}
+
+    def calc_from_partials(self, statcolname, summaryset, partials, 
+                           default_weightcol):
+        wgtcolname = self.select_weightcol(default_weightcol)
+        if wgtcolname:
+            summaryset[statcolname].data.extend(Stats.wn_from_partials(partials))
+
 class freqcl(freq):
     'Frequency (with confidence limits)'
     short_label = 'Frequency'
@@ -207,6 +323,15 @@ class freqcl(freq):
         freq.__init__(self, weightcol=weightcol, **kwargs)
         self.kwargs['conflev'] = self.conflev = conflev
 
+    def needs_rows(self, default_weightcol):
+        return True
+
+    def cells_okay(self, default_weightcol):
+        return False
+
+    def partials_okay(self, default_weightcol):
+        return False
+
     def add_statcol(self, dataset, statcolname, summaryset, default_weightcol):
         label = self.get_label(dataset, default_weightcol)
         wgtcolname = self.select_weightcol(default_weightcol)
@@ -239,12 +364,16 @@ class asum(_SummaryStatBase):
 
     name_fmt = 'sum_of_%s'
     statcol_fns = Stats.asum, Stats.wsum
+    cellpartial_fns = ((Stats.cell_sum_partials, Stats.sum_from_partials),
+                       (Stats.cell_wsum_partials, Stats.wsum_from_partials))
 
 class mean(_SummaryStatBase):
     'Mean'
 
     name_fmt = 'mean_of_%s'
     statcol_fns = Stats.amean, Stats.wamean
+    cellpartial_fns = ((Stats.cell_sum_partials, Stats.mean_from_partials),
+                       (Stats.cell_wsum_partials, Stats.wamean_from_partials))
 
 class meancl(_CISummaryStatBase):
     'Mean (with confidence limits)'
@@ -264,30 +393,44 @@ class minimum(_SummaryStatBase):
 
     name_fmt = 'minimum_of_%s'
     statcol_fns = Stats.aminimum, Stats.wminimum
+    cellpartial_fns = ((Stats.cell_minmax_partials, 
+                            Stats.minimum_from_partials),
+                       (Stats.cell_wminmax_partials, 
+                            Stats.minimum_from_partials))
 
 class maximum(_SummaryStatBase):
     'Maximum'
 
     name_fmt = 'maximum_of_%s'
     statcol_fns = Stats.amaximum, Stats.wmaximum
+    cellpartial_fns = ((Stats.cell_minmax_partials, 
+                            Stats.maximum_from_partials),
+                       (Stats.cell_wminmax_partials, 
+                            Stats.maximum_from_partials))
 
 class arange(_SummaryStatBase):
     'Range'
 
     name_fmt = 'range_of_%s'
     statcol_fns = Stats.arange, Stats.wrange
+    cellpartial_fns = ((Stats.cell_minmax_partials, 
+                            Stats.range_from_partials),
+                       (Stats.cell_wminmax_partials, 
+                            Stats.range_from_partials))
 
 class median(_SummaryStatBase):
     'Median'
 
     name_fmt = 'median_of_%s'
     statcol_fns = Stats.median, Stats.wmedian
+    cellstatcol_fns = Stats.cell_median, Stats.cell_wmedian
 
 class p10(_SummaryStatBase):
     '10th Percentile'
 
     name_fmt = 'p10_of_%s'
     statcol_fns = Stats.quantile, Stats.wquantile
+    cellstatcol_fns = Stats.cell_quantile, Stats.cell_wquantile
 
     def __init__(self, srccolname, **kwargs):
         _SummaryStatBase.__init__(self, srccolname, **kwargs)
@@ -299,6 +442,7 @@ class p25(_SummaryStatBase):
 
     name_fmt = 'p25_of_%s'
     statcol_fns = Stats.quantile, Stats.wquantile
+    cellstatcol_fns = Stats.cell_quantile, Stats.cell_wquantile
 
     def __init__(self, srccolname, **kwargs):
         _SummaryStatBase.__init__(self, srccolname, **kwargs)
@@ -310,6 +454,7 @@ class p75(_SummaryStatBase):
 
     name_fmt = 'p75_of_%s'
     statcol_fns = Stats.quantile, Stats.wquantile
+    cellstatcol_fns = Stats.cell_quantile, Stats.cell_wquantile
 
     def __init__(self, srccolname, **kwargs):
         _SummaryStatBase.__init__(self, srccolname, **kwargs)
@@ -321,6 +466,7 @@ class p90(_SummaryStatBase):
 
     name_fmt = 'p90_of_%s'
     statcol_fns = Stats.quantile, Stats.wquantile
+    cellstatcol_fns = Stats.cell_quantile, Stats.cell_wquantile
 
     def __init__(self, srccolname, **kwargs):
         _SummaryStatBase.__init__(self, srccolname, **kwargs)
@@ -331,6 +477,7 @@ class quantile(_SummaryStatBase):
     'Percentile'
 
     statcol_fns = Stats.quantile, Stats.wquantile
+    cellstatcol_fns = Stats.cell_quantile, Stats.cell_wquantile
 
     def __init__(self, srccolname, p, **kwargs):
         _SummaryStatBase.__init__(self, srccolname, **kwargs)
@@ -348,54 +495,70 @@ class samplevar(_SummaryStatBase):
 
     name_fmt = 'samplevar_of_%s'
     statcol_fns = Stats.samplevar, Stats.wsamplevar
+    cellstatcol_fns = Stats.cell_samplevar, Stats.cell_wsamplevar
 
 class popvar(_SummaryStatBase):
     'Population Variance'
 
     name_fmt = 'popvar_of_%s'
     statcol_fns = Stats.populationvar, Stats.wpopulationvar
+    cellstatcol_fns = Stats.cell_populationvar, Stats.cell_wpopulationvar
 
 class stddev(_SummaryStatBase):
     'Sample Standard Deviation'
 
     name_fmt = 'samplestddev_of_%s'
     statcol_fns = Stats.sample_stddev, Stats.wsample_stddev
+    cellstatcol_fns = Stats.cell_sample_stddev, Stats.cell_wsample_stddev
 
 class popstddev(_SummaryStatBase):
     'Population Standard Deviation'
 
     name_fmt = 'popstddev_of_%s'
     statcol_fns = Stats.population_stddev, Stats.wpopulation_stddev
+    cellstatcol_fns = (Stats.cell_population_stddev, 
+                       Stats.cell_wpopulation_stddev)
 
 class samplecv(_SummaryStatBase):
     'Sample Co-efficient of Variation'
 
     name_fmt = 'samplecv_of_%s'
     statcol_fns = Stats.sample_cv, Stats.wsample_cv
+    cellstatcol_fns = Stats.cell_sample_cv, Stats.cell_wsample_cv
 
 class popcv(_SummaryStatBase):
     'Population Co-efficient of Variation'
 
     name_fmt = 'popcv_of_%s'
     statcol_fns = Stats.population_cv, Stats.wpopulation_cv
+    cellstatcol_fns = Stats.cell_population_cv, Stats.cell_wpopulation_cv
 
 class stderr(_SummaryStatBase):
     'Standard Error'
 
     name_fmt = 'stderr_of_%s'
     statcol_fns = Stats.stderr, Stats.wstderr
+    cellstatcol_fns = Stats.cell_stderr, Stats.cell_wstderr
 
 class nonmissing(_SummaryStatBase):
     'Count of non-missing values'
 
     name_fmt = 'nonmissing_of_%s'
     statcol_fns = Stats.nonmissing, Stats.wnonmissing
+    cellpartial_fns = ((Stats.cell_nonmissing_partials, 
+                            Stats.nonmissing_from_partials),
+                       (Stats.cell_wnonmissing_partials, 
+                            Stats.nonmissing_from_partials))
 
 class missing(_SummaryStatBase):
     'Count of missing values'
 
     name_fmt = 'missing_of_%s'
     statcol_fns = Stats.missing, Stats.wmissing
+    cellpartial_fns = ((Stats.cell_nonmissing_partials, 
+                            Stats.missing_from_partials),
+                       (Stats.cell_wnonmissing_partials, 
+                            Stats.missing_from_partials))
 
 class studentt(_SummaryStatBase):
     'Student\'s T'
@@ -460,6 +623,49 @@ class StatMethods:
             stat_method.calc(statcolname, summaryset, colvectors, 
                              self.default_weightcol)
 
+    def needs_rows(self):
+        """
+        Do any methods need the rows of each cell (rather than
+        just the cell frequency)?
+        """
+        for statcolname, stat_method in self:
+            if stat_method.needs_rows(self.default_weightcol):
+                return True
+        return False
+
+    def cells_okay(self):
+        for statcolname, stat_method in self:
+            if not stat_method.cells_okay(self.default_weightcol):
+                return False
+        return True
+
+    def calc_partials(self, groups, colvectors):
+        """
+        Returns a dictionary of the partial aggregates of each
+        decomposable method, keyed by statcolname.
+        """
+        partials = {}
+        for statcolname, stat_method in self:
+            if stat_method.partials_okay(self.default_weightcol):
+                partials[statcolname] = \
+                    stat_method.calc_partials(statcolname, groups, colvectors,
+                                              self.default_weightcol)
+        return partials
+
+    def calc_cells(self, summaryset, level):
+        """
+        Calculate every cell of a summary level (a SummaryCubeLevel),
+        from rolled up partial aggregates where available.
+        """
+        for statcolname, stat_method in self:
+            if level.partials.has_key(statcolname):
+                stat_method.calc_from_partials(statcolname, summaryset,
+                                               level.partials[statcolname],
+                                               self.default_weightcol)
+            else:
+                stat_method.calc_cells(statcolname, summaryset, level.groups,
+                                       level.extract, self.default_weightcol)
+
 def extract(args, default_weightcol = None):
     args_remain = []
     stat_methods = StatMethods(default_weightcol)
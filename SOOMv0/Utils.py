@@ -21,6 +21,8 @@ import textwrap  # used to wrap column headings
 import errno
 import os
 import copy
+import shutil
+import tempfile
 import sets
 from SOOMv0 import common
 
@@ -302,6 +304,92 @@ def helpful_mkdir(path):
         if eno != errno.EEXIST:
             raise OSError(eno, '%s: mkdir %s' % (estr, path))
 
+def remove_file(filename):
+    """
+    Remove filename if it exists - files that are about to be
+    rewritten are removed first so that a new file is created,
+    rather than a file shared with another dataset generation
+    (see link_tree) being overwritten.
+    """
+    try:
+        os.unlink(filename)
+    except OSError, (eno, estr):
+        if eno != errno.ENOENT:
+            raise
+
+def unshare_file(filename):
+    """
+    If filename is hard linked (shared with another dataset
+    generation), replace it with a private copy, so it can be
+    modified in place.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError, (eno, estr):
+        if eno == errno.ENOENT:
+            return
+        raise
+    if st.st_nlink > 1:
+        fd, tmpname = tempfile.mkstemp('', '.soom', os.path.dirname(filename))
+        os.close(fd)
+        try:
+            shutil.copy2(filename, tmpname)
+            os.rename(tmpname, filename)
+        except:
+            remove_file(tmpname)
+            raise
+
+def link_tree(src, dst, exclude=()):
+    """
+    Recreate the directory tree src at dst, with the files hard
+    linked rather than copied (files are copied if they can't be
+    linked, eg on another file system). Names in exclude are
+    skipped.
+    """
+    helpful_mkdir(dst)
+    for name in os.listdir(src):
+        if name in exclude:
+            continue
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if os.path.isdir(srcname) and not os.path.islink(srcname):
+            link_tree(srcname, dstname)
+        else:
+            try:
+                os.link(srcname, dstname)
+            except OSError:
+                shutil.copy2(srcname, dstname)
+
+def remove_tree(path):
+    """
+    Remove the directory tree at path, returning the number of
+    bytes freed, and the number of bytes in files that remain
+    linked from elsewhere (and so were not freed).
+    """
+    freed = shared = 0
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(filename)
+                os.unlink(filename)
+            except OSError:
+                continue
+            if st.st_nlink > 1:
+                shared += st.st_size
+            else:
+                freed += st.st_size
+        for name in dirnames:
+            try:
+                os.rmdir(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+    return freed, shared
+
 def assert_args_exhausted(args = None, kwargs = None):
     if args is not None and args:
         raise common.Error('Unknown argument(s): %s' % 
@@ -15,7 +15,7 @@
 #
 
 import Numeric
-import soomfunc
+import FilterPlan
 import mx.DateTime
 import Search
 %%
@@ -192,19 +192,19 @@ parser soomparse:
 
     # An expression is the logical "or" of factors
     rule expr:        factor                    {{ f = factor }}
-                      ( "or" factor             {{ f = soomfunc.union(f, factor) }}
+                      ( "or" factor             {{ f = FilterPlan.Or(f, factor) }}
                       )*                        {{ return f }}
 
     # A factor is the logical "and" of comparisons, ("and" has higher precedence than "or")
     rule factor:      comparison                {{ f = comparison }}
-                      ( "and" comparison        {{ f = soomfunc.intersect(f, comparison) }}
+                      ( "and" comparison        {{ f = FilterPlan.And(f, comparison) }}
                       )*                        {{ return f }}
 
     # A comparison is the comparison of terms
-                                                # the real work's done here
-    rule comparison:  col op term               {{ return col.filter_op(op, term, self.filter_keys) }}
+                                                # (evaluated by FilterPlan once parsed)
+    rule comparison:  col op term               {{ return FilterPlan.Compare(col, op, term) }}
                     | "\\(" expr "\\)"          {{ return expr }}
-                    | "not" comparison          {{ return soomfunc.outersect(Numeric.arrayrange(len(self.dataset)), comparison) }}
+                    | "not" comparison          {{ return FilterPlan.negate(comparison) }}
 
     # A term is either a number or an expression surrounded by parentheses
     rule term:        INT                       {{ return int(INT) }}
@@ -357,12 +357,23 @@ def relativeDate(years=None, months=None, days=None, align=None):
     return mx.DateTime.now() + mx.DateTime.RelativeDateTime(**kwargs)
 
 class SoomFilterParse(soomparse):
-    def __init__(self, dataset, expr, filter_keys=()):
+    """
+    Parse the filter expression into a FilterPlan tree, and
+    evaluate it against the dataset. If "rows" is given, only
+    those rows are considered. If "cache" is given, it is a
+    FilterCache of results for the dataset.
+    """
+    def __init__(self, dataset, expr, filter_keys=(), rows=None, cache=None):
         self.dataset = dataset
         self.filter_keys = filter_keys
         self.__expr = expr
         soomparse.__init__(self, soomparseScanner(expr))
-        self.__filter = wrap_error_reporter(self, 'goal')
+        self.tree = wrap_error_reporter(self, 'goal')
+        if self.tree is None:
+            self.__filter = None
+        else:
+            self.__filter = FilterPlan.evaluate(self.tree, dataset, rows, 
+                                                filter_keys, cache)
 
     def filter(self):
         # XXX probably want to build the return type here
@@ -15,7 +15,7 @@
 #
 
 import Numeric
-import soomfunc
+import FilterPlan
 import mx.DateTime
 import Search
 
@@ -568,7 +568,7 @@ class soomparse(Parser):
         while self._peek('"or"', 'END', '"\\\\)"') == '"or"':
             self._scan('"or"')
             factor = self.factor()
-            f = soomfunc.union(f, factor)
+            f = FilterPlan.Or(f, factor)
         return f
 
     def factor(self):
@@ -577,7 +577,7 @@ class soomparse(Parser):
         while self._peek('"and"', '"or"', 'END', '"\\\\)"') == '"and"':
             self._scan('"and"')
             comparison = self.comparison()
-            f = soomfunc.intersect(f, comparison)
+            f = FilterPlan.And(f, comparison)
         return f
 
     def comparison(self):
@@ -586,7 +586,7 @@ class soomparse(Parser):
             col = self.col()
             op = self.op()
             term = self.term()
-            return col.filter_op(op, term, self.filter_keys)
+            return FilterPlan.Compare(col, op, term)
         elif _token_ == '"\\\\("':
             self._scan('"\\\\("')
             expr = self.expr()
@@ -595,7 +595,7 @@ class soomparse(Parser):
         else:# == '"not"'
             self._scan('"not"')
             comparison = self.comparison()
-            return soomfunc.outersect(Numeric.arrayrange(len(self.dataset)), comparison)
+            return FilterPlan.negate(comparison)
 
     def term(self):
         _token_ = self._peek('INT', 'FLOAT', 'STR', '"\\\\[\\\\["', '"\\\\("', '"date"', '"reldate"')
@@ -850,12 +850,23 @@ def relativeDate(years=None, months=None, days=None, align=None):
     return mx.DateTime.now() + mx.DateTime.RelativeDateTime(**kwargs)
 
 class SoomFilterParse(soomparse):
-    def __init__(self, dataset, expr, filter_keys=()):
+    """
+    Parse the filter expression into a FilterPlan tree, and
+    evaluate it against the dataset. If "rows" is given, only
+    those rows are considered. If "cache" is given, it is a
+    FilterCache of results for the dataset.
+    """
+    def __init__(self, dataset, expr, filter_keys=(), rows=None, cache=None):
         self.dataset = dataset
         self.filter_keys = filter_keys
         self.__expr = expr
         soomparse.__init__(self, soomparseScanner(expr))
-        self.__filter = wrap_error_reporter(self, 'goal')
+        self.tree = wrap_error_reporter(self, 'goal')
+        if self.tree is None:
+            self.__filter = None
+        else:
+            self.__filter = FilterPlan.evaluate(self.tree, dataset, rows, 
+                                                filter_keys, cache)
 
     def filter(self):
         # XXX probably want to build the return type here
@@ -66,6 +66,44 @@ static PyObject *BlobStore_free(BlobStoreObject *self, PyObject *args)
     return Py_None;
 }
 
+static char BlobStore_reserve__doc__[] = 
+"reserve(nbytes, nblobs) -> None";
+
+static PyObject *BlobStore_reserve(BlobStoreObject *self, PyObject *args)
+{
+    int nbytes, nblobs;
+
+    if (!PyArg_ParseTuple(args, "ii", &nbytes, &nblobs))
+	return NULL;
+
+    if (nbytes < 0) {
+	PyErr_SetString(PyExc_ValueError, "nbytes must not be negative");
+	return NULL;
+    }
+    if (store_reserve(self->sm, nbytes, nblobs) < 0)
+	return NULL;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static char BlobStore_sync__doc__[] = 
+"sync([fsync]) -> None";
+
+static PyObject *BlobStore_sync(BlobStoreObject *self, PyObject *args)
+{
+    int do_fsync = 0;
+
+    if (!PyArg_ParseTuple(args, "|i", &do_fsync))
+	return NULL;
+
+    if (store_sync(self->sm, do_fsync) < 0)
+	return NULL;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static char BlobStore_usage__doc__[] = 
 "usage() -> (int, int)";
 
@@ -106,6 +144,8 @@ static struct PyMethodDef BlobStore_methods[] = {
     { "append", (PyCFunction)BlobStore_append, METH_VARARGS, BlobStore_append__doc__ },
     { "get", (PyCFunction)BlobStore_get, METH_VARARGS, BlobStore_get__doc__ },
     { "free", (PyCFunction)BlobStore_free, METH_VARARGS, BlobStore_free__doc__ },
+    { "reserve", (PyCFunction)BlobStore_reserve, METH_VARARGS, BlobStore_reserve__doc__ },
+    { "sync", (PyCFunction)BlobStore_sync, METH_VARARGS, BlobStore_sync__doc__ },
     { "usage", (PyCFunction)BlobStore_usage, METH_VARARGS, BlobStore_usage__doc__ },
     { "header", (PyCFunction)BlobStore_header, METH_VARARGS, BlobStore_header__doc__ },
     { NULL, NULL }
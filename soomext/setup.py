@@ -32,6 +32,8 @@ setup(
     py_modules=["soomarray"],
     ext_modules = [Extension('soomfunc',
                              ['soomfunc.c']),
+                   Extension('soombitmap',
+                             ['soombitmap.c']),
                    Extension('mmaparray',
                              ['mmaparray.c']),
                    Extension('blobstore',
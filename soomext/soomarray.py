@@ -15,10 +15,13 @@
 # $Id: soomarray.py 2626 2007-03-09 04:35:54Z andrewm $
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/soomext/soomarray.py,v $
 
+import os
 import cPickle
 import string
 import blobstore
 import mmaparray
+import soombitmap
+import soomfunc
 import MA
 import Numeric
 import types
@@ -149,32 +152,366 @@ class ArrayFile(MmapArray):
         MmapArray.__init__(self, blob)
 
 
+class Bitmap:
+    """
+    A sorted set of row ids held as a compressed bitmap (see
+    soombitmap). Behaves as a read-only rank-1 Numeric.Int array
+    of the row ids, the ids only being expanded when needed.
+    """
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self._ids = None
+
+    def fromids(cls, ids):
+        ids = Numeric.asarray(ids).astype(Numeric.Int)
+        return cls(soombitmap.from_ids(ids.tostring()))
+    fromids = classmethod(fromids)
+
+    def ids(self):
+        if self._ids is None:
+            self._ids = Numeric.fromstring(soombitmap.to_ids(self.bitmap),
+                                           Numeric.Int)
+        return self._ids
+
+    def nbytes(self):
+        return len(self.bitmap)
+
+    def __repr__(self):
+        return 'Bitmap(%r)' % (self.ids(),)
+
+    def __array__(self, t=None):
+        if t:
+            return Numeric.asarray(self.ids(), t)
+        return self.ids()
+
+    def __len__(self):
+        return int(soombitmap.popcount(self.bitmap))
+
+    def __getitem__(self, index):
+        return self.ids()[index]
+
+    def take(self, rows):
+        return Numeric.take(self.ids(), rows)
+
+    def tolist(self):
+        return self.ids().tolist()
+
+    def typecode(self):
+        return Numeric.Int
+
+
+def _ids(a):
+    if isinstance(a, Bitmap):
+        return a.ids()
+    return a
+
+def intersect(*vectors):
+    """
+    soomfunc.intersect() of row id vectors and/or Bitmaps. Bitmaps
+    are intersected natively, then with any vectors, giving a
+    vector. The result is a Bitmap only if all arguments are.
+    """
+    bitmaps = [v.bitmap for v in vectors if isinstance(v, Bitmap)]
+    if not bitmaps:
+        return soomfunc.intersect(*vectors)
+    others = [v for v in vectors if not isinstance(v, Bitmap)]
+    if len(bitmaps) > 1:
+        bitmap = soombitmap.and_(*bitmaps)
+    else:
+        bitmap = bitmaps[0]
+    if not others:
+        return Bitmap(bitmap)
+    if len(others) > 1:
+        ids = soomfunc.intersect(*others)
+    else:
+        ids = others[0]
+    ids = Numeric.asarray(ids, Numeric.Int)
+    return Numeric.fromstring(soombitmap.and_ids(bitmap, ids.tostring()),
+                              Numeric.Int)
+
+def intersect_count(*vectors):
+    """
+    len(intersect(*vectors)), without building the intersection
+    where possible.
+    """
+    if len(vectors) == 1:
+        return len(vectors[0])
+    bitmaps = [v.bitmap for v in vectors if isinstance(v, Bitmap)]
+    if not bitmaps:
+        return soomfunc.intersect_count(*vectors)
+    if len(bitmaps) == len(vectors):
+        return int(soombitmap.and_count(*bitmaps))
+    return len(intersect(*vectors))
+
+def union(*vectors):
+    """
+    soomfunc.union() of row id vectors and/or Bitmaps. The result
+    is a Bitmap only if all arguments are.
+    """
+    for v in vectors:
+        if not isinstance(v, Bitmap):
+            return soomfunc.union(*map(_ids, vectors))
+    return Bitmap(soombitmap.or_(*[v.bitmap for v in vectors]))
+
+def difference(*vectors):
+    """
+    soomfunc.difference() of row id vectors and/or Bitmaps. The
+    result is a Bitmap only if all arguments are.
+    """
+    for v in vectors:
+        if not isinstance(v, Bitmap):
+            return soomfunc.difference(*map(_ids, vectors))
+    return Bitmap(soombitmap.andnot(*[v.bitmap for v in vectors]))
+
+def complement(vector, size):
+    """
+    Row ids in range(size) that are not in the vector or Bitmap
+    """
+    if isinstance(vector, Bitmap):
+        return Bitmap(soombitmap.complement(vector.bitmap, size))
+    return soomfunc.outersect(Numeric.arrayrange(size), vector)
+
+
 BLOB_DICT = 0
 BLOB_ARRAY = 1
 BLOB_FILLED = 2
 BLOB_MASK = 3
 BLOB_STRING = 4
+BLOB_BITMAP = 5
+BLOB_KEYDIR = 6
+
+def _blob_nbytes(a):
+    # Approximate space needed to store a in an ArrayDict
+    if isinstance(a, Bitmap):
+        return len(a.bitmap)
+    elif MA.isMaskedArray(a):
+        return Numeric.size(a) * (a.itemsize() + 1)
+    elif type(a) == Numeric.ArrayType:
+        return Numeric.size(a) * a.itemsize()
+    return len(str(a))
+
+class _Batch:
+    """
+    Explicit writes, rather than relying on the store being written
+    when the object is deleted.
+
+    sync() writes any pending metadata (for an ArrayDict, the key
+    directory) and flushes the store to disc - if fsync is true,
+    waiting for the writes and fsync()ing the file. close() syncs,
+    then releases the store. Writes between begin() and commit()
+    are a batch: sync() is deferred until the outermost commit().
+    Values are written to the store as they are assigned, so there
+    is no rollback.
+    """
+    _batch = 0
+
+    def begin(self):
+        self._batch += 1
+
+    def commit(self, fsync=False):
+        if self._batch <= 0:
+            raise Error('commit() without begin()')
+        self._batch -= 1
+        self.sync(fsync)
+
+    def sync(self, fsync=False):
+        if self._batch:
+            return
+        self._save_metadata()
+        self.store.sync(fsync)
+
+    def close(self, fsync=False):
+        self._batch = 0
+        self.sync(fsync)
+        self.store = None
+
+
+class _KeyDirectory:
+    """
+    The key to blob index mapping of an ArrayDict, kept in the
+    blobstore as a sorted directory: the pickled keys in key order,
+    held in a heap of bytes with a vector of offsets, and a parallel
+    vector of blob indexes. Blob 0 (type BLOB_KEYDIR) holds the
+    number of keys and the indexes of those three blobs.
+
+    The directory is memory mapped, so opening it costs nothing,
+    len() is the stored count, and a lookup unpickles the O(log n)
+    keys visited by a binary search.
+    """
+    def __init__(self, store):
+        self.store = store
+        header = store[0].as_array()
+        self.size = int(header[0])
+        self.blobs = [int(i) for i in header[1:]]
+
+    def save(cls, store, keys, indexes):
+        """
+        Write a directory of the (sorted) keys and their blob
+        indexes to the store, replacing any existing directory
+        """
+        if store[0].type == BLOB_KEYDIR:
+            for i in store[0].as_array()[1:]:
+                store.free(int(i))
+        pickled = [cPickle.dumps(key, 2) for key in keys]
+        offsets = Numeric.zeros(len(pickled) + 1, Numeric.Int)
+        if pickled:
+            offsets[1:] = Numeric.add.accumulate(map(len, pickled))
+        # Padded, so the heap is never empty
+        heap = Numeric.fromstring(''.join(pickled) + '\0',
+                                  Numeric.UnsignedInt8)
+        indexes = Numeric.array(indexes, Numeric.Int)
+        store.reserve(_blob_nbytes(offsets) + len(heap) 
+                      + _blob_nbytes(indexes), 3)
+        header = [len(pickled)]
+        for a in (offsets, heap, indexes):
+            index = store.append()
+            blob = store[index]
+            blob.type = BLOB_KEYDIR
+            blob.save_array(a)
+            header.append(index)
+        blob = store[0]
+        blob.type = BLOB_KEYDIR
+        blob.save_array(Numeric.array(header, Numeric.Int))
+    save = classmethod(save)
+
+    def _arrays(self):
+        # Fetched on each use - the mapping moves if the store grows
+        return [self.store[i].as_array() for i in self.blobs]
+
+    def _key(self, offsets, heap, i):
+        return cPickle.loads(heap[offsets[i]:offsets[i+1]].tostring())
+
+    def get(self, key, default=None):
+        offsets, heap, indexes = self._arrays()
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(offsets, heap, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.size and self._key(offsets, heap, lo) == key:
+            return int(indexes[lo])
+        return default
+
+    def __getitem__(self, key):
+        index = self.get(key)
+        if index is None:
+            raise KeyError, key
+        return index
+
+    def has_key(self, key):
+        return self.get(key) is not None
+    __contains__ = has_key
+
+    def __len__(self):
+        return self.size
+
+    def iterkeys(self):
+        offsets, heap, indexes = self._arrays()
+        for i in xrange(self.size):
+            yield self._key(offsets, heap, i)
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        indexes = self._arrays()[2]
+        return zip(self.iterkeys(), [int(i) for i in indexes])
+
+    def values(self):
+        return [int(i) for i in self._arrays()[2]]
 
-class ArrayDict:
+    def todict(self):
+        return dict(self.items())
+
+
+class ArrayDict(_Batch):
+    """
+    A dictionary of arrays (and strings) held in a blobstore.
+
+    The keys are held in a sorted directory (see _KeyDirectory),
+    which is read in place. Stores written before the directory was
+    introduced - or whose keys can not be ordered - keep the keys as
+    a pickled dict in blob 0, which is read whole. Adding or removing
+    keys reads the whole directory, and a new one is written by
+    sync(), close() or commit() (see _Batch), or when the ArrayDict
+    is deleted. update() stores many arrays with one growth of the
+    file.
+    """
     def __init__(self, filename, mode = 'r'):
         self.dict_dirty = 0
+        self.store = None
         self.store = blobstore.open(filename, mode)
         if len(self.store) > 0:
             blob = self.store[0]
-            self.dict = cPickle.loads(blob.as_str())
+            if blob.type == BLOB_KEYDIR:
+                self.dict = _KeyDirectory(self.store)
+            else:
+                self.dict = cPickle.loads(blob.as_str())
         else:
             self.dict_dirty = 1
             self.store.append()
             self.dict = {}
 
     def __del__(self):
-        if self.dict_dirty:
+        if self.store is not None:
+            self._save_metadata()
+
+    def _save_metadata(self):
+        if not self.dict_dirty:
+            return
+        keys = self.dict.keys()
+        try:
+            keys.sort()
+        except TypeError:
+            keys = None
+        if keys is None:
+            # Unorderable keys - save as a pickled dict
             blob = self.store[0]
+            if blob.type == BLOB_KEYDIR:
+                for i in blob.as_array()[1:]:
+                    self.store.free(int(i))
             blob.type = BLOB_DICT
             blob.save_str(cPickle.dumps(self.dict))
+        else:
+            _KeyDirectory.save(self.store, keys, 
+                               [self.dict[key] for key in keys])
+        self.dict_dirty = 0
+
+    def reserve(self, nbytes, nblobs):
+        """
+        Grow the file once, to make room for nblobs new arrays
+        totalling nbytes, so they are laid out contiguously
+        without the file being remapped for each.
+        """
+        self.store.reserve(nbytes, nblobs)
+
+    def update(self, values):
+        """
+        Store the arrays in values (a dictionary, or a sequence of
+        (key, array) pairs), reserving space for them all first
+        """
+        if hasattr(values, 'items'):
+            values = values.items()
+        nbytes = 0
+        for key, a in values:
+            nbytes += _blob_nbytes(a)
+        # Masked arrays need a second blob for the mask
+        self.reserve(nbytes, len(values) * 2)
+        for key, a in values:
+            self[key] = a
+
+    def _writable_dict(self):
+        if isinstance(self.dict, _KeyDirectory):
+            self.dict = self.dict.todict()
+        return self.dict
 
     def __getitem__(self, key):
-        index = self.dict[key]
+        return self._get_index(self.dict[key])
+
+    def _get_index(self, index):
         blob = self.store[index]
         if blob.type == BLOB_ARRAY:
             return MmapArray(blob)
@@ -185,13 +522,22 @@ class ArrayDict:
             return MA.array(data, mask = mask)
         elif blob.type == BLOB_STRING:
             return blob.as_str()
+        elif blob.type == BLOB_BITMAP:
+            return Bitmap(blob.as_str())
         else:
             raise Error('bad BLOB type %s in index' % blob.type)
 
     def __setitem__(self, key, a):
         index = self.dict.get(key)
+        if (index is not None and 
+            (self.store[index].type == BLOB_BITMAP) != isinstance(a, Bitmap)):
+            # Changing between bitmap and other representations
+            del self[key]
+            index = None
         if index is None:
-            if MA.isMaskedArray(a):
+            if isinstance(a, Bitmap):
+                index = self._save_new_bitmap(a)
+            elif MA.isMaskedArray(a):
                 index = self._save_new_masked(a)
             elif type(a) == Numeric.ArrayType:
                 index = self._save_new_array(a)
@@ -199,10 +545,12 @@ class ArrayDict:
                 index = self._save_new_str(a)
             else:
                 index = self._save_new_str(repr(a))
-            self.dict[key] = index
+            self._writable_dict()[key] = index
             self.dict_dirty = 1
         else:
-            if MA.isMaskedArray(a):
+            if isinstance(a, Bitmap):
+                self.store[index].save_str(a.bitmap)
+            elif MA.isMaskedArray(a):
                 self._save_masked(index, a)
             elif type(a) == Numeric.ArrayType:
                 self._save_array(index, a)
@@ -219,7 +567,7 @@ class ArrayDict:
         if blob.type == BLOB_FILLED:
             self.store.free(blob.other)
         self.store.free(index)
-        del self.dict[key]
+        del self._writable_dict()[key]
         self.dict_dirty = 1
 
     def __getslice__(self, i, j): 
@@ -235,26 +583,35 @@ class ArrayDict:
             del self[key]
 
     def get(self, key, default = None):
-        if self.dict.has_key(key):
-            return self[key]
-        return default
+        index = self.dict.get(key)
+        if index is None:
+            return default
+        return self._get_index(index)
 
     def has_key(self, key):
         return self.dict.has_key(key)
+    __contains__ = has_key
 
     def keys(self):
         return self.dict.keys()
 
+    def iterkeys(self):
+        """
+        Iterate over the keys - in key order if the keys are held
+        in a sorted directory
+        """
+        return iter(self.dict)
+
     def values(self):
         values = []
-        for key in self.dict.keys():
-            values.append(self[key])
+        for index in self.dict.values():
+            values.append(self._get_index(index))
         return values
 
     def items(self):
         items = []
-        for key in self.dict.keys():
-            items.append((key, self[key]))
+        for key, index in self.dict.items():
+            items.append((key, self._get_index(index)))
         return items
 
     def _save_new_masked(self, a):
@@ -283,6 +640,13 @@ class ArrayDict:
         blob.save_str(str(a))
         return index
 
+    def _save_new_bitmap(self, a):
+        index = self.store.append()
+        blob = self.store[index]
+        blob.type = BLOB_BITMAP
+        blob.save_str(a.bitmap)
+        return index
+
     def _save_masked(self, index, a):
         blob = self.store[index]
         if blob.type == BLOB_FILLED:
@@ -412,6 +776,306 @@ class ArrayTuple:
 #        return slice    
 
 
+def _ranges(starts, ends):
+    """
+    Given vectors of range starts and ends, returns an index vector
+    of the concatenated ranges, and a list of the bounds of each
+    range within it.
+    """
+    lengths = ends - starts
+    bounds = Numeric.zeros(len(lengths) + 1, Numeric.Int)
+    if len(lengths):
+        bounds[1:] = Numeric.add.accumulate(lengths)
+    index = Numeric.arrayrange(bounds[-1]) + \
+            Numeric.repeat(starts - bounds[:-1], lengths)
+    return index, bounds.tolist()
+
+class _HeapArray:
+    """
+    Variable length values, held as a vector of offsets into a
+    contiguous heap of bytes - value i is heap[offsets[i]:offsets[i+1]].
+    Both are kept in a blobstore, and memory mapped when read, so
+    take() and slicing gather values with Numeric, rather than a
+    database lookup per row.
+
+    The values are written when the array is flush()ed (or
+    deleted), so while open for writing they can be assigned in any
+    order. Rows assigned past the end of an existing array are
+    appended to the stored offsets and heap in place; assigning to
+    an existing row reads all of the values, which are then
+    rewritten.
+    """
+    chunk = 4096
+
+    def __init__(self, filename=None, mode='c'):
+        self.filename = filename
+        self.writable = mode != 'r'
+        self.store = None
+        self.values = None
+        self.base = None                # number of stored rows appended to
+        self.dirty = False
+        if filename and os.path.exists(filename):
+            self._open()
+        elif not self.writable:
+            raise Error('%s: no such array' % filename)
+        else:
+            self.values = []
+            self.dirty = True
+
+    def __del__(self):
+        try:
+            self.flush()
+        except AttributeError:
+            pass
+
+    def _open(self):
+        self.store = ArrayDict(self.filename, 'r')
+        self.offsets = Numeric.asarray(self.store['offsets'])
+        self.heap = Numeric.asarray(self.store['heap'])
+
+    def _close(self):
+        self.store = self.offsets = self.heap = None
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        if not self.filename:
+            return
+        if self.base is not None and not self._can_extend(self.values):
+            self._load_stored()
+        self._close()
+        if self.base is not None:
+            store = ArrayDict(self.filename, 'r+')
+            self._extend(store, self.values)
+        else:
+            try:
+                os.unlink(self.filename)
+            except OSError:
+                pass
+            store = ArrayDict(self.filename, 'w+')
+            self._save(store, self.values)
+        store.close()
+        self.values = self.base = None
+        self._open()
+
+    def _load_stored(self):
+        # Hold the stored rows in memory along with the appended rows,
+        # so all are rewritten
+        if self.base:
+            self.values = self._take(Numeric.arrayrange(self.base)) + \
+                          self.values
+        self.base = None
+
+    def _can_extend(self, values):
+        return True
+
+    def _offsets(self, values):
+        offsets = Numeric.zeros(len(values) + 1, Numeric.Int)
+        if values:
+            offsets[1:] = Numeric.add.accumulate(map(len, values))
+        return offsets
+
+    def _save_heap(self, store, values, offsets_key='offsets'):
+        # Padded, so the heap is never empty
+        heap = Numeric.fromstring(''.join(values) + '\0', 
+                                  Numeric.UnsignedInt8)
+        store.update([(offsets_key, self._offsets(values)), ('heap', heap)])
+
+    def _extend_heap(self, store, values, offsets_key='offsets'):
+        # Append values to the stored offsets and heap
+        if not values:
+            return
+        offsets = store[offsets_key]
+        heap = store['heap']
+        data = Numeric.fromstring(''.join(values) + '\0', 
+                                  Numeric.UnsignedInt8)
+        # The new values start in the padding byte
+        heap[-1] = data[0]
+        if len(data) > 1:
+            heap.append(data[1:])
+        offsets.append(self._offsets(values)[1:] + offsets[-1])
+
+    def _gather(self, offsets, heap, rows):
+        # Returns the heap strings at rows
+        index, bounds = _ranges(Numeric.take(offsets, rows), 
+                                Numeric.take(offsets, rows + 1))
+        data = Numeric.take(heap, index).tostring()
+        return [data[bounds[i]:bounds[i+1]] for i in xrange(len(rows))]
+
+    def _rows(self, rows):
+        rows = Numeric.asarray(rows, Numeric.Int)
+        size = len(self)
+        if len(rows) and Numeric.sometrue(Numeric.less(rows, 0)):
+            rows = Numeric.where(Numeric.less(rows, 0), rows + size, rows)
+        return rows
+
+    def __len__(self):
+        if self.values is not None:
+            return (self.base or 0) + len(self.values)
+        return len(self.offsets) - 1
+
+    def __setitem__(self, i, a):
+        a = self._check(a)
+        if self.values is None:
+            if not self.writable:
+                raise Error('array is read-only')
+            self.base = len(self)
+            self.values = []
+        if i < 0:
+            i += len(self)
+        if self.base is not None:
+            if i < self.base:
+                self._load_stored()
+            else:
+                i -= self.base
+        if i >= len(self.values):
+            self.values.extend([self.empty] * (i + 1 - len(self.values)))
+        self.values[i] = a
+        self.dirty = True
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return self.take(Numeric.arrayrange(*i.indices(len(self))))
+        size = len(self)
+        if i < 0:
+            i += size
+        if i < 0 or i >= size:
+            raise IndexError('index %d out of range' % i)
+        if self.values is not None and self.base is None:
+            return self.values[i]
+        return self.take([i])[0]
+
+    def take(self, rows):
+        rows = self._rows(rows)
+        if not len(rows):
+            return []
+        if self.values is None:
+            return self._take(rows)
+        if self.base is None:
+            return [self.values[i] for i in rows]
+        # Appending - some rows are stored, some held in memory
+        stored = Numeric.compress(Numeric.less(rows, self.base), rows)
+        if len(stored):
+            stored = iter(self._take(stored))
+        result = []
+        for i in rows:
+            if i < self.base:
+                result.append(stored.next())
+            else:
+                result.append(self.values[i - self.base])
+        return result
+
+    def __iter__(self):
+        size = len(self)
+        for start in xrange(0, size, self.chunk):
+            end = min(start + self.chunk, size)
+            for value in self.take(Numeric.arrayrange(start, end)):
+                yield value
+
+    def discard(self):
+        """
+        Forget any values not yet written
+        """
+        self.dirty = False
+
+
+class ArrayHeapString(_HeapArray):
+    """
+    Strings stored in a _HeapArray (None is stored as '')
+    """
+    empty = ''
+
+    def _check(self, a):
+        if a is None:
+            return ''
+        if type(a) is not str:
+            raise TypeError('Cannot store a non-string in an ArrayHeapString: %r' % a)
+        return a
+
+    def _save(self, store, values):
+        self._save_heap(store, values)
+
+    def _extend(self, store, values):
+        self._extend_heap(store, values)
+
+    def _take(self, rows):
+        return self._gather(self.offsets, self.heap, rows)
+
+
+class ArrayHeapTuple(_HeapArray):
+    """
+    Tuples stored CSR fashion - a vector of offsets into a vector
+    of elements, the elements being held in a _HeapArray heap
+    (pickled, unless they are all strings).
+    """
+    empty = ()
+
+    def _open(self):
+        _HeapArray._open(self)
+        self.elem_offsets = Numeric.asarray(self.store['elem_offsets'])
+        self.pickled = self.store['encoding'] == 'pickle'
+
+    def _close(self):
+        _HeapArray._close(self)
+        self.elem_offsets = None
+
+    def _check(self, a):
+        if type(a) is not tuple:
+            raise TypeError('Cannot store a non-tuple in an ArrayHeapTuple: %r' % a)
+        try:
+            hash(a)
+        except TypeError:
+            raise ValueError('Cannot store a non-hashable value in an ArrayHeapTuple: %r' % a)
+        return a
+
+    def _save(self, store, values):
+        elems = []
+        for value in values:
+            elems.extend(value)
+        encoding = 'str'
+        for elem in elems:
+            if type(elem) is not str:
+                encoding = 'pickle'
+                elems = [cPickle.dumps(elem, -1) for elem in elems]
+                break
+        store['offsets'] = self._offsets(values)
+        store['encoding'] = encoding
+        self._save_heap(store, elems, 'elem_offsets')
+
+    def _can_extend(self, values):
+        # Elements are only appended in the stored encoding
+        if self.pickled:
+            return True
+        for value in values:
+            for elem in value:
+                if type(elem) is not str:
+                    return False
+        return True
+
+    def _extend(self, store, values):
+        elems = []
+        for value in values:
+            elems.extend(value)
+        if self.pickled:
+            elems = [cPickle.dumps(elem, -1) for elem in elems]
+        if values:
+            offsets = store['offsets']
+            offsets.append(self._offsets(values)[1:] + offsets[-1])
+        self._extend_heap(store, elems, 'elem_offsets')
+
+    def _take(self, rows):
+        index, bounds = _ranges(Numeric.take(self.offsets, rows), 
+                                Numeric.take(self.offsets, rows + 1))
+        if len(index):
+            elems = self._gather(self.elem_offsets, self.heap, index)
+            if self.pickled:
+                elems = map(cPickle.loads, elems)
+        else:
+            elems = []
+        return [tuple(elems[bounds[i]:bounds[i+1]]) for i in xrange(len(rows))]
+
+
 class ArrayDateTime:
     def __init__(self, filename=None, mode='c'):
         self.store = bsddb.rnopen(filename, mode)
@@ -595,10 +1259,136 @@ class ArrayTime:
 #        return slice    
 
 
+class _OrdinalArray:
+    """
+    Dates or times held as a Numeric vector of ordinals, with a
+    mask for missing values, converted to mx.DateTime objects only
+    as values are fetched. ordinals() and take_ordinals() return the
+    ordinals themselves (as a masked array if any are missing), so
+    values can be compared a vector at a time.
+    """
+    chunk = 4096
+
+    def __init__(self, size=0, data=None, mask=None):
+        if data is None:
+            data = Numeric.zeros(size, self.typecode)
+            mask = Numeric.ones(size, MA.MaskType)
+        elif MA.isMaskedArray(data):
+            mask = MA.getmaskarray(data)
+            data = data.raw_data()
+        self.data = data
+        self.mask = mask
+
+    def ordinals(self):
+        if self.mask is None:
+            return self.data
+        return MA.array(self.data, mask=self.mask, copy=0)
+
+    def take_ordinals(self, rows):
+        data = Numeric.take(self.data, rows)
+        if self.mask is None:
+            return data
+        return MA.array(data, mask=Numeric.take(self.mask, rows), copy=0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __setitem__(self, i, a):
+        if a is None:
+            self.data[i] = 0
+            self.mask[i] = 1
+        else:
+            self.data[i] = self.to_ordinal(a)
+            self.mask[i] = 0
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return self.take(Numeric.arrayrange(*i.indices(len(self))))
+        value = self.data[i]
+        if self.mask is not None and self.mask[i]:
+            return None
+        return self.from_ordinal(value)
+
+    def take(self, rows):
+        from_ordinal = self.from_ordinal
+        data = Numeric.take(self.data, rows)
+        if self.mask is None:
+            return map(from_ordinal, data)
+        values = []
+        for value, masked in zip(data, Numeric.take(self.mask, rows)):
+            if masked:
+                values.append(None)
+            else:
+                values.append(from_ordinal(value))
+        return values
+
+    def __iter__(self):
+        size = len(self)
+        for start in xrange(0, size, self.chunk):
+            end = min(start + self.chunk, size)
+            for value in self.take(Numeric.arrayrange(start, end)):
+                yield value
+
+
+def _absvalues(a, cls):
+    try:
+        return a.absvalues()
+    except AttributeError:
+        raise TypeError('%s values must be mx.DateTimes or None' % cls)
+
+class ArrayDateOrdinal(_OrdinalArray):
+    """
+    Dates, as absolute day numbers
+    """
+    typecode = Numeric.Int
+
+    def to_ordinal(a):
+        return _absvalues(a, 'ArrayDateOrdinal')[0]
+    to_ordinal = staticmethod(to_ordinal)
+
+    def from_ordinal(ordinal):
+        return mx.DateTime.DateTimeFromAbsDateTime(ordinal, 0)
+    from_ordinal = staticmethod(from_ordinal)
+
+class ArrayTimeOrdinal(_OrdinalArray):
+    """
+    Times, as seconds
+    """
+    typecode = Numeric.Float
+
+    def to_ordinal(a):
+        try:
+            return a.seconds            # DateTimeDelta
+        except AttributeError:
+            return _absvalues(a, 'ArrayTimeOrdinal')[1]
+    to_ordinal = staticmethod(to_ordinal)
+
+    def from_ordinal(ordinal):
+        return mx.DateTime.DateTimeDeltaFromSeconds(ordinal)
+    from_ordinal = staticmethod(from_ordinal)
+
+class ArrayDateTimeOrdinal(_OrdinalArray):
+    """
+    Dates and times, as seconds since the start of day one
+    """
+    typecode = Numeric.Float
+
+    def to_ordinal(a):
+        absdate, abstime = _absvalues(a, 'ArrayDateTimeOrdinal')
+        return absdate * 86400.0 + abstime
+    to_ordinal = staticmethod(to_ordinal)
+
+    def from_ordinal(ordinal):
+        absdate = int(ordinal // 86400)
+        return mx.DateTime.DateTimeFromAbsDateTime(absdate, 
+                                                   ordinal - absdate * 86400.0)
+    from_ordinal = staticmethod(from_ordinal)
+
+
 RECODE_META_IDX = 0
 RECODE_DATA_IDX = 1
 
-class RecodeBlobArray:
+class RecodeBlobArray(_Batch):
     def __init__(self, size, filename, mode='r'):
         self.dirty = False
         self.store = None
@@ -606,6 +1396,13 @@ class RecodeBlobArray:
         if len(self.store):
             metadata = cPickle.loads(self.store[RECODE_META_IDX].as_str())
             self.obj_to_code, self.code_to_obj, self.next_code = metadata
+            if size > len(self):
+                # Rows are being appended
+                data = self.store[RECODE_DATA_IDX].as_array()
+                grown = Numeric.zeros(size)
+                grown[:len(data)] = data
+                del data
+                self.store[RECODE_DATA_IDX].save_array(grown)
         else:
             self.store.append()
             self.store.append()
@@ -616,9 +1413,14 @@ class RecodeBlobArray:
             self.store[RECODE_DATA_IDX].save_array(zeros)
 
     def __del__(self):
+        if self.store is not None:
+            self._save_metadata()
+
+    def _save_metadata(self):
         if self.dirty:
             metadata = self.obj_to_code, self.code_to_obj, self.next_code
             self.store[0].save_str(cPickle.dumps(metadata))
+            self.dirty = False
 
     def __len__(self):
         return len(self.store[RECODE_DATA_IDX].as_array())
@@ -634,6 +1436,12 @@ class RecodeBlobArray:
         array = self.store[RECODE_DATA_IDX].as_array()
         return [self.code_to_obj[v] for v in Numeric.take(array, rows)]
 
+    def codes(self):
+        return self.store[RECODE_DATA_IDX].as_array()
+
+    def take_codes(self, rows):
+        return Numeric.take(self.store[RECODE_DATA_IDX].as_array(), rows)
+
     def __setitem__(self, i, v):
         code = self.obj_to_code.get(v, None)
         if code is None:
@@ -665,6 +1473,12 @@ class RecodeNumericArray:
     def take(self, rows):
         return [self.code_to_obj[v] for v in Numeric.take(self.data, rows)]
 
+    def codes(self):
+        return self.data
+
+    def take_codes(self, rows):
+        return Numeric.take(self.data, rows)
+
     def __setitem__(self, i, v):
         code = self.obj_to_code.get(v, None)
         if code is None:
@@ -680,7 +1494,7 @@ def get_recode_array(size, filename=None, mode='r'):
     else:
         return RecodeNumericArray(size)
 
-class ArrayVocab:
+class ArrayVocab(_Batch):
     def __init__(self, filename=None, mode='c'):
         self.store = bsddb.hashopen(filename, mode)
 
@@ -718,6 +1532,33 @@ class ArrayVocab:
         stat = self.store.db.stat()
         return stat['ndata']
 
-    def sync(self):
+    def sync(self, fsync=False):
+        if self._batch:
+            return
         self.store.sync()
+        if fsync:
+            os.fsync(self.store.db.fd())
+
+    def close(self, fsync=False):
+        self._batch = 0
+        self.sync(fsync)
+        self.store.close()
+        self.store = None
+
+    def update(self, values):
+        """
+        Store the (key, value) pairs in values (or a dictionary) in
+        key order, as one batch synced at the end. bsddb has no bulk
+        write, so each pair is still a separate put.
+        """
+        if hasattr(values, 'items'):
+            values = values.items()
+        values = list(values)
+        values.sort()
+        self.begin()
+        try:
+            for i, a in values:
+                self[i] = a
+        finally:
+            self.commit()
 
@@ -0,0 +1,1044 @@
+/*
+ *  The contents of this file are subject to the HACOS License Version 1.2
+ *  (the "License"); you may not use this file except in compliance with
+ *  the License.  Software distributed under the License is distributed
+ *  on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+ *  implied. See the LICENSE file for the specific language governing
+ *  rights and limitations under the License.  The Original Software
+ *  is "NetEpi Analysis". The Initial Developer of the Original
+ *  Software is the Health Administration Corporation, incorporated in
+ *  the State of New South Wales, Australia.
+ *
+ *  Copyright (C) 2004,2005 Health Administration Corporation.
+ *  All Rights Reserved.
+ */
+
+/*
+ * Compressed bitmaps of row ids, in the style of "roaring" bitmaps.
+ *
+ * The row id space is split into 65536 row blocks, keyed by the high
+ * 16 bits of the row id.  Each block with any rows set is held in a
+ * container - either a sorted array of the low 16 bits of the row ids
+ * (when the block has ARRAY_MAX or fewer rows), or a 65536 bit bitmap.
+ *
+ * A bitmap is passed to and from Python as a string:
+ *
+ *      header          magic, number of containers, total rows
+ *      directory       key, type, rows and offset of each container
+ *      containers      uint16 arrays or BITMAP_WORDS uint64 words
+ *
+ * Row id vectors are passed as strings of native C longs (the
+ * representation of a Numeric.Int array).
+ */
+#include "Python.h"
+
+#include <string.h>
+#include <stdlib.h>
+
+#if defined(_MSC_VER)
+typedef unsigned __int16 uint16_t;
+typedef unsigned __int32 uint32_t;
+typedef unsigned __int64 uint64_t;
+#else
+#include <stdint.h>
+#endif
+
+#define MAGIC "SRB1"
+#define ARRAY_MAX 4096
+#define BITMAP_WORDS 1024
+#define CONTAINER_ROWS 65536
+
+#define TYPE_ARRAY 0
+#define TYPE_BITMAP 1
+
+typedef struct {
+    char magic[4];
+    uint32_t ncontainers;
+    uint32_t card;
+} BitmapHeader;
+
+typedef struct {
+    uint16_t key;
+    uint16_t type;
+    uint32_t card;
+    uint32_t offset;
+} ContainerDir;
+
+/* Unpacked container - data is always malloc'ed and aligned */
+typedef struct {
+    uint16_t key;
+    int type;
+    uint32_t card;
+    uint16_t *array;
+    uint64_t *bits;
+} Container;
+
+typedef struct {
+    int ncontainers;
+    int size;
+    Container *containers;
+} Bitmap;
+
+static int popcount64(uint64_t w)
+{
+    w = w - ((w >> 1) & 0x5555555555555555ULL);
+    w = (w & 0x3333333333333333ULL) + ((w >> 2) & 0x3333333333333333ULL);
+    w = (w + (w >> 4)) & 0x0f0f0f0f0f0f0f0fULL;
+    return (int)((w * 0x0101010101010101ULL) >> 56);
+}
+
+static void free_bitmap(Bitmap *bm)
+{
+    int i;
+
+    for (i = 0; i < bm->ncontainers; i++) {
+        free(bm->containers[i].array);
+        free(bm->containers[i].bits);
+    }
+    free(bm->containers);
+    bm->containers = NULL;
+    bm->ncontainers = bm->size = 0;
+}
+
+/* Returns a new (empty) container at the end of the bitmap */
+static Container *add_container(Bitmap *bm, uint16_t key)
+{
+    Container *c;
+
+    if (bm->ncontainers == bm->size) {
+        int size = bm->size ? bm->size * 2 : 16;
+        Container *containers;
+
+        containers = realloc(bm->containers, size * sizeof(Container));
+        if (containers == NULL) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        bm->containers = containers;
+        bm->size = size;
+    }
+    c = &bm->containers[bm->ncontainers++];
+    memset(c, 0, sizeof(*c));
+    c->key = key;
+    return c;
+}
+
+/* Discard the last container if it turned out to be empty */
+static void trim_container(Bitmap *bm)
+{
+    Container *c = &bm->containers[bm->ncontainers - 1];
+
+    if (c->card == 0) {
+        free(c->array);
+        free(c->bits);
+        bm->ncontainers--;
+    }
+}
+
+static uint64_t *alloc_bits(void)
+{
+    uint64_t *bits = calloc(BITMAP_WORDS, sizeof(uint64_t));
+
+    if (bits == NULL)
+        PyErr_NoMemory();
+    return bits;
+}
+
+static uint16_t *alloc_array(uint32_t card)
+{
+    uint16_t *array = malloc((card ? card : 1) * sizeof(uint16_t));
+
+    if (array == NULL)
+        PyErr_NoMemory();
+    return array;
+}
+
+/* Expand any container into bits (BITMAP_WORDS words, zeroed by caller) */
+static void container_bits(Container *c, uint64_t *bits)
+{
+    uint32_t i;
+
+    if (c->type == TYPE_BITMAP)
+        memcpy(bits, c->bits, BITMAP_WORDS * sizeof(uint64_t));
+    else
+        for (i = 0; i < c->card; i++)
+            bits[c->array[i] >> 6] |= (uint64_t)1 << (c->array[i] & 63);
+}
+
+/* Take ownership of bits, converting to an array container if sparse */
+static int set_container_bits(Container *c, uint64_t *bits)
+{
+    uint32_t card = 0;
+    int i;
+
+    for (i = 0; i < BITMAP_WORDS; i++)
+        card += popcount64(bits[i]);
+    c->card = card;
+    if (card > ARRAY_MAX) {
+        c->type = TYPE_BITMAP;
+        c->bits = bits;
+        return 0;
+    }
+    c->type = TYPE_ARRAY;
+    if ((c->array = alloc_array(card)) == NULL) {
+        free(bits);
+        return -1;
+    }
+    card = 0;
+    for (i = 0; i < BITMAP_WORDS; i++) {
+        uint64_t w = bits[i];
+        while (w) {
+            int bit = 0;
+            while (!(w & ((uint64_t)1 << bit)))
+                bit++;
+            c->array[card++] = (uint16_t)(i * 64 + bit);
+            w &= w - 1;
+        }
+    }
+    free(bits);
+    return 0;
+}
+
+static int container_contains(Container *c, uint16_t low)
+{
+    int lo, hi;
+
+    if (c->type == TYPE_BITMAP)
+        return (c->bits[low >> 6] >> (low & 63)) & 1;
+    lo = 0;
+    hi = (int)c->card - 1;
+    while (lo <= hi) {
+        int mid = (lo + hi) / 2;
+        if (c->array[mid] < low)
+            lo = mid + 1;
+        else if (c->array[mid] > low)
+            hi = mid - 1;
+        else
+            return 1;
+    }
+    return 0;
+}
+
+static Container *find_container(Bitmap *bm, uint16_t key)
+{
+    int lo = 0, hi = bm->ncontainers - 1;
+
+    while (lo <= hi) {
+        int mid = (lo + hi) / 2;
+        if (bm->containers[mid].key < key)
+            lo = mid + 1;
+        else if (bm->containers[mid].key > key)
+            hi = mid - 1;
+        else
+            return &bm->containers[mid];
+    }
+    return NULL;
+}
+
+/* ------------------------------------------------------------------
+ * Serialisation
+ */
+static int unpack_bitmap(PyObject *obj, Bitmap *bm)
+{
+    const char *buf;
+    Py_ssize_t len;
+    BitmapHeader header;
+    uint32_t i, prev_key = 0;
+
+    memset(bm, 0, sizeof(*bm));
+    if (PyString_AsStringAndSize(obj, (char **)&buf, &len) < 0)
+        return -1;
+    if (len < (Py_ssize_t)sizeof(header))
+        goto corrupt;
+    memcpy(&header, buf, sizeof(header));
+    if (memcmp(header.magic, MAGIC, 4) != 0
+        || header.ncontainers > CONTAINER_ROWS
+        || (Py_ssize_t)(sizeof(header) + header.ncontainers * sizeof(ContainerDir)) > len)
+        goto corrupt;
+    for (i = 0; i < header.ncontainers; i++) {
+        ContainerDir dir;
+        Container *c;
+        size_t size;
+
+        memcpy(&dir, buf + sizeof(header) + i * sizeof(dir), sizeof(dir));
+        if (i > 0 && dir.key <= prev_key)
+            goto corrupt;
+        prev_key = dir.key;
+        if (dir.type == TYPE_ARRAY && dir.card <= ARRAY_MAX)
+            size = dir.card * sizeof(uint16_t);
+        else if (dir.type == TYPE_BITMAP && dir.card <= CONTAINER_ROWS)
+            size = BITMAP_WORDS * sizeof(uint64_t);
+        else
+            goto corrupt;
+        if ((Py_ssize_t)(dir.offset + size) > len)
+            goto corrupt;
+        if ((c = add_container(bm, dir.key)) == NULL)
+            goto error;
+        c->type = dir.type;
+        c->card = dir.card;
+        if (dir.type == TYPE_ARRAY) {
+            if ((c->array = alloc_array(dir.card)) == NULL)
+                goto error;
+            memcpy(c->array, buf + dir.offset, size);
+        } else {
+            if ((c->bits = alloc_bits()) == NULL)
+                goto error;
+            memcpy(c->bits, buf + dir.offset, size);
+        }
+    }
+    return 0;
+
+corrupt:
+    PyErr_SetString(PyExc_ValueError, "not a soombitmap bitmap");
+error:
+    free_bitmap(bm);
+    return -1;
+}
+
+static PyObject *pack_bitmap(Bitmap *bm)
+{
+    BitmapHeader header;
+    PyObject *res;
+    char *buf;
+    size_t size, offset;
+    int i;
+
+    memcpy(header.magic, MAGIC, 4);
+    header.ncontainers = bm->ncontainers;
+    header.card = 0;
+    size = sizeof(header) + bm->ncontainers * sizeof(ContainerDir);
+    for (i = 0; i < bm->ncontainers; i++) {
+        Container *c = &bm->containers[i];
+        header.card += c->card;
+        if (c->type == TYPE_ARRAY)
+            size += c->card * sizeof(uint16_t);
+        else
+            size += BITMAP_WORDS * sizeof(uint64_t);
+    }
+    res = PyString_FromStringAndSize(NULL, size);
+    if (res == NULL)
+        return NULL;
+    buf = PyString_AS_STRING(res);
+    memcpy(buf, &header, sizeof(header));
+    offset = sizeof(header) + bm->ncontainers * sizeof(ContainerDir);
+    for (i = 0; i < bm->ncontainers; i++) {
+        Container *c = &bm->containers[i];
+        ContainerDir dir;
+
+        dir.key = c->key;
+        dir.type = c->type;
+        dir.card = c->card;
+        dir.offset = offset;
+        memcpy(buf + sizeof(header) + i * sizeof(dir), &dir, sizeof(dir));
+        if (c->type == TYPE_ARRAY) {
+            memcpy(buf + offset, c->array, c->card * sizeof(uint16_t));
+            offset += c->card * sizeof(uint16_t);
+        } else {
+            memcpy(buf + offset, c->bits, BITMAP_WORDS * sizeof(uint64_t));
+            offset += BITMAP_WORDS * sizeof(uint64_t);
+        }
+    }
+    return res;
+}
+
+/* Parse a sequence of bitmap string arguments */
+static Bitmap *unpack_args(PyObject *args, int *count)
+{
+    int i, n = PyTuple_Size(args);
+    Bitmap *bitmaps;
+
+    if (n < 1) {
+        PyErr_SetString(PyExc_TypeError, "at least one bitmap required");
+        return NULL;
+    }
+    if ((bitmaps = calloc(n, sizeof(Bitmap))) == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (i = 0; i < n; i++)
+        if (unpack_bitmap(PyTuple_GET_ITEM(args, i), &bitmaps[i]) < 0) {
+            while (--i >= 0)
+                free_bitmap(&bitmaps[i]);
+            free(bitmaps);
+            return NULL;
+        }
+    *count = n;
+    return bitmaps;
+}
+
+static void free_args(Bitmap *bitmaps, int count)
+{
+    int i;
+
+    for (i = 0; i < count; i++)
+        free_bitmap(&bitmaps[i]);
+    free(bitmaps);
+}
+
+/* ------------------------------------------------------------------
+ * Container operations - results are added to the end of "res"
+ */
+static int and_containers(Bitmap *res, Container *a, Container *b)
+{
+    Container *c;
+    uint32_t i, j;
+
+    if ((c = add_container(res, a->key)) == NULL)
+        return -1;
+    if (a->type == TYPE_BITMAP && b->type == TYPE_BITMAP) {
+        uint64_t *bits = alloc_bits();
+        if (bits == NULL)
+            return -1;
+        for (i = 0; i < BITMAP_WORDS; i++)
+            bits[i] = a->bits[i] & b->bits[i];
+        if (set_container_bits(c, bits) < 0)
+            return -1;
+    } else {
+        if (a->type == TYPE_BITMAP) {
+            Container *t = a;
+            a = b;
+            b = t;
+        }
+        /* a is now an array container */
+        c->type = TYPE_ARRAY;
+        if ((c->array = alloc_array(a->card)) == NULL)
+            return -1;
+        if (b->type == TYPE_BITMAP) {
+            for (i = 0; i < a->card; i++)
+                if (container_contains(b, a->array[i]))
+                    c->array[c->card++] = a->array[i];
+        } else {
+            i = j = 0;
+            while (i < a->card && j < b->card) {
+                if (a->array[i] < b->array[j])
+                    i++;
+                else if (a->array[i] > b->array[j])
+                    j++;
+                else {
+                    c->array[c->card++] = a->array[i];
+                    i++;
+                    j++;
+                }
+            }
+        }
+    }
+    trim_container(res);
+    return 0;
+}
+
+static int or_containers(Bitmap *res, Container *a, Container *b)
+{
+    Container *c;
+    uint32_t i, j;
+
+    if ((c = add_container(res, a->key)) == NULL)
+        return -1;
+    if (a->type == TYPE_ARRAY && b->type == TYPE_ARRAY
+        && a->card + b->card <= ARRAY_MAX) {
+        c->type = TYPE_ARRAY;
+        if ((c->array = alloc_array(a->card + b->card)) == NULL)
+            return -1;
+        i = j = 0;
+        while (i < a->card || j < b->card) {
+            if (j >= b->card || (i < a->card && a->array[i] < b->array[j]))
+                c->array[c->card++] = a->array[i++];
+            else if (i >= a->card || b->array[j] < a->array[i])
+                c->array[c->card++] = b->array[j++];
+            else {
+                c->array[c->card++] = a->array[i];
+                i++;
+                j++;
+            }
+        }
+    } else {
+        uint64_t *bits = alloc_bits();
+        if (bits == NULL)
+            return -1;
+        container_bits(a, bits);
+        if (b->type == TYPE_BITMAP)
+            for (i = 0; i < BITMAP_WORDS; i++)
+                bits[i] |= b->bits[i];
+        else
+            container_bits(b, bits);
+        if (set_container_bits(c, bits) < 0)
+            return -1;
+    }
+    return 0;
+}
+
+static int andnot_containers(Bitmap *res, Container *a, Container *b)
+{
+    Container *c;
+    uint32_t i, j;
+
+    if ((c = add_container(res, a->key)) == NULL)
+        return -1;
+    if (a->type == TYPE_ARRAY) {
+        c->type = TYPE_ARRAY;
+        if ((c->array = alloc_array(a->card)) == NULL)
+            return -1;
+        if (b->type == TYPE_BITMAP) {
+            for (i = 0; i < a->card; i++)
+                if (!container_contains(b, a->array[i]))
+                    c->array[c->card++] = a->array[i];
+        } else {
+            i = j = 0;
+            while (i < a->card) {
+                if (j >= b->card || a->array[i] < b->array[j])
+                    c->array[c->card++] = a->array[i++];
+                else if (a->array[i] > b->array[j])
+                    j++;
+                else {
+                    i++;
+                    j++;
+                }
+            }
+        }
+    } else {
+        uint64_t *bits = alloc_bits();
+        if (bits == NULL)
+            return -1;
+        memcpy(bits, a->bits, BITMAP_WORDS * sizeof(uint64_t));
+        if (b->type == TYPE_BITMAP)
+            for (i = 0; i < BITMAP_WORDS; i++)
+                bits[i] &= ~b->bits[i];
+        else
+            for (i = 0; i < b->card; i++)
+                bits[b->array[i] >> 6] &= ~((uint64_t)1 << (b->array[i] & 63));
+        if (set_container_bits(c, bits) < 0)
+            return -1;
+    }
+    trim_container(res);
+    return 0;
+}
+
+static int copy_container(Bitmap *res, Container *a)
+{
+    Container *c;
+
+    if ((c = add_container(res, a->key)) == NULL)
+        return -1;
+    c->type = a->type;
+    c->card = a->card;
+    if (a->type == TYPE_ARRAY) {
+        if ((c->array = alloc_array(a->card)) == NULL)
+            return -1;
+        memcpy(c->array, a->array, a->card * sizeof(uint16_t));
+    } else {
+        if ((c->bits = alloc_bits()) == NULL)
+            return -1;
+        memcpy(c->bits, a->bits, BITMAP_WORDS * sizeof(uint64_t));
+    }
+    return 0;
+}
+
+/* ------------------------------------------------------------------
+ * Bitmap operations
+ */
+static int and_bitmaps(Bitmap *res, Bitmap *a, Bitmap *b)
+{
+    int i = 0, j = 0;
+
+    memset(res, 0, sizeof(*res));
+    while (i < a->ncontainers && j < b->ncontainers) {
+        Container *ca = &a->containers[i], *cb = &b->containers[j];
+        if (ca->key < cb->key)
+            i++;
+        else if (ca->key > cb->key)
+            j++;
+        else {
+            if (and_containers(res, ca, cb) < 0)
+                goto error;
+            i++;
+            j++;
+        }
+    }
+    return 0;
+
+error:
+    free_bitmap(res);
+    return -1;
+}
+
+static int or_bitmaps(Bitmap *res, Bitmap *a, Bitmap *b)
+{
+    int i = 0, j = 0, rc;
+
+    memset(res, 0, sizeof(*res));
+    while (i < a->ncontainers || j < b->ncontainers) {
+        Container *ca = i < a->ncontainers ? &a->containers[i] : NULL;
+        Container *cb = j < b->ncontainers ? &b->containers[j] : NULL;
+        if (cb == NULL || (ca != NULL && ca->key < cb->key)) {
+            rc = copy_container(res, ca);
+            i++;
+        } else if (ca == NULL || cb->key < ca->key) {
+            rc = copy_container(res, cb);
+            j++;
+        } else {
+            rc = or_containers(res, ca, cb);
+            i++;
+            j++;
+        }
+        if (rc < 0)
+            goto error;
+    }
+    return 0;
+
+error:
+    free_bitmap(res);
+    return -1;
+}
+
+static int andnot_bitmaps(Bitmap *res, Bitmap *a, Bitmap *b)
+{
+    int i, rc;
+
+    memset(res, 0, sizeof(*res));
+    for (i = 0; i < a->ncontainers; i++) {
+        Container *ca = &a->containers[i];
+        Container *cb = find_container(b, ca->key);
+        if (cb == NULL)
+            rc = copy_container(res, ca);
+        else
+            rc = andnot_containers(res, ca, cb);
+        if (rc < 0)
+            goto error;
+    }
+    return 0;
+
+error:
+    free_bitmap(res);
+    return -1;
+}
+
+static long count_and_containers(Container *a, Container *b)
+{
+    long count = 0;
+    uint32_t i, j;
+
+    if (a->type == TYPE_BITMAP && b->type == TYPE_BITMAP) {
+        for (i = 0; i < BITMAP_WORDS; i++)
+            count += popcount64(a->bits[i] & b->bits[i]);
+    } else {
+        if (a->type == TYPE_BITMAP) {
+            Container *t = a;
+            a = b;
+            b = t;
+        }
+        if (b->type == TYPE_BITMAP) {
+            for (i = 0; i < a->card; i++)
+                count += container_contains(b, a->array[i]);
+        } else {
+            i = j = 0;
+            while (i < a->card && j < b->card) {
+                if (a->array[i] < b->array[j])
+                    i++;
+                else if (a->array[i] > b->array[j])
+                    j++;
+                else {
+                    count++;
+                    i++;
+                    j++;
+                }
+            }
+        }
+    }
+    return count;
+}
+
+static long count_and_bitmaps(Bitmap *a, Bitmap *b)
+{
+    long count = 0;
+    int i = 0, j = 0;
+
+    while (i < a->ncontainers && j < b->ncontainers) {
+        Container *ca = &a->containers[i], *cb = &b->containers[j];
+        if (ca->key < cb->key)
+            i++;
+        else if (ca->key > cb->key)
+            j++;
+        else {
+            count += count_and_containers(ca, cb);
+            i++;
+            j++;
+        }
+    }
+    return count;
+}
+
+typedef int (*BitmapOp)(Bitmap *res, Bitmap *a, Bitmap *b);
+
+/* Fold "op" across all the bitmap arguments */
+static PyObject *reduce_bitmaps(PyObject *args, BitmapOp op)
+{
+    Bitmap *bitmaps, acc, res;
+    PyObject *result;
+    int i, count;
+
+    if ((bitmaps = unpack_args(args, &count)) == NULL)
+        return NULL;
+    acc = bitmaps[0];
+    memset(&bitmaps[0], 0, sizeof(Bitmap));
+    for (i = 1; i < count; i++) {
+        if (op(&res, &acc, &bitmaps[i]) < 0) {
+            free_bitmap(&acc);
+            free_args(bitmaps, count);
+            return NULL;
+        }
+        free_bitmap(&acc);
+        acc = res;
+    }
+    free_args(bitmaps, count);
+    result = pack_bitmap(&acc);
+    free_bitmap(&acc);
+    return result;
+}
+
+/* ------------------------------------------------------------------
+ * Module functions
+ */
+static char soombitmap_from_ids__doc__[] =
+"from_ids(ids) -> bitmap\n"
+"\n"
+"    Return a bitmap of the row ids in the string \"ids\" (the\n"
+"    tostring() of a Numeric.Int array). The ids must be in\n"
+"    ascending order with no duplicates.\n";
+
+static PyObject *soombitmap_from_ids(PyObject *module, PyObject *args)
+{
+    const long *ids;
+    int len, count, i, start;
+    Bitmap bm;
+    PyObject *res;
+
+    if (!PyArg_ParseTuple(args, "s#:from_ids", (char **)&ids, &len))
+        return NULL;
+    if (len % sizeof(long)) {
+        PyErr_SetString(PyExc_ValueError, "ids string is not a whole number of C longs");
+        return NULL;
+    }
+    count = len / sizeof(long);
+    for (i = 0; i < count; i++)
+        if (ids[i] < 0 || ids[i] > 0xffffffffL
+            || (i > 0 && ids[i] <= ids[i - 1])) {
+            PyErr_SetString(PyExc_ValueError, "ids must be ascending, unique and between 0 and 2**32-1");
+            return NULL;
+        }
+    memset(&bm, 0, sizeof(bm));
+    for (start = 0; start < count; start = i) {
+        uint16_t key = (uint16_t)(ids[start] >> 16);
+        Container *c;
+
+        for (i = start; i < count && (ids[i] >> 16) == key; i++)
+            ;
+        if ((c = add_container(&bm, key)) == NULL)
+            goto error;
+        c->card = i - start;
+        if (c->card > ARRAY_MAX) {
+            int j;
+            c->type = TYPE_BITMAP;
+            if ((c->bits = alloc_bits()) == NULL)
+                goto error;
+            for (j = start; j < i; j++)
+                c->bits[(ids[j] & 0xffff) >> 6] |= (uint64_t)1 << (ids[j] & 63);
+        } else {
+            int j;
+            c->type = TYPE_ARRAY;
+            if ((c->array = alloc_array(c->card)) == NULL)
+                goto error;
+            for (j = start; j < i; j++)
+                c->array[j - start] = (uint16_t)(ids[j] & 0xffff);
+        }
+    }
+    res = pack_bitmap(&bm);
+    free_bitmap(&bm);
+    return res;
+
+error:
+    free_bitmap(&bm);
+    return NULL;
+}
+
+static char soombitmap_to_ids__doc__[] =
+"to_ids(bitmap) -> ids\n"
+"\n"
+"    Return the row ids in the bitmap as a string of C longs\n"
+"    in ascending order (suitable for Numeric.fromstring()).\n";
+
+static PyObject *soombitmap_to_ids(PyObject *module, PyObject *args)
+{
+    PyObject *obj, *res;
+    Bitmap bm;
+    long *ids;
+    size_t count = 0;
+    int i;
+
+    if (!PyArg_ParseTuple(args, "O!:to_ids", &PyString_Type, &obj))
+        return NULL;
+    if (unpack_bitmap(obj, &bm) < 0)
+        return NULL;
+    for (i = 0; i < bm.ncontainers; i++)
+        count += bm.containers[i].card;
+    res = PyString_FromStringAndSize(NULL, count * sizeof(long));
+    if (res == NULL) {
+        free_bitmap(&bm);
+        return NULL;
+    }
+    ids = (long *)PyString_AS_STRING(res);
+    for (i = 0; i < bm.ncontainers; i++) {
+        Container *c = &bm.containers[i];
+        long base = (long)c->key << 16;
+        uint32_t j;
+
+        if (c->type == TYPE_ARRAY)
+            for (j = 0; j < c->card; j++)
+                *ids++ = base + c->array[j];
+        else
+            for (j = 0; j < BITMAP_WORDS; j++) {
+                uint64_t w = c->bits[j];
+                int bit;
+                for (bit = 0; w; bit++, w >>= 1)
+                    if (w & 1)
+                        *ids++ = base + j * 64 + bit;
+            }
+    }
+    free_bitmap(&bm);
+    return res;
+}
+
+static char soombitmap_popcount__doc__[] =
+"popcount(bitmap) -> int\n"
+"\n"
+"    Return the number of row ids in the bitmap.\n";
+
+static PyObject *soombitmap_popcount(PyObject *module, PyObject *args)
+{
+    const char *buf;
+    int len;
+    BitmapHeader header;
+
+    if (!PyArg_ParseTuple(args, "s#:popcount", &buf, &len))
+        return NULL;
+    if (len < (int)sizeof(header) || memcmp(buf, MAGIC, 4) != 0) {
+        PyErr_SetString(PyExc_ValueError, "not a soombitmap bitmap");
+        return NULL;
+    }
+    memcpy(&header, buf, sizeof(header));
+    return PyLong_FromUnsignedLong(header.card);
+}
+
+static char soombitmap_and___doc__[] =
+"and_(a, b, ...) -> bitmap\n"
+"\n"
+"    Return the intersection of the bitmaps passed.\n";
+
+static PyObject *soombitmap_and_(PyObject *module, PyObject *args)
+{
+    return reduce_bitmaps(args, and_bitmaps);
+}
+
+static char soombitmap_and_count__doc__[] =
+"and_count(a, b, ...) -> int\n"
+"\n"
+"    Return the number of row ids in the intersection of the\n"
+"    bitmaps passed, without building the (final) intersection.\n";
+
+static PyObject *soombitmap_and_count(PyObject *module, PyObject *args)
+{
+    Bitmap *bitmaps, acc, res;
+    long count;
+    int i, count_args;
+
+    if ((bitmaps = unpack_args(args, &count_args)) == NULL)
+        return NULL;
+    if (count_args == 1) {
+        for (count = 0, i = 0; i < bitmaps[0].ncontainers; i++)
+            count += bitmaps[0].containers[i].card;
+        free_args(bitmaps, count_args);
+        return PyInt_FromLong(count);
+    }
+    acc = bitmaps[0];
+    memset(&bitmaps[0], 0, sizeof(Bitmap));
+    for (i = 1; i < count_args - 1; i++) {
+        if (and_bitmaps(&res, &acc, &bitmaps[i]) < 0) {
+            free_bitmap(&acc);
+            free_args(bitmaps, count_args);
+            return NULL;
+        }
+        free_bitmap(&acc);
+        acc = res;
+    }
+    count = count_and_bitmaps(&acc, &bitmaps[count_args - 1]);
+    free_bitmap(&acc);
+    free_args(bitmaps, count_args);
+    return PyInt_FromLong(count);
+}
+
+static char soombitmap_or___doc__[] =
+"or_(a, b, ...) -> bitmap\n"
+"\n"
+"    Return the union of the bitmaps passed.\n";
+
+static PyObject *soombitmap_or_(PyObject *module, PyObject *args)
+{
+    return reduce_bitmaps(args, or_bitmaps);
+}
+
+static char soombitmap_andnot__doc__[] =
+"andnot(a, b, ...) -> bitmap\n"
+"\n"
+"    Return the result of removing the second and subsequent\n"
+"    bitmaps from the first.\n";
+
+static PyObject *soombitmap_andnot(PyObject *module, PyObject *args)
+{
+    return reduce_bitmaps(args, andnot_bitmaps);
+}
+
+static char soombitmap_complement__doc__[] =
+"complement(bitmap, size) -> bitmap\n"
+"\n"
+"    Return a bitmap of the row ids in range(size) that are\n"
+"    not in the bitmap.\n";
+
+static PyObject *soombitmap_complement(PyObject *module, PyObject *args)
+{
+    PyObject *obj, *result = NULL;
+    long size;
+    Bitmap bm, res;
+    uint32_t key, nkeys;
+
+    if (!PyArg_ParseTuple(args, "O!l:complement", &PyString_Type, &obj, &size))
+        return NULL;
+    if (size < 0 || size > 0x100000000L) {
+        PyErr_SetString(PyExc_ValueError, "size must be between 0 and 2**32");
+        return NULL;
+    }
+    if (unpack_bitmap(obj, &bm) < 0)
+        return NULL;
+    memset(&res, 0, sizeof(res));
+    nkeys = (uint32_t)((size + CONTAINER_ROWS - 1) / CONTAINER_ROWS);
+    for (key = 0; key < nkeys; key++) {
+        long rows = size - (long)key * CONTAINER_ROWS;
+        Container *c, *cb;
+        uint64_t *bits;
+        int i;
+
+        if ((bits = alloc_bits()) == NULL)
+            goto error;
+        if (rows > CONTAINER_ROWS)
+            rows = CONTAINER_ROWS;
+        for (i = 0; i < rows / 64; i++)
+            bits[i] = ~(uint64_t)0;
+        if (rows % 64)
+            bits[i] = ((uint64_t)1 << (rows % 64)) - 1;
+        if ((cb = find_container(&bm, (uint16_t)key)) != NULL) {
+            if (cb->type == TYPE_BITMAP)
+                for (i = 0; i < BITMAP_WORDS; i++)
+                    bits[i] &= ~cb->bits[i];
+            else
+                for (i = 0; i < (int)cb->card; i++)
+                    bits[cb->array[i] >> 6] &= ~((uint64_t)1 << (cb->array[i] & 63));
+        }
+        if ((c = add_container(&res, (uint16_t)key)) == NULL) {
+            free(bits);
+            goto error;
+        }
+        if (set_container_bits(c, bits) < 0)
+            goto error;
+        trim_container(&res);
+    }
+    result = pack_bitmap(&res);
+
+error:
+    free_bitmap(&bm);
+    free_bitmap(&res);
+    return result;
+}
+
+static char soombitmap_and_ids__doc__[] =
+"and_ids(bitmap, ids) -> ids\n"
+"\n"
+"    Return the row ids in the string \"ids\" (a string of C longs)\n"
+"    that are also in the bitmap, preserving their order.\n";
+
+static PyObject *soombitmap_and_ids(PyObject *module, PyObject *args)
+{
+    PyObject *obj, *res;
+    const long *ids;
+    long *out;
+    int len, count, i, n = 0;
+    Bitmap bm;
+    Container *c = NULL;
+
+    if (!PyArg_ParseTuple(args, "O!s#:and_ids", &PyString_Type, &obj,
+                          (char **)&ids, &len))
+        return NULL;
+    if (len % sizeof(long)) {
+        PyErr_SetString(PyExc_ValueError, "ids string is not a whole number of C longs");
+        return NULL;
+    }
+    count = len / sizeof(long);
+    if (unpack_bitmap(obj, &bm) < 0)
+        return NULL;
+    if ((out = malloc((count ? count : 1) * sizeof(long))) == NULL) {
+        free_bitmap(&bm);
+        return PyErr_NoMemory();
+    }
+    for (i = 0; i < count; i++) {
+        long id = ids[i];
+        uint16_t key;
+
+        if (id < 0 || id > 0xffffffffL)
+            continue;
+        key = (uint16_t)(id >> 16);
+        if (c == NULL || c->key != key)
+            if ((c = find_container(&bm, key)) == NULL)
+                continue;
+        if (container_contains(c, (uint16_t)(id & 0xffff)))
+            out[n++] = id;
+    }
+    res = PyString_FromStringAndSize((char *)out, n * sizeof(long));
+    free(out);
+    free_bitmap(&bm);
+    return res;
+}
+
+static struct PyMethodDef soombitmap_methods[] = {
+    { "from_ids", (PyCFunction)soombitmap_from_ids, METH_VARARGS, soombitmap_from_ids__doc__ },
+    { "to_ids", (PyCFunction)soombitmap_to_ids, METH_VARARGS, soombitmap_to_ids__doc__ },
+    { "popcount", (PyCFunction)soombitmap_popcount, METH_VARARGS, soombitmap_popcount__doc__ },
+    { "and_", (PyCFunction)soombitmap_and_, METH_VARARGS, soombitmap_and___doc__ },
+    { "and_count", (PyCFunction)soombitmap_and_count, METH_VARARGS, soombitmap_and_count__doc__ },
+    { "or_", (PyCFunction)soombitmap_or_, METH_VARARGS, soombitmap_or___doc__ },
+    { "andnot", (PyCFunction)soombitmap_andnot, METH_VARARGS, soombitmap_andnot__doc__ },
+    { "complement", (PyCFunction)soombitmap_complement, METH_VARARGS, soombitmap_complement__doc__ },
+    { "and_ids", (PyCFunction)soombitmap_and_ids, METH_VARARGS, soombitmap_and_ids__doc__ },
+    { NULL, (PyCFunction)NULL, 0, NULL } /* sentinel */
+};
+
+static char soombitmap_module__doc__[] =
+"Compressed (roaring style) bitmaps of row ids, used as an\n"
+"alternative to sorted row id vectors in SOOM inverted indexes.\n";
+
+void initsoombitmap(void)
+{
+    PyObject *module, *dict, *ver = NULL;
+
+    module = Py_InitModule4("soombitmap", soombitmap_methods,
+                            soombitmap_module__doc__,
+                            (PyObject*)NULL, PYTHON_API_VERSION);
+    if (module == NULL)
+        goto error;
+    if ((dict = PyModule_GetDict(module)) == NULL)
+        goto error;
+    if ((ver = PyString_FromString("0.1")) == NULL)
+        goto error;
+    if (PyDict_SetItemString(dict, "__version__", ver) < 0)
+        goto error;
+
+error:
+    Py_XDECREF(ver);
+    if (PyErr_Occurred())
+        Py_FatalError("can't initialize module soombitmap");
+}
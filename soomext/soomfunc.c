@@ -262,7 +262,7 @@ static void sparse_##NAME(ArrayInfo *info1, ArrayInfo *info2, ArrayInfo *info_re
 { \
     char *data1 = info1->array->data; \
     char *data2 = info2->array->data; \
-    char *data_res = info_res->array->data; \
+    char *data_res = info_res->array ? info_res->array->data : NULL; \
     int index1, index2, index_res; \
     int stride1, stride2, stride_res; \
     int len1, len2; \
@@ -302,9 +302,11 @@ static void sparse_##NAME(ArrayInfo *info1, ArrayInfo *info2, ArrayInfo *info_re
 	    char *match_value; \
  \
 	    match_value = data1; \
-	    *(TYPE *)data_res = *(TYPE *)data1; \
+	    if (data_res != NULL) { \
+		*(TYPE *)data_res = *(TYPE *)data1; \
+		data_res += stride_res; \
+	    } \
 	    index_res++; \
-	    data_res += stride_res; \
  \
 	    index1++; \
 	    data1 += stride1; \
@@ -330,7 +332,7 @@ static void dense_##NAME(ArrayInfo *info1, ArrayInfo *info2, ArrayInfo *info_res
 { \
     char *data1 = info1->array->data; \
     char *data2 = info2->array->data; \
-    char *data_res = info_res->array->data; \
+    char *data_res = info_res->array ? info_res->array->data : NULL; \
     int index1, index2, index_res; \
     int stride1, stride2, stride_res; \
     int len1, len2; \
@@ -355,9 +357,11 @@ static void dense_##NAME(ArrayInfo *info1, ArrayInfo *info2, ArrayInfo *info_res
 	    char *match_value; \
  \
 	    match_value = data1; \
-	    *(TYPE *)data_res = *(TYPE *)data1; \
+	    if (data_res != NULL) { \
+		*(TYPE *)data_res = *(TYPE *)data1; \
+		data_res += info_res->stride; \
+	    } \
 	    index_res++; \
-	    data_res += info_res->stride; \
  \
 	    index1++; \
 	    data1 += stride1; \
@@ -420,10 +424,15 @@ static int ai_size_cmp(const void *info1, const void *info2)
     return (((ArrayInfo *)info1)->len - ((ArrayInfo *)info2)->len);
 }
 
-static PyObject *intersect_with(IntersectTable *table, PyObject *args)
+/* If count_only, the size of the intersection is returned, and
+ * the final (and for two arrays, only) intersection is counted
+ * without being stored.
+ */
+static PyObject *intersect_with(IntersectTable *table, PyObject *args,
+				int count_only)
 {
-    ArrayInfo *array_info, info1, *info2, info_ret;
-    PyArrayObject *ret;
+    ArrayInfo *array_info, info1, *info2, info_ret, info_count, *info_res;
+    PyArrayObject *ret = NULL;
     int shape[1];
     int alloc_size, i;
     int type_num, num_arrays;
@@ -442,13 +451,17 @@ static PyObject *intersect_with(IntersectTable *table, PyObject *args)
     alloc_size = array_info->len;
 
     /* Build the array to capture the intersection */
-    shape[0] = alloc_size;
-    ret = (PyArrayObject *)PyArray_FromDims(1, shape, type_num);
-    if (ret == NULL) {
-	free_array_info(array_info, num_arrays);
-	return NULL;
+    memset(&info_ret, 0, sizeof(info_ret));
+    memset(&info_count, 0, sizeof(info_count));
+    if (!count_only || num_arrays > 2) {
+	shape[0] = alloc_size;
+	ret = (PyArrayObject *)PyArray_FromDims(1, shape, type_num);
+	if (ret == NULL) {
+	    free_array_info(array_info, num_arrays);
+	    return NULL;
+	}
+	set_array_info(&info_ret, ret);
     }
-    set_array_info(&info_ret, ret);
 
     /* Generate the intersection.  Intersect the smallest array with
      * each other array - after each operation subsitute the result
@@ -459,36 +472,44 @@ static PyObject *intersect_with(IntersectTable *table, PyObject *args)
     info2 = array_info + 1;
     while (i < num_arrays && info1.len > 0)
     {
+	if (count_only && i == num_arrays - 1)
+	    info_res = &info_count;
+	else
+	    info_res = &info_ret;
 	switch (type_num) {
 	case PyArray_CHAR:
 	case PyArray_SBYTE:
-	    table->schar_func(&info1, info2, &info_ret);
+	    table->schar_func(&info1, info2, info_res);
 	    break;
 	case PyArray_UBYTE:
-	    table->uchar_func(&info1, info2, &info_ret);
+	    table->uchar_func(&info1, info2, info_res);
 	    break;
 	case PyArray_SHORT:
-	    table->short_func(&info1, info2, &info_ret);
+	    table->short_func(&info1, info2, info_res);
 	    break;
 	case PyArray_INT:
-	    table->int_func(&info1, info2, &info_ret);
+	    table->int_func(&info1, info2, info_res);
 	    break;
 	case PyArray_LONG:
-	    table->long_func(&info1, info2, &info_ret);
+	    table->long_func(&info1, info2, info_res);
 	    break;
 	case PyArray_FLOAT:
-	    table->float_func(&info1, info2, &info_ret);
+	    table->float_func(&info1, info2, info_res);
 	    break;
 	case PyArray_DOUBLE: 
-	    table->double_func(&info1, info2, &info_ret);
+	    table->double_func(&info1, info2, info_res);
 	    break;
 	}
-	info1 = info_ret;
+	info1 = *info_res;
 	i++;
 	info2++;
     }
     free_array_info(array_info, num_arrays);
 
+    if (count_only) {
+	Py_XDECREF(ret);
+	return PyInt_FromLong(info1.len);
+    }
     ret->dimensions[0] = info_ret.len;
     return (PyObject *)ret;
 }
@@ -511,7 +532,29 @@ static PyObject *soomfunc_intersect(PyObject *module, PyObject *args)
 	intersect_double
     };
 
-    return intersect_with(&intersect, args);
+    return intersect_with(&intersect, args, 0);
+}
+
+static char soomfunc_intersect_count__doc__[] =
+"intersect_count(a, b, ...) -> int\n"
+"\n"
+"    Return the size of the intersection of the rank-1 arrays\n"
+"    passed, without building the (final) intersection.  All arrays\n"
+"    must have the same typecode.\n";
+
+static PyObject *soomfunc_intersect_count(PyObject *module, PyObject *args)
+{
+    static IntersectTable intersect = {
+	intersect_schar,
+	intersect_uchar,
+	intersect_short,
+	intersect_int,
+	intersect_long,
+	intersect_float,
+	intersect_double
+    };
+
+    return intersect_with(&intersect, args, 1);
 }
 
 static char soomfunc_dense_intersect__doc__[] =
@@ -532,7 +575,7 @@ static PyObject *soomfunc_dense_intersect(PyObject *module, PyObject *args)
 	dense_intersect_double
     };
 
-    return intersect_with(&dense_intersect, args);
+    return intersect_with(&dense_intersect, args, 0);
 }
 
 static char soomfunc_sparse_intersect__doc__[] =
@@ -553,7 +596,7 @@ static PyObject *soomfunc_sparse_intersect(PyObject *module, PyObject *args)
 	sparse_intersect_double
     };
 
-    return intersect_with(&sparse_intersect, args);
+    return intersect_with(&sparse_intersect, args, 0);
 }
 
 #define outersect_func(NAME, TYPE) \
@@ -1335,6 +1378,7 @@ static PyObject *soomfunc_strip_word(PyObject *module, PyObject *args)
 static struct PyMethodDef soomfunc_methods[] = {
     { "unique", (PyCFunction)soomfunc_unique, METH_VARARGS, soomfunc_unique__doc__ },
     { "intersect", (PyCFunction)soomfunc_intersect, METH_VARARGS, soomfunc_intersect__doc__ },
+    { "intersect_count", (PyCFunction)soomfunc_intersect_count, METH_VARARGS, soomfunc_intersect_count__doc__ },
     { "sparse_intersect", (PyCFunction)soomfunc_sparse_intersect, METH_VARARGS, soomfunc_sparse_intersect__doc__ },
     { "dense_intersect", (PyCFunction)soomfunc_dense_intersect, METH_VARARGS, soomfunc_dense_intersect__doc__ },
     { "outersect", (PyCFunction)soomfunc_outersect, METH_VARARGS, soomfunc_outersect__doc__ },
@@ -136,7 +136,7 @@ static int init_store(MmapBlobStore *sm)
  * This is a bit complex because the table is actually contained in
  * space managed by the table.
  */
-static int grow_table(MmapBlobStore *sm)
+static int grow_table(MmapBlobStore *sm, int table_size)
 {
     BlobDesc *last_desc, *table_desc, *new_table_desc;
     int old_table_index;
@@ -146,7 +146,7 @@ static int grow_table(MmapBlobStore *sm)
     /* the location of the new table will be at the end of the file */
     last_desc = get_desc(sm, sm->header->table_len - 1);
     new_table_loc = last_desc->loc + last_desc->size;
-    data_len = (sm->header->table_size + TABLE_INC) * sizeof(*last_desc);
+    data_len = table_size * sizeof(*last_desc);
     data_size = data_align(data_len);
     if (new_table_loc + data_size >= sm->size) {
 	/* grow the file */
@@ -164,7 +164,7 @@ static int grow_table(MmapBlobStore *sm)
 
     /* update the file header */
     sm->header->table_loc = new_table_loc;
-    sm->header->table_size += TABLE_INC;
+    sm->header->table_size = table_size;
     sm->header->table_index = sm->header->table_len;
     /* now setup new desc for new desc table */
     new_table_desc = get_desc(sm, sm->header->table_len);
@@ -227,7 +227,7 @@ static int allocate_new_blob(MmapBlobStore *sm, size_t data_len, int status)
     data_size = data_align(data_len);
     if (sm->header->table_len == sm->header->table_size) {
 	/* grow the table */
-	if (grow_table(sm) < 0)
+	if (grow_table(sm, sm->header->table_size + TABLE_INC) < 0)
 	    return -1;
     }
     prev_desc = get_desc(sm, sm->header->table_len - 1);
@@ -552,6 +552,76 @@ int store_blob_free(MmapBlobStore *sm, int index)
     return 0;
 }
 
+/* Make room for nblobs new BLOBs holding data_len bytes between
+ * them: grow the file once, and the BlobDesc table and BLOB sequence
+ * to their final size, so the BLOBs can be added (contiguously, at
+ * the end of the file) without the file being remapped for each -
+ * return success status.
+ */
+int store_reserve(MmapBlobStore *sm, size_t data_len, int nblobs)
+{
+    BlobDesc *last_desc;
+    off_t min_size;
+    int table_size, seq_size;
+
+    if (nblobs < 0) {
+	PyErr_SetString(PyExc_ValueError, "nblobs must not be negative");
+	return -1;
+    }
+    /* the table and sequence each need a BlobDesc when they move */
+    table_size = sm->header->table_size;
+    if (sm->header->table_len + nblobs + 2 >= table_size)
+	table_size = sm->header->table_len + nblobs + 2 + TABLE_INC;
+    seq_size = sm->header->seq_size;
+    if (sm->header->seq_index >= 0 && sm->header->seq_len + nblobs >= seq_size)
+	seq_size = sm->header->seq_len + nblobs + TABLE_INC;
+
+    last_desc = get_desc(sm, sm->header->table_len - 1);
+    min_size = last_desc->loc + last_desc->size + data_len
+	+ nblobs * sizeof(int)	/* alignment */
+	+ data_align(table_size * sizeof(*last_desc))
+	+ data_align(seq_size * sizeof(int));
+    if (min_size >= sm->size)
+	if (grow_file(sm, min_size + 1) < 0)
+	    return -1;
+
+    if (table_size != sm->header->table_size)
+	if (grow_table(sm, table_size) < 0)
+	    return -1;
+    if (seq_size != sm->header->seq_size) {
+	int new_index;
+
+	new_index = grow_blob(sm, sm->header->seq_index,
+			      seq_size * sizeof(int));
+	if (new_index < 0)
+	    return -1;
+	sm->header->seq_index = new_index;
+	sm->header->seq_size = seq_size;
+    }
+    return 0;
+}
+
+/* Flush the mapped file to disc - MS_ASYNC schedules the writes,
+ * with do_fsync, wait for them and fsync() the file - return success
+ * status.
+ */
+int store_sync(MmapBlobStore *sm, int do_fsync)
+{
+    if (!(sm->prot & PROT_WRITE))
+	return 0;
+    if (sm->header != (StoreHeader*)-1) {
+	if (msync(sm->header, sm->size, do_fsync ? MS_SYNC : MS_ASYNC) < 0) {
+	    PyErr_SetFromErrnoWithFilename(PyExc_IOError, "msync");
+	    return -1;
+	}
+    }
+    if (do_fsync && fsync(sm->fd) < 0) {
+	PyErr_SetFromErrnoWithFilename(PyExc_IOError, "fsync");
+	return -1;
+    }
+    return 0;
+}
+
 /* Compress all free space out of the BLOB store - return amount of
  * space freed.
  */
@@ -67,3 +67,5 @@ BlobDesc *store_get_blobdesc(MmapBlobStore *sm, int index, int from_seq);
 int store_blob_resize(MmapBlobStore *sm, int index, size_t data_len);
 int store_blob_free(MmapBlobStore *sm, int index);
 int store_blob_size(MmapBlobStore *sm, int index);
+int store_reserve(MmapBlobStore *sm, size_t data_len, int nblobs);
+int store_sync(MmapBlobStore *sm, int do_fsync);
@@ -27,6 +27,7 @@ import unittest
 class AllTestSuite(unittest.TestSuite):
     all_tests = [
         "soomfunctest",
+        "soombitmaptest",
     ]
 
     def __init__(self):
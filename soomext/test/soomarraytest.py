@@ -86,6 +86,61 @@ class ArrayDictTest(unittest.TestCase):
             except UnboundLocalError: pass
             tmpfile.done()
 
+    def test_keydir(self):
+        keys = range(0, 3000, 3) + ['a', 'b', None, (1, 'x')]
+        tmpfile = TempFile('soomtestarray_tmpfile')
+        try:
+            a = soomarray.ArrayDict(tmpfile.fn(), 'w')
+            for key in keys:
+                a[key] = Numeric.array([len(str(key))])
+            del a
+            a = soomarray.ArrayDict(tmpfile.fn(), 'r')
+            self.failUnless(isinstance(a.dict, soomarray._KeyDirectory))
+            self.assertEqual(len(a), len(keys))
+            keys.sort()
+            self.assertEqual(list(a.iterkeys()), keys)
+            for key in keys:
+                self.assertEqual(list(a[key]), [len(str(key))])
+            self.failIf(a.has_key(1))
+            self.assertEqual(a.get('c'), None)
+            self.assertRaises(KeyError, a.__getitem__, 3001)
+            del a
+            # Adding a key rewrites the directory
+            a = soomarray.ArrayDict(tmpfile.fn(), 'r+')
+            a['c'] = 'see'
+            del a['a']
+            del a
+            a = soomarray.ArrayDict(tmpfile.fn(), 'r')
+            self.assertEqual(a['c'], 'see')
+            self.failIf(a.has_key('a'))
+            self.assertEqual(len(a), len(keys))
+        finally:
+            try: del a
+            except UnboundLocalError: pass
+            tmpfile.done()
+
+    def test_update(self):
+        values = {}
+        for i in range(2000):
+            values[i] = Numeric.arrayrange(i % 50)
+        values['masked'] = MA.array([1, 2, 3], mask=[0, 1, 0])
+        tmpfile = TempFile('soomtestarray_tmpfile')
+        try:
+            a = soomarray.ArrayDict(tmpfile.fn(), 'w')
+            a.begin()
+            a.update(values)
+            a.commit(fsync=True)
+            self.assertRaises(soomarray.Error, a.commit)
+            a.close()
+            a = soomarray.ArrayDict(tmpfile.fn(), 'r')
+            self.assertEqual(len(a), len(values))
+            for key, value in values.items():
+                self.assertEqual(a[key], value)
+        finally:
+            try: del a
+            except UnboundLocalError: pass
+            tmpfile.done()
+
             
 class _BSDDB_Base(unittest.TestCase):
     def _test_array(self, cls, data):
@@ -140,6 +195,70 @@ class TupleTest(_BSDDB_Base):
         self._test_array(soomarray.ArrayTuple, data)
 
 
+class HeapTest(_BSDDB_Base):
+    def test_string(self):
+        data = ['', 'qsl', 'rst', 'qrm', 'qsy', '']
+        self._test_array(soomarray.ArrayHeapString, data)
+
+    def test_tuple(self):
+        data = [(), ('abc', 'def'), ('pqr',), ('qsl', 'rst', 'qrm', 'qsy')]
+        self._test_array(soomarray.ArrayHeapTuple, data)
+        data = [(1, 'a'), (), ((2, 3), None)]
+        self._test_array(soomarray.ArrayHeapTuple, data)
+
+    def test_take(self):
+        data = ['%d' % (i * 7) for i in range(1000)]
+        tempfile = TempFile('soomarraytest_tmpfile')
+        try:
+            a = soomarray.ArrayHeapString(tempfile.fn(), 'w')
+            for i, d in enumerate(data):
+                a[i] = d
+            a.flush()
+            a = soomarray.ArrayHeapString(tempfile.fn(), 'r')
+            rows = [999, 0, 5, 5, -1]
+            self.assertEqual(a.take(rows), [data[i] for i in rows])
+            self.assertEqual(a.take([]), [])
+            self.assertEqual(a[10:20], data[10:20])
+            self.assertRaises(IndexError, a.__getitem__, 1000)
+            # Appending rows
+            a = soomarray.ArrayHeapString(tempfile.fn(), 'w')
+            a[1000] = 'new'
+            del a
+            a = soomarray.ArrayHeapString(tempfile.fn(), 'r')
+            self.assertEqual(list(a), data + ['new'])
+        finally:
+            try: del a
+            except UnboundLocalError: pass
+            tempfile.done()
+
+    def test_append_tuple(self):
+        data = [('a', 'b'), (), ('c',)]
+        tempfile = TempFile('soomarraytest_tmpfile')
+        try:
+            a = soomarray.ArrayHeapTuple(tempfile.fn(), 'w')
+            for i, d in enumerate(data):
+                a[i] = d
+            a.flush()
+            # Appended in place, held in memory until flushed
+            a = soomarray.ArrayHeapTuple(tempfile.fn(), 'w')
+            a[3] = ('d', 'e')
+            self.assertEqual(a.base, 3)
+            self.assertEqual(a[0:4], data + [('d', 'e')])
+            a.flush()
+            data.append(('d', 'e'))
+            # A new element type means the elements are rewritten
+            a = soomarray.ArrayHeapTuple(tempfile.fn(), 'w')
+            a[4] = (1, None)
+            a.flush()
+            data.append((1, None))
+            a = soomarray.ArrayHeapTuple(tempfile.fn(), 'r')
+            self.assertEqual(list(a), data)
+        finally:
+            try: del a
+            except UnboundLocalError: pass
+            tempfile.done()
+
+
 class DateTimeTest(_BSDDB_Base):
     def test_datetime(self):
         data = [DateTime(2004,1,1,0,0), 
@@ -163,6 +282,56 @@ class DateTimeTest(_BSDDB_Base):
         self._test_array(soomarray.ArrayTime, data)
 
 
+class OrdinalTest(unittest.TestCase):
+    def _test_array(self, cls, data):
+        a = cls(len(data))
+        for i, d in enumerate(data):
+            a[i] = d
+        self.assertRaises(TypeError, a.__setitem__, 0, object)
+        self.assertEqual(len(a), len(data))
+        self.assertEqual(list(a), data)
+        self.assertEqual(a[-2:], data[-2:])
+        self.assertEqual(a.take([3, 0]), [data[3], data[0]])
+        ordinals = a.ordinals()
+        self.assertEqual(list(MA.getmaskarray(ordinals)), [0, 0, 0, 1])
+        # Ordinals sort as the values do
+        self.failUnless(ordinals[1] < ordinals[0] < ordinals[2])
+        # Stored and reloaded
+        tmpfile = TempFile('soomarraytest_tmpfile')
+        try:
+            store = soomarray.ArrayDict(tmpfile.fn(), 'w')
+            store['data'] = ordinals
+            del store
+            store = soomarray.ArrayDict(tmpfile.fn(), 'r')
+            a = cls(data=store['data'])
+            self.assertEqual(list(a), data)
+        finally:
+            try: del store, a
+            except UnboundLocalError: pass
+            tmpfile.done()
+
+    def test_datetime(self):
+        data = [DateTime(2004,1,1,0,0), 
+                DateTime(1900,12,31,23,59,59), 
+                DateTime(2050,2,28),
+                None]
+        self._test_array(soomarray.ArrayDateTimeOrdinal, data)
+
+    def test_date(self):
+        data = [Date(2004,1,1), 
+                Date(1900,12,31), 
+                Date(2050,2,28),
+                None]
+        self._test_array(soomarray.ArrayDateOrdinal, data)
+
+    def test_time(self):
+        data = [Time(12,0,0),
+                Time(0,0), 
+                Time(23,59,59), 
+                None]
+        self._test_array(soomarray.ArrayTimeOrdinal, data)
+
+
 class RecodeArray(unittest.TestCase):
     def _check_data(self, r):
         self.assertEqual(list(r), ['def', None, None, 'abc'])
@@ -0,0 +1,106 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Analysis". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004,2005 Health Administration Corporation.
+#   All Rights Reserved.
+#
+"""
+Test soombitmap and the soomarray Bitmap wrapper
+
+$Id$
+$Source$
+"""
+
+import sets
+import unittest
+
+import Numeric
+import soombitmap
+import soomarray
+
+# Row id sets spanning sparse (array) and dense (bitmap) containers
+sparse = range(0, 200000, 97)
+dense = range(70000, 140000) + range(140001, 140100, 2)
+mixed = range(0, 65536, 3) + [65536, 131071, 131072, 199999]
+
+def _bitmap(ids):
+    return soomarray.Bitmap.fromids(Numeric.array(ids, typecode='l'))
+
+def _sorted(ids):
+    ids = list(ids)
+    ids.sort()
+    return ids
+
+class soombitmapCase(unittest.TestCase):
+    def test_roundtrip(self):
+        for ids in ([], [0], sparse, dense, mixed):
+            bitmap = _bitmap(ids)
+            self.assertEqual(len(bitmap), len(ids))
+            self.assertEqual(bitmap.ids().typecode(), 'l')
+            self.assertEqual(list(bitmap), ids)
+
+    def test_compression(self):
+        bitmap = _bitmap(dense)
+        self.failUnless(bitmap.nbytes() < len(dense) * 2)
+
+    def test_bad_ids(self):
+        self.assertRaises(ValueError, soomarray.Bitmap.fromids, [3, 2])
+        self.assertRaises(ValueError, soomarray.Bitmap.fromids, [3, 3])
+        self.assertRaises(ValueError, soomarray.Bitmap.fromids, [-1])
+        self.assertRaises(ValueError, soombitmap.to_ids, 'junk')
+
+    def test_and(self):
+        want = _sorted(sets.Set(sparse) & sets.Set(dense))
+        result = soomarray.intersect(_bitmap(sparse), _bitmap(dense))
+        self.failUnless(isinstance(result, soomarray.Bitmap))
+        self.assertEqual(list(result), want)
+        self.assertEqual(soombitmap.popcount(result.bitmap), len(want))
+
+    def test_count(self):
+        bitmaps = [_bitmap(sparse), _bitmap(dense), _bitmap(mixed)]
+        for i in range(1, len(bitmaps) + 1):
+            self.assertEqual(soomarray.intersect_count(*bitmaps[:i]),
+                             len(soomarray.intersect(*bitmaps[:i])))
+        vector = Numeric.array(sparse, typecode='l')
+        self.assertEqual(soomarray.intersect_count(_bitmap(dense), vector),
+                         len(sets.Set(sparse) & sets.Set(dense)))
+
+    def test_or(self):
+        want = _sorted(sets.Set(sparse + dense + mixed))
+        result = soomarray.union(_bitmap(sparse), _bitmap(dense),
+                                 _bitmap(mixed))
+        self.assertEqual(list(result), want)
+
+    def test_andnot(self):
+        want = _sorted(sets.Set(mixed) - sets.Set(dense))
+        result = soomarray.difference(_bitmap(mixed), _bitmap(dense))
+        self.assertEqual(list(result), want)
+
+    def test_complement(self):
+        want = _sorted(sets.Set(range(150000)) - sets.Set(mixed))
+        result = soomarray.complement(_bitmap(mixed), 150000)
+        self.assertEqual(list(result), want)
+
+    def test_mixed(self):
+        # Bitmaps and vectors can be combined - vectors win
+        want = _sorted(sets.Set(sparse) & sets.Set(dense))
+        vector = Numeric.array(sparse, typecode='l')
+        result = soomarray.intersect(_bitmap(dense), vector)
+        self.assertEqual(result.typecode(), 'l')
+        self.assertEqual(list(result), want)
+        result = soomarray.union(_bitmap(dense), vector)
+        self.assertEqual(list(result), _sorted(sets.Set(sparse + dense)))
+
+def suite():
+    return unittest.makeSuite(soombitmapCase)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -117,6 +117,20 @@ class intersectCase(_soomfuncTest):
             self.assertEqual(dense1, dense2)
             self.assertEqual(sparse1, dense1)
 
+    def test_count(self):
+        RandomArray.seed(0)
+        vectors = [Numeric.sort(RandomArray.randint(0, 100000, (n,)))
+                   for n in (100, 10000, 50000, 100000)]
+        for i in range(2, len(vectors) + 1):
+            args = vectors[:i]
+            self.assertEqual(soomfunc.intersect_count(*args),
+                             len(soomfunc.intersect(*args)))
+            args.reverse()
+            self.assertEqual(soomfunc.intersect_count(*args),
+                             len(soomfunc.intersect(*args)))
+        empty = Numeric.array([], typecode='l')
+        self.assertEqual(soomfunc.intersect_count(vectors[0], empty), 0)
+
 
 
 class intersectSuite(unittest.TestSuite):
@@ -128,6 +142,7 @@ class intersectSuite(unittest.TestSuite):
         "test_one",
         "test_empty",
         "test_sparse_vs_dense",
+        "test_count",
     )
     def __init__(self):
         unittest.TestSuite.__init__(self, map(intersectCase, self.test_list))
@@ -0,0 +1,217 @@
+#
+#   The contents of this file are subject to the HACOS License Version 1.2
+#   (the "License"); you may not use this file except in compliance with
+#   the License.  Software distributed under the License is distributed
+#   on an "AS IS" basis, WITHOUT WARRANTY OF ANY KIND, either express or
+#   implied. See the LICENSE file for the specific language governing
+#   rights and limitations under the License.  The Original Software
+#   is "NetEpi Analysis". The Initial Developer of the Original
+#   Software is the Health Administration Corporation, incorporated in
+#   the State of New South Wales, Australia.
+#
+#   Copyright (C) 2004,2005 Health Administration Corporation.
+#   All Rights Reserved.
+#
+# $Id$
+# $Source$
+
+import os
+import shutil
+import time
+import tempfile
+import unittest
+from mx import DateTime
+from SOOMv0 import ChunkingLoader
+from SOOMv0.Soom import soom
+from SOOMv0.common import Error
+
+class DummyDataType:
+    def __init__(self, name):
+        self.name = name
+
+class DummyCol:
+    def __init__(self, name, datatype):
+        self.name = name
+        self.datatype = DummyDataType(datatype)
+
+class DummySource(list):
+    name = 'dummy'
+
+    def get_ranges(self, nparts):
+        return None
+
+class DummyRangeSource(DummySource):
+    # Split into (start, end) row ranges, the first part being the
+    # slowest to load
+    range = None
+    fail_row = None
+
+    def get_ranges(self, nparts):
+        step = (len(self) + nparts - 1) / nparts
+        return [(start, min(start + step, len(self)))
+                for start in range(0, len(self), step)]
+
+    def open_range(self, range):
+        self.range = range
+
+    def __iter__(self):
+        start, end = self.range
+        if start == 0:
+            time.sleep(0.2)
+        for i in xrange(start, end):
+            if i == self.fail_row:
+                raise ValueError('row %d' % i)
+            yield self[i]
+
+class chunk_test(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _roundtrip(self, encoding, data, expect_encoding=None):
+        if expect_encoding is None:
+            expect_encoding = encoding
+        filename = os.path.join(self.path, 'chunk')
+        for compress in (False, True):
+            record = ChunkingLoader.encode_chunk(encoding, data, compress)
+            ChunkingLoader.write_chunk(filename, [record, record])
+            records = ChunkingLoader.read_chunk(filename)
+            self.assertEqual(len(records), 2)
+            got_encoding, count, sections = records[0]
+            self.assertEqual(got_encoding, expect_encoding)
+            self.assertEqual(count, len(data))
+            self.assertEqual(ChunkingLoader._decode_chunk(got_encoding,
+                                                          sections), data)
+            self.assertEqual(ChunkingLoader.decode_chunk(records), 
+                             data + data)
+
+    def test_int(self):
+        self._roundtrip('i', [])
+        self._roundtrip('i', [3, 1, 4, 1, 5])
+        self._roundtrip('i', [3, None, 4, None])
+        self._roundtrip('i', [3, 1.5], 'p')
+
+    def test_float(self):
+        self._roundtrip('f', [0.16, 0.78, None, 3.0])
+
+    def test_str(self):
+        self._roundtrip('s', ['pickle', '', None, 'cheese'])
+        self._roundtrip('s', ['pickle', u'cheese'], 'p')
+
+    def test_date(self):
+        self._roundtrip('D', [DateTime.Date(2004, 2, 29), None,
+                              DateTime.DateTime(1970, 1, 1, 12, 30, 15.5)])
+        self._roundtrip('D', [DateTime.Date(2004, 2, 29), '2004-02-29'], 'p')
+
+    def test_pickle(self):
+        self._roundtrip('p', [(1, 2), None, ()])
+
+    def _load(self, membudget=None):
+        columns = [DummyCol('a', 'int'), DummyCol('b', 'str'),
+                   DummyCol('c', 'tuple')]
+        loader = ChunkingLoader.ChunkingLoader(columns, self.path, 
+                                               membudget=membudget)
+        rows = [{'a': i, 'b': str(i), 'c': (i,)} for i in range(25)]
+        rows[3] = {}
+        loader.loadrows(DummySource(rows), chunkrows=10)
+        self.assertEqual(loader.rownum, 25)
+        return loader, rows
+
+    def _unchunk(self, loader, rows):
+        for col, data in loader.unchunk_columns():
+            self.assertEqual(list(data),
+                             [row.get(col.name) for row in rows])
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_loader(self):
+        # Fits in memory - no chunk files
+        loader, rows = self._load()
+        self.assertEqual(len(loader.chunks), 3)
+        self.assertEqual(os.listdir(self.path), [])
+        self._unchunk(loader, rows)
+
+    def test_spill(self):
+        # Every chunk exceeds the budget, so is spilled to disc
+        loader, rows = self._load(membudget=1)
+        self.assertEqual(len(loader.chunks), 3)
+        self.assertEqual(len(os.listdir(self.path)), 9)
+        self.assertEqual(loader.memrecords, {})
+        self._unchunk(loader, rows)
+
+    def test_spill_merge(self):
+        # Chunks held in memory are spilled as one chunk file
+        loader, rows = self._load()
+        loader.spill()
+        self.assertEqual(loader.chunks, [('0', 25)])
+        self.assertEqual(len(os.listdir(self.path)), 3)
+        self._unchunk(loader, rows)
+
+class parallel_test(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.saved_nproc, soom.nproc = soom.nproc, 3
+
+    def tearDown(self):
+        soom.nproc = self.saved_nproc
+        shutil.rmtree(self.path)
+
+    def _load_parallel(self, rowlimit=0, fail_row=None, membudget=None):
+        columns = [DummyCol('a', 'int'), DummyCol('b', 'str'),
+                   DummyCol('c', 'tuple')]
+        loader = ChunkingLoader.ChunkingLoader(columns, self.path, 
+                                               membudget=membudget)
+        # Rows loaded before the parallel load precede its rows
+        rows = [{'a': -1, 'b': '-1', 'c': (-1,)}]
+        loader.loadrows(DummySource(rows))
+        source = DummyRangeSource([{'a': i, 'b': str(i), 'c': (i,)} 
+                                   for i in range(25)])
+        source[3] = {}
+        source.fail_row = fail_row
+        loader.loadrows(source, chunkrows=4, rowlimit=rowlimit)
+        return loader, rows + source[:]
+
+    def _chunk_rows(self, loader):
+        return [chunk_rows for chunkid, chunk_rows in loader.chunks]
+
+    def _unchunk(self, loader, rows):
+        for col, data in loader.unchunk_columns():
+            self.assertEqual(list(data),
+                             [row.get(col.name) for row in rows])
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_parallel(self):
+        # Each part is spilled as one chunk at the end of its load
+        loader, rows = self._load_parallel()
+        self.assertEqual(loader.rownum, 26)
+        self.assertEqual(self._chunk_rows(loader), [1, 9, 9, 7])
+        self._unchunk(loader, rows)
+        # Or as it goes, if over budget
+        loader, rows = self._load_parallel(membudget=1)
+        self.assertEqual(loader.rownum, 26)
+        self.assertEqual(self._chunk_rows(loader), 
+                         [1, 4, 4, 1, 4, 4, 1, 4, 3])
+        self._unchunk(loader, rows)
+
+    def test_rowlimit(self):
+        # All of the first part, three rows of the second (truncating
+        # its first chunk), and none of the third
+        loader, rows = self._load_parallel(rowlimit=12, membudget=1)
+        self.assertEqual(loader.rownum, 13)
+        self.assertEqual(self._chunk_rows(loader), [1, 4, 4, 1, 3])
+        self._unchunk(loader, rows[:13])
+
+    def test_failed(self):
+        # The second part fails after spilling its first chunk - only
+        # the chunks loaded before the parallel load remain
+        self.assertRaises(Error, self._load_parallel, fail_row=14, 
+                          membudget=1)
+        names = os.listdir(self.path)
+        names.sort()
+        self.assertEqual(names, ['a_chunk_0.SOOMchunk', 
+                                 'b_chunk_0.SOOMchunk',
+                                 'c_chunk_0.SOOMchunk'])
+
+if __name__ == '__main__':
+    unittest.main()
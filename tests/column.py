@@ -21,6 +21,7 @@ import errno
 import unittest
 import SOOMv0
 import soomfunc
+import Numeric
 import array
 
 class column_basic_test(unittest.TestCase):
@@ -123,7 +124,22 @@ class datatypes_test_mixin:
     def test_str(self):
         data = ['pickle', 'cheese', 'salami', 'pickle', 
                 'cheese', 'cheese', 'salami', 'salami']
-        self._test(data, datatype=str)
+        col = self._test(data, datatype=str)
+        # Few distinct values, so dictionary encoded
+        codes, obj_to_code = col.take_codes(Numeric.arrayrange(len(data)))
+        self.assertEqual(list(codes), [obj_to_code[v] for v in data])
+        self.assertEqual(list(col.inverted['cheese']), [1,4,5])
+
+    def test_str_heap(self):
+        data = ['pickle', 'cheese', 'salami', 'pickle']
+        saved_threshold, SOOMv0.soom.recode_threshold = \
+            SOOMv0.soom.recode_threshold, 2
+        try:
+            col = self._test(data, datatype=str)
+        finally:
+            SOOMv0.soom.recode_threshold = saved_threshold
+        self.assertEqual(col.take_codes(Numeric.arrayrange(len(data))), None)
+        self.assertEqual(list(col.inverted['pickle']), [0,3])
 
     def test_tuple(self):
         data = [
@@ -162,6 +178,82 @@ class column_datatypes_non_persistent_test(datatypes_test_mixin,
                                            unittest.TestCase):
     pass
 
+class RowSource(list):
+    name = 'rows'
+
+    def register_dataset_types(self, cols):
+        pass
+
+    def get_ranges(self, nparts):
+        return None
+
+class column_append_test(persistent_dataset_mixin, unittest.TestCase):
+    def _load(self, rows, append=False, **kwargs):
+        ds = SOOMv0.makedataset('testds', path=self.path, append=append)
+        ds.addcolumn('cat', datatype='int', coltype='categorical', **kwargs)
+        ds.addcolumn('tup', datatype='tuple', coltype='categorical')
+        ds.addcolumn('size', datatype='float', coltype='scalar')
+        ds.addcolumn('name', datatype='str', coltype='identity')
+        ds.loaddata(RowSource(rows), initialise=1, finalise=1)
+        ds.save()
+        return ds
+
+    def test_append(self):
+        rows = [
+            {'cat': 1, 'tup': ('a', 'b'), 'size': 1.5, 'name': 'one'},
+            {'cat': 2, 'tup': ('b',), 'size': 2.5, 'name': 'two'},
+            {'cat': 1, 'tup': (), 'name': 'three'},
+        ]
+        ds = self._load(rows, outtrans={1: 'One', 2: 'Two', 3: 'Three'})
+        ds.filter(name='ones', expr='cat = 1')
+        ds.save()
+        ds.unlock()
+        new_rows = [
+            {'cat': 3, 'tup': ('a',), 'size': 4.5, 'name': 'four'},
+            {'cat': 1, 'tup': ('b', 'c'), 'size': 5.5, 'name': 'five'},
+        ]
+        ds = self._load(new_rows, append=True)
+        self.assertEqual(ds.generation, 2)
+        self.assertEqual(len(ds), 5)
+        rows += new_rows
+        self.assertEqual(list(ds['cat']), [row['cat'] for row in rows])
+        self.assertEqual(list(ds['name']), [row['name'] for row in rows])
+        self.assertEqual(list(ds['size'].data.mask()), [0, 0, 1, 0, 0])
+        self.assertEqual(list(ds['cat'].inverted[1]), [0, 2, 4])
+        self.assertEqual(list(ds['cat'].inverted[3]), [3])
+        self.assertEqual(list(ds['tup'].inverted['b']), [0, 1, 4])
+        self.assertEqual(list(ds['tup'].inverted['c']), [4])
+        self.assertEqual(ds['cat'].do_outtrans(3), 'Three')
+        self.assertEqual(list(ds.filters['ones'].record_ids), [0, 2, 4])
+        ds.unlock()
+
+    def test_keep(self):
+        rows = [
+            {'cat': 1, 'tup': ('a', 'b'), 'size': 1.5, 'name': 'one'},
+            {'cat': 2, 'tup': ('b',), 'size': 2.5, 'name': 'two'},
+            {'cat': 1, 'tup': (), 'name': 'three'},
+        ]
+        self._load(rows).unlock()
+        ds = SOOMv0.makedataset('testds', path=self.path, keep=True)
+        self.assertEqual(ds.generation, 2)
+        ds.addcolumnfromseq('size', [10.0, 20.0, 30.0], 
+                            datatype='float', coltype='scalar')
+        ds.save()
+        def inode(gen, colname, filename):
+            return os.stat(os.path.join(self.path, 'testds', str(gen), 
+                                        colname, filename)).st_ino
+        # Unchanged columns are shared with the previous generation
+        self.assertEqual(inode(1, 'name', 'data.SOOMrecodearray'),
+                         inode(2, 'name', 'data.SOOMrecodearray'))
+        self.assertEqual(inode(1, 'cat', 'inverted.SOOMblobstore'),
+                         inode(2, 'cat', 'inverted.SOOMblobstore'))
+        self.assertNotEqual(inode(1, 'size', 'data.SOOMblobstore'),
+                            inode(2, 'size', 'data.SOOMblobstore'))
+        self.assertEqual(list(ds['size']), [10.0, 20.0, 30.0])
+        self.assertEqual(list(ds['name']), ['one', 'two', 'three'])
+        self.assertEqual(list(ds['cat'].inverted[1]), [0, 2])
+        ds.unlock()
+
 class column_calculatedby(unittest.TestCase):
     def test_calculatedby(self):
         realdata = [3,1,4,1,5,9,2,6,5,4]
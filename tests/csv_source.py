@@ -57,5 +57,39 @@ class csv_data_source_test(unittest.TestCase):
             self.assertEqual(db_row, row_expect)
         self.failIf(expect)
 
+    def test_ranges(self):
+        import tempfile, shutil
+        columns = [
+            DataSourceColumn('a_col', label='A Col', ordinalpos=1, posbase=1),
+            DataSourceColumn('b_col', label='B Col', ordinalpos=2, posbase=1),
+        ]
+        dummy_dataset = [
+            DummyCol('a_col', 'int'),
+            DummyCol('b_col', 'str'),
+        ]
+        path = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(path, 'csv_data'), 'w')
+            f.write('a,b\n')
+            for i in range(100):
+                f.write('%d,"x%d"\n' % (i, i))
+            f.close()
+            source = CSVDataSource('test', columns, path=path, 
+                                   filename='csv_data', header_rows=1)
+            self.assertEqual(source.get_ranges(3), None)
+            source = CSVDataSource('test', columns, path=path, 
+                                   filename='csv_data', header_rows=1,
+                                   parallel=True)
+            source.register_dataset_types(dummy_dataset)
+            ranges = source.get_ranges(3)
+            self.assertEqual(len(ranges), 3)
+            rows = []
+            for byte_range in ranges:
+                source.open_range(byte_range)
+                rows.extend([row['a_col'] for row in source])
+            self.assertEqual(rows, range(100))
+        finally:
+            shutil.rmtree(path)
+
 if __name__ == '__main__':
     unittest.main()
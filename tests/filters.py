@@ -15,8 +15,13 @@
 # $Id: filters.py 2626 2007-03-09 04:35:54Z andrewm $
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/tests/filters.py,v $
 
+import os
+import shutil
 import unittest
-from SOOMv0 import Filter, DatasetColumn, Soom, Dataset
+import Numeric
+import SOOMv0
+from SOOMv0 import Filter, DatasetColumn, Soom, Dataset, soomparse, FilterPlan
+from soomarray import Bitmap
 from mx import DateTime
 
 class DummyDataset:
@@ -25,13 +30,14 @@ class DummyDataset:
     length = 0
     generation = 0
 
-    def __init__(self, cols):
+    def __init__(self, cols, **kwargs):
         for i, (name, (datatype, items)) in enumerate(cols.iteritems()):
             if self.length:
                 assert self.length == len(items)
             else:
                 self.length = len(items)
-            col = DatasetColumn.get_dataset_col(self, name, i, datatype=datatype)
+            col = DatasetColumn.get_dataset_col(self, name, i, 
+                                                datatype=datatype, **kwargs)
             col.store_column(items)
             setattr(self, name, col)
 
@@ -344,6 +350,317 @@ class filter_paren_test(filter_test):
                    'i notin (0,6,7) and j notin (0,1,4,5,6,7,8)',
                    [3,9])
 
+class filter_index_encoding_test(filter_test):
+    a = [i % 3 for i in range(200)]
+    b = [i % 2 for i in range(200)]
+    c = [int(i == 7) for i in range(200)]
+
+    def _test_ds(self, encoding):
+        return DummyDataset({'a': (int, self.a), 'b': (int, self.b),
+                             'c': (int, self.c)}, index_encoding=encoding)
+
+    def _expect(self, pred):
+        return [i for i in range(200) if pred(self.a[i], self.b[i], self.c[i])]
+
+    def test_encodings(self):
+        # Bitmap and vector encoded indexes, alone or mixed, filter alike
+        for encoding in ('vector', 'bitmap', 'auto'):
+            ds = self._test_ds(encoding)
+            self._test(ds, 'a=1 and b=0', 
+                       self._expect(lambda a, b, c: a == 1 and b == 0))
+            self._test(ds, 'a=1 or b=0', 
+                       self._expect(lambda a, b, c: a == 1 or b == 0))
+            self._test(ds, 'not a=1', 
+                       self._expect(lambda a, b, c: a != 1))
+            self._test(ds, 'a>0 and not b=1', 
+                       self._expect(lambda a, b, c: a > 0 and b != 1))
+            self._test(ds, 'c=1 or (b=1 and a in (0, 2))', 
+                       self._expect(lambda a, b, c: c or (b and a != 1)))
+
+    def test_auto(self):
+        ds = self._test_ds('auto')
+        self.failUnless(isinstance(ds.c.inverted[0], Bitmap))
+        self.failIf(isinstance(ds.c.inverted[1], Bitmap))
+
+class filtered_ds_test(unittest.TestCase):
+    a = [i % 7 for i in range(300)]
+    b = [i % 11 for i in range(300)]
+
+    def _test_ds(self):
+        ds = Dataset('filtered')
+        ds.addcolumnfromseq('a', data=self.a, datatype='int', 
+                            coltype='categorical')
+        ds.addcolumnfromseq('b', data=self.b, datatype='int', 
+                            coltype='categorical')
+        return ds
+
+    def test_columns(self):
+        ds = self._test_ds()
+        fds = Filter.filtered_ds(ds, Numeric.arrayrange(10, 200))
+        # Proxies are only created for the columns used
+        self.failIf('b' in fds._column_dict)
+        self.assertEqual(fds.get_column_names(), ['row_ordinal', 'a', 'b'])
+        self.failUnless(fds.has_column('b'))
+        self.assertEqual(list(fds['b'].data), self.b[10:200])
+        self.failUnless('b' in fds._column_dict)
+        self.failIf('a' in fds._column_dict)
+        self.assertEqual([col.name for col in fds.get_columns()], 
+                         ['row_ordinal', 'a', 'b'])
+        self.assertRaises(KeyError, fds.__getitem__, 'c')
+        # Nested filters are composed against the original dataset
+        nested = Filter.filtered_ds(fds, Numeric.arrayrange(0, 20, 2))
+        self.failUnless(nested.parent_dataset is ds)
+        self.assertEqual(list(nested['a'].data), self.a[10:30:2])
+
+    def test_inverted(self):
+        ds = self._test_ds()
+        # Keeping few records (intersect), and most (difference)
+        for record_ids in (range(0, 300, 10), range(5, 290)):
+            fds = Filter.filtered_ds(ds, Numeric.array(record_ids))
+            inverted = fds['a'].inverted
+            self.assertEqual(len(inverted), 7)
+            self.assertEqual(inverted.keys(), ds['a'].inverted.keys())
+            for value in range(7):
+                self.assertEqual(list(inverted[value]), 
+                                 [i for i in record_ids if self.a[i] == value])
+            self.failUnless(inverted[3] is fds['a'].inverted[3])
+            self.assertEqual(inverted.get(99), None)
+
+class filter_sortedkeys_test(filter_test):
+    # Enough distinct values that a scan and bisection would differ
+    codes = ['%03d' % ((i * 37) % 600) for i in range(900)]
+
+    def _test_ds(self):
+        return DummyDataset({'diag': (str, self.codes)})
+
+    def _expect(self, pred):
+        return [i for i, code in enumerate(self.codes) if pred(code)]
+
+    def test_range(self):
+        ds = self._test_ds()
+        self._test(ds, 'diag >=: "41" and diag <: "415"', 
+                   self._expect(lambda c: '41' <= c[:2] and c[:3] < '415'))
+        self._test(ds, 'diag between ("200", "300")', 
+                   self._expect(lambda c: '200' <= c < '300'))
+        self._test(ds, 'diag < "050"', self._expect(lambda c: c < '050'))
+        self._test(ds, 'diag <= "050"', self._expect(lambda c: c <= '050'))
+        self._test(ds, 'diag > "550"', self._expect(lambda c: c > '550'))
+        self._test(ds, 'diag != "007"', self._expect(lambda c: c != '007'))
+        self._test(ds, 'diag >: "59"', self._expect(lambda c: c[:2] > '59'))
+
+    def test_prefix_set(self):
+        ds = self._test_ds()
+        self._test(ds, 'diag in: ("41*", "41", "5")', 
+                   self._expect(lambda c: c[:2] == '41' or c[0] == '5'))
+        self._test(ds, 'diag notin: ("1", "2", "3")', 
+                   self._expect(lambda c: c[0] not in '123'))
+        self._test(ds, 'diag in ("001", "002", "001", "999")', 
+                   self._expect(lambda c: c in ('001', '002')))
+        self._test(ds, 'diag notin ("001", "002")', 
+                   self._expect(lambda c: c not in ('001', '002')))
+
+class filter_plan_test(filter_test):
+    a = [i % 7 for i in range(300)]
+    b = [i % 11 for i in range(300)]
+    x = [i / 3.0 for i in range(300)]
+
+    def _test_ds(self):
+        ds = Dataset('plan')
+        ds.addcolumnfromseq('a', data=self.a, datatype='int', 
+                            coltype='categorical')
+        ds.addcolumnfromseq('b', data=self.b, datatype='int', 
+                            coltype='categorical')
+        ds.addcolumnfromseq('x', data=self.x, datatype='float', 
+                            coltype='scalar')
+        return ds
+
+    def _expect(self, pred):
+        return [i for i in range(300) if pred(self.a[i], self.b[i], self.x[i])]
+
+    def test_plan(self):
+        # Most selective first
+        ds = self._test_ds()
+        parser = soomparse.SoomFilterParse(ds, 'x >= 1 and b = 4 and a < 6')
+        self.assertEqual([node.col.name 
+                          for node, cached in parser.tree.plan(ds)],
+                         ['b', 'a', 'x'])
+
+    def test_conjunction(self):
+        ds = self._test_ds()
+        self._test(ds, 'x >= 10 and a != 3 and b in (1, 2, 3, 4) and '
+                       'not a = 5 and x < 90 and b != 2 and a between (1, 6)',
+                   self._expect(lambda a, b, x: x >= 10 and a != 3 and 
+                                b in (1, 3, 4) and a != 5 and x < 90 and
+                                1 <= a < 6))
+        self._test(ds, 'a = 1 and b = 1 and x between (30, 60)',
+                   self._expect(lambda a, b, x: a == 1 and b == 1 and 
+                                30 <= x < 60))
+        self._test(ds, 'a = 1 and b = 1 and x < 0', [])
+
+    def test_disjunction(self):
+        ds = self._test_ds()
+        self._test(ds, 'x < 5 or (a = 1 and x > 95) or b = 10 and '
+                       'not x between (20, 30)',
+                   self._expect(lambda a, b, x: x < 5 or (a == 1 and x > 95)
+                                or (b == 10 and not 20 <= x < 30)))
+
+    def test_negation(self):
+        ds = self._test_ds()
+        self._test(ds, 'not a = 1 and not b in (1, 2, 3)',
+                   self._expect(lambda a, b, x: a != 1 and b not in (1, 2, 3)))
+        self._test(ds, 'not (not a = 1)',
+                   self._expect(lambda a, b, x: a == 1))
+        self._test(ds, 'not (not a = 1 and not b = 2)',
+                   self._expect(lambda a, b, x: a == 1 or b == 2))
+        self._test(ds, 'x < 50 and not a = 1 and not (b = 2 or b = 3)',
+                   self._expect(lambda a, b, x: x < 50 and a != 1 and 
+                                b not in (2, 3)))
+        self._test(ds, 'a = 2 or not b = 3 or not x < 50',
+                   self._expect(lambda a, b, x: a == 2 or b != 3 or x >= 50))
+        parser = soomparse.SoomFilterParse(ds, 'not (not a = 1)')
+        self.failUnless(isinstance(parser.tree, FilterPlan.Compare))
+
+class filter_sortindex_test(filter_test):
+    x = [(i * 37) % 101 / 4.0 for i in range(300)]
+    x[5] = x[50] = None
+
+    def _test_ds(self, sort_index):
+        ds = Dataset('sortindex')
+        ds.addcolumnfromseq('x', data=self.x, datatype='float', 
+                            coltype='scalar', sort_index=sort_index)
+        return ds
+
+    def _expect(self, pred):
+        return [i for i, x in enumerate(self.x) if x is not None and pred(x)]
+
+    def test_ops(self):
+        for sort_index in (False, True):
+            ds = self._test_ds(sort_index)
+            self.assertEqual(ds.x.sortindex is not None, sort_index)
+            self._test(ds, 'x < 5', self._expect(lambda x: x < 5))
+            self._test(ds, 'x <= 5', self._expect(lambda x: x <= 5))
+            self._test(ds, 'x > 20.25', self._expect(lambda x: x > 20.25))
+            self._test(ds, 'x >= 20.25', self._expect(lambda x: x >= 20.25))
+            self._test(ds, 'x = 3.5', self._expect(lambda x: x == 3.5))
+            self._test(ds, 'x between (2, 3.5)', 
+                       self._expect(lambda x: 2 <= x < 3.5))
+            self._test(ds, 'x between (3.5, 2)', [])
+            self._test(ds, 'x > 100', [])
+
+    def test_not_equal(self):
+        ds = self._test_ds(True)
+        self._test(ds, 'x != 3.5', self._expect(lambda x: x != 3.5))
+
+    def test_estimate(self):
+        ds = self._test_ds(True)
+        self.assertEqual(ds.x.filter_estimate('op_less_than', 5),
+                         len(self._expect(lambda x: x < 5)))
+
+class filter_cache_test(filter_test):
+    a = [i % 7 for i in range(300)]
+    b = [i % 11 for i in range(300)]
+
+    def setUp(self):
+        self.ds = Dataset('cache')
+        self.ds.addcolumnfromseq('a', data=self.a, datatype='int', 
+                                 coltype='categorical')
+        self.ds.addcolumnfromseq('b', data=self.b, datatype='int', 
+                                 coltype='categorical')
+        self.cache = self.ds.filters.cache
+        self.saved_size = Soom.soom.filter_cache_size
+
+    def tearDown(self):
+        Soom.soom.filter_cache_size = self.saved_size
+
+    def _expect(self, pred):
+        return [i for i in range(300) if pred(self.a[i], self.b[i])]
+
+    def test_normalised(self):
+        expect = self._expect(lambda a, b: a == 1 and b in (2, 3))
+        self._test(self.ds, 'a = 1 and b in (2, 3)', expect)
+        hits = self.cache.stats()['hits']
+        self._test(self.ds, 'b in (3,2) and a eq 1', expect)
+        self.assertEqual(self.cache.stats()['hits'], hits + 1)
+
+    def test_date_key(self):
+        # Equal dates have equal keys (their repr includes an address)
+        keys = [FilterPlan.Compare(self.ds['a'], 'op_in', 
+                                   [DateTime.Date(2004, 1, i), 
+                                    DateTime.Date(2004, 1, 1)]).key()
+                for i in (2, 2)]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_subexpression(self):
+        self._test(self.ds, 'a = 1 and b = 2', 
+                   self._expect(lambda a, b: a == 1 and b == 2))
+        stats = self.cache.stats()
+        # "b = 2" is evaluated first, then only the surviving rows of "a"
+        self.assertEqual(stats['entries'], 2)
+        self._test(self.ds, 'a < 5 and b = 2', 
+                   self._expect(lambda a, b: a < 5 and b == 2))
+        self.assertEqual(self.cache.stats()['hits'], stats['hits'] + 1)
+        self.failUnless(self.cache.stats()['memory_bytes'] > 0)
+
+    def test_invalidate(self):
+        self._test(self.ds, 'a = 1', self._expect(lambda a, b: a == 1))
+        self.ds.addcolumnfromseq('a', data=self.b, datatype='int', 
+                                 coltype='categorical')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self._test(self.ds, 'a = 1', self._expect(lambda a, b: b == 1))
+
+    def test_evict(self):
+        Soom.soom.filter_cache_size = 1
+        self._test(self.ds, 'a = 1 or b = 1', 
+                   self._expect(lambda a, b: a == 1 or b == 1))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+class filter_contains_cache_test(filter_test):
+    txt = [
+        'heart attack',
+        'attack of the heart',
+        'heart failure',
+        'panic attack',
+        'heart attack and heart failure',
+    ]
+
+    def setUp(self):
+        self.path = os.path.join(os.path.dirname(__file__), 'test_objects')
+        self.saved_writepath, Soom.soom.writepath = \
+            Soom.soom.writepath, self.path
+        SOOMv0.dsunload('contains')
+        self.ds = SOOMv0.makedataset('contains', path=self.path)
+        self.ds.addcolumnfromseq('txt', data=self.txt, datatype='str',
+                                 coltype='searchabletext')
+        self.ds.addcolumnfromseq('n', data=range(len(self.txt)),
+                                 datatype='int', coltype='categorical')
+        self.cache = self.ds.filters.cache
+
+    def tearDown(self):
+        SOOMv0.dsunload('contains')
+        Soom.soom.writepath = self.saved_writepath
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_conjunction(self):
+        expr = 'txt contains [[heart & attack]]'
+        self._test(self.ds, expr, [0, 1, 4])
+        hits = self.cache.stats()['hits']
+        self._test(self.ds, expr, [0, 1, 4])
+        self.assertEqual(self.cache.stats()['hits'], hits + 1)
+        self._test(self.ds, 'n != 0 and ' + expr, [1, 4])
+        self._test(self.ds, 'txt contains [[heart &- attack]]', [2])
+        self._test(self.ds, 'txt contains [[heart < attack]]', [0, 4])
+        self._test(self.ds, 'txt contains [[heart ~[0] attack]]', [])
+
+    def test_key(self):
+        def key(query):
+            sexpr = soomparse.parse('sgoal', query)
+            return FilterPlan.Compare(self.ds['txt'], 'op_contains',
+                                      sexpr).key()
+        self.assertEqual(key('heart & attack'), key('heart & attack'))
+        self.assertNotEqual(key('heart ~ attack'), key('heart ~[2] attack'))
+        self.assertNotEqual(key('heart & attack'), key('heart &- attack'))
+        self.assertNotEqual(key('"heart attack"'), key('heart attack'))
+
 class datetime_test(filter_test):
     def _get_dates_ds(self):
         ds = Dataset('dates_and_times')
@@ -463,7 +780,17 @@ class datetime_test(filter_test):
         else:
             self._test(ds, 'a between(reldate(days=-7), reldate(days=-2))', [3]) 
 
-    # Note: currently no support for times or datetime in filters
+    def test_datetimes(self):
+        # Scalar datetime columns are compared as ordinals
+        ds = self._get_dates_ds()
+        self._test(ds, 'c between (date(1900,1,1), date(2005,1,1))', 
+                   [0,1,2,3,6])
+        self._test(ds, 'c >= date 2003-9-30', [1,4,5])
+        self._test(ds, 'c < date(1803,9,10) and c > date(1000,1,1)', [7,8])
+        self.assertEqual(ds['c'][4], DateTime.DateTime(2009,5,27,12,9,11.5))
+        self.assertEqual(ds['a'][-1], DateTime.Date(103,9,29))
+
+    # Note: currently no support for time or datetime literals in filters
 
 if __name__ == '__main__':
     unittest.main()
@@ -2890,5 +2890,135 @@ class StatsTests(unittest.TestCase):
             #self._stricttest(Stats.wncl, (w1001_missing,), 154046.66666667, exclude_nonpositive_weights=True)
             pass
 
+def _partials(partial_fn, finish_fn):
+    def cell_fn(groups, *args, **kwargs):
+        return finish_fn(partial_fn(groups, *args, **kwargs))
+    cell_fn.__name__ = finish_fn.__name__
+    return cell_fn
+
+class CellStatsTests(unittest.TestCase):
+    """
+    Check the per-cell stat functions against their per-vector
+    equivalents
+    """
+    cells = Numeric.arrayrange(1001) % 7
+    ncells = 8                          # last cell is empty
+
+    def _test(self, cell_fn, fn, vectors, empty=None, **kwargs):
+        groups = Stats.CellGroups(self.cells, self.ncells)
+        ordered = [MA.take(v, groups.order) for v in vectors]
+        result = cell_fn(groups, *ordered, **kwargs)
+        expect = []
+        for cell in range(self.ncells):
+            rows = Numeric.nonzero(Numeric.equal(self.cells, cell))
+            if len(rows):
+                expect.append(fn(*[MA.take(v, rows) for v in vectors], 
+                                 **kwargs))
+            else:
+                expect.append(empty)
+        self.assertEqual(len(result), len(expect))
+        for r_val, e_val in zip(result, expect):
+            if r_val is None or e_val is None:
+                ok = r_val == e_val
+            else:
+                ok = round(r_val, 7) == round(e_val, 7)
+            self.failUnless(ok, '%s - expected %s, got %s' % 
+                                    (cell_fn.__name__, expect, result))
+
+    def test_cellgroups(self):
+        groups = Stats.CellGroups(Numeric.array([2, 0, 2, 1, 0]), 4)
+        self.assertEqual(list(groups.order), [1, 4, 3, 0, 2])
+        self.assertEqual(list(groups.counts), [2, 1, 2, 0])
+        data = Numeric.take(Numeric.array([5, 1, 3, 2, 4]), groups.order)
+        self.assertEqual(list(groups.reduce(Numeric.add, data)), [5, 2, 8, 0])
+
+    def test_unweighted(self):
+        for data in (n1001_nomissing_numpy, n1001_nomissing_MA, 
+                     n1001_missing):
+            vectors = (data,)
+            self._test(_partials(Stats.cell_nonmissing_partials,
+                                 Stats.nonmissing_from_partials),
+                       Stats.nonmissing, vectors)
+            self._test(_partials(Stats.cell_nonmissing_partials,
+                                 Stats.missing_from_partials),
+                       Stats.missing, vectors)
+            self._test(_partials(Stats.cell_sum_partials, 
+                                 Stats.sum_from_partials),
+                       Stats.asum, vectors)
+            self._test(_partials(Stats.cell_sum_partials, 
+                                 Stats.mean_from_partials),
+                       Stats.amean, vectors)
+            self._test(_partials(Stats.cell_minmax_partials, 
+                                 Stats.minimum_from_partials),
+                       Stats.aminimum, vectors)
+            self._test(_partials(Stats.cell_minmax_partials, 
+                                 Stats.maximum_from_partials),
+                       Stats.amaximum, vectors)
+            self._test(_partials(Stats.cell_minmax_partials, 
+                                 Stats.range_from_partials),
+                       Stats.arange, vectors)
+            self._test(Stats.cell_samplevar, Stats.samplevar, vectors)
+            self._test(Stats.cell_populationvar, Stats.populationvar, vectors)
+            self._test(Stats.cell_sample_stddev, Stats.sample_stddev, vectors)
+            self._test(Stats.cell_sample_cv, Stats.sample_cv, vectors)
+            self._test(Stats.cell_population_cv, Stats.population_cv, vectors)
+            self._test(Stats.cell_stderr, Stats.stderr, vectors)
+
+    def test_weighted(self):
+        for vectors in ((n1001_nomissing_numpy, w1001_nomissing_numpy),
+                        (n1001_missing, w1001_missing)):
+            for exclude in (False, True):
+                kw = {'exclude_nonpositive_weights': exclude}
+                self._test(Stats.cell_wn, Stats.wn, vectors[1:], empty=0, **kw)
+                self._test(_partials(Stats.cell_wnonmissing_partials,
+                                     Stats.nonmissing_from_partials),
+                           Stats.wnonmissing, vectors, **kw)
+                self._test(_partials(Stats.cell_wsum_partials, 
+                                     Stats.wsum_from_partials),
+                           Stats.wsum, vectors, **kw)
+                self._test(_partials(Stats.cell_wsum_partials, 
+                                     Stats.wamean_from_partials),
+                           Stats.wamean, vectors, **kw)
+                self._test(_partials(Stats.cell_wminmax_partials, 
+                                     Stats.minimum_from_partials),
+                           Stats.wminimum, vectors, **kw)
+                self._test(_partials(Stats.cell_wminmax_partials, 
+                                     Stats.maximum_from_partials),
+                           Stats.wmaximum, vectors, **kw)
+                self._test(Stats.cell_wsamplevar, Stats.wsamplevar, 
+                           vectors, **kw)
+                self._test(Stats.cell_wpopulation_stddev, 
+                           Stats.wpopulation_stddev, vectors, **kw)
+                self._test(Stats.cell_wsample_cv, Stats.wsample_cv, 
+                           vectors, **kw)
+                self._test(Stats.cell_wstderr, Stats.wstderr, vectors, **kw)
+
+    def test_quantiles(self):
+        for data in (n1001_nomissing_numpy, n1001_nomissing_MA, 
+                     n1001_missing):
+            for defn in range(1, 6):
+                self._test(Stats.cell_median, Stats.median, (data,), 
+                           defn=defn)
+                for p in (0.0, 0.1, 0.25, 0.75, 0.9, 1.0):
+                    self._test(Stats.cell_quantile, Stats.quantile, (data,), 
+                               p=p, defn=defn)
+
+    def test_wquantiles(self):
+        for vectors in ((n1001_nomissing_numpy, w1001_nomissing_numpy),
+                        (n1001_missing, w1001_missing)):
+            for exclude in (False, True):
+                kw = {'exclude_nonpositive_weights': exclude}
+                self._test(Stats.cell_wmedian, Stats.wmedian, vectors, **kw)
+                for p in (0.0, 0.1, 0.25, 0.75, 0.9, 1.0):
+                    self._test(Stats.cell_wquantile, Stats.wquantile, vectors,
+                               p=p, **kw)
+
+    def test_sort_cache(self):
+        groups = Stats.CellGroups(self.cells, self.ncells)
+        data = MA.take(n1001_missing, groups.order)
+        self.assertEqual(Stats.cell_quantile(groups, data, 0.25),
+                         Stats.cell_quantile(groups, data, 0.25))
+        self.assertEqual(len(groups.sort_cache), 1)
+
 if __name__ == '__main__':
     unittest.main()
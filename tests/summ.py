@@ -16,11 +16,14 @@
 # $Source: /usr/local/cvsroot/NSWDoH/SOOMv0/tests/summ.py,v $
 
 from SOOMv0 import *
+from SOOMv0.SummaryCache import SummaryCache
 import MA
 import unittest
+import os, shutil
 
-def _get_ds():
-    ds = Dataset('apples')
+def _get_ds(ds=None):
+    if ds is None:
+        ds = Dataset('apples')
     ds.addcolumnfromseq('variety', label='Variety',
                         coltype='categorical', datatype='int',
                         all_value=-1,
@@ -154,6 +157,22 @@ class summ_test(unittest.TestCase):
         summ = ds.summ('variety', freq())
         check()
 
+    def test_stats_freq_norows(self):
+        from SOOMv0.SummaryStats import StatMethods
+        def needs_rows(weightcol, *methods):
+            stat_methods = StatMethods(weightcol)
+            for method in methods:
+                stat_methods.append(method)
+            return stat_methods.needs_rows()
+        self.failIf(needs_rows(None, freq()))
+        self.failUnless(needs_rows('weighting', freq()))
+        self.failUnless(needs_rows(None, freq(weightcol='weighting')))
+        self.failUnless(needs_rows(None, freqcl()))
+        self.failUnless(needs_rows(None, freq(), mean('size')))
+        ds = _get_ds()
+        summ = ds.summ('variety', freq())
+        self.assertEqual(list(summ['_freq_']), [3, 2, 1, 1, 1])
+
     def test_stats_wgtmean(self):
         def check():
             self.assertEqual(list(summ['row_ordinal']), range(5))
@@ -370,6 +389,157 @@ class summ_test(unittest.TestCase):
         self.assertListNear(summ['mean_of_size'], 
                             [6.55, 6.0, 8.0, 6.5, 8.8, None])
 
+    def test_cube(self):
+        from SOOMv0.DatasetSummary import Summarise
+        class IntersectSummarise(Summarise):
+            def use_cube(self):
+                return False
+        def check(*args, **kwargs):
+            cube = Summarise(ds, *args, **kwargs)
+            self.failUnless(cube.use_cube())
+            intersect = IntersectSummarise(ds, *args, **kwargs)
+            cube_set = cube.as_dict()
+            intersect_set = intersect.as_dict()
+            self.assertEqual(cube_set.colorder, intersect_set.colorder)
+            for colname in cube_set.colorder:
+                if cube_set[colname].datatype == 'float':
+                    self.assertListNear(cube_set[colname].data,
+                                        intersect_set[colname].data, prec=6)
+                else:
+                    self.assertEqual(cube_set[colname].data,
+                                     intersect_set[colname].data)
+            self.assertEqual(cube_set.suppressed_rows, 
+                             intersect_set.suppressed_rows)
+        ds = _get_ds()
+        check('variety', 'grade', freq(weightcol='weighting'), allcalc=True)
+        check('grade', 'supplier', proportions=True, weightcol='weighting',
+              filterexpr='size > 6.5')
+        check(condcol('grade', coalesce(2,3)), 'supplier', levels=[0, 2],
+              zeros=True)
+        # Single level (no roll-up)
+        check('variety', 'supplier', freq(weightcol='weighting'), levels=[1])
+        check('variety', 'grade', 
+              applyto('size', nonmissing, missing, asum, mean, minimum, 
+                      maximum, arange, samplevar, popvar, stddev, popstddev,
+                      samplecv, popcv, stderr),
+              allcalc=True)
+        check('grade', 'supplier', 
+              applyto('size', nonmissing, asum, mean, minimum, maximum, 
+                      samplevar, stddev, samplecv, stderr),
+              weightcol='weighting', allcalc=True)
+        check('variety', 'grade', 
+              applyto('size', median, p25, p75), quantile('size', 0.6),
+              allcalc=True)
+        check('grade', 'supplier', 
+              applyto('size', median, p10, p90),
+              weightcol='weighting', allcalc=True)
+
+    def test_intersect_cells(self):
+        # The intersect path gives the same cells as intersecting
+        # each cell's condcol vectors directly
+        import soomarray
+        from SOOMv0 import Utils
+        from SOOMv0.DatasetSummary import Summarise
+        class IntersectSummarise(Summarise):
+            def use_cube(self):
+                return False
+        def check(*args, **kwargs):
+            summarise = IntersectSummarise(ds, *args, **kwargs)
+            pairs = summarise.condcols.veckey_pairs(kwargs.get('zeros'))
+            expect = {}
+            for level in range(len(pairs) + 1):
+                for subset in Utils.xcombinations(range(len(pairs)), level):
+                    for item in Utils.cross(*[pairs[i] for i in subset]):
+                        rows = range(len(ds))
+                        key = []
+                        for value, vector, suppress, condcol in item:
+                            if key:
+                                rows = soomarray.intersect(rows, vector)
+                            else:
+                                rows = vector
+                            key.append((condcol.name, value))
+                        expect[tuple(key)] = list(rows)
+            # "variety" 3 has no "grade" 3 rows, so the prefix is empty
+            # before "supplier" is reached
+            self.assertEqual(expect[(('variety', 3), ('grade', 3))], [])
+            summ = summarise.as_dict()
+            self.assertEqual(len(summ['_freq_'].data), len(expect))
+            for i, condcols in enumerate(summ['_condcols_'].data):
+                key = tuple([(colname, summ[colname].data[i])
+                             for colname in condcols])
+                rows = expect[key]
+                self.assertEqual(summ['_freq_'].data[i], len(rows))
+                if 'mean_of_size' in summ and rows:
+                    sizes = [ds['size'].data[r] for r in rows]
+                    self.assertAlmostEqual(summ['mean_of_size'].data[i],
+                                           sum(sizes) / len(sizes))
+        ds = _get_ds()
+        # Counts only (nested most selective first), then cell rows
+        check('variety', 'grade', 'supplier', allcalc=True)
+        check('variety', 'grade', 'supplier', mean('size'), allcalc=True)
+        check('variety', 'grade', 'supplier', allcalc=True, zeros=True)
+
+class summ_cache_test(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(os.path.dirname(__file__), 'test_objects')
+        self.saved_writepath, soom.writepath = soom.writepath, self.path
+        dsunload('apples')
+        self.ds = _get_ds(makedataset('apples', path=self.path))
+        self.ds.save()
+        self.ds.unlock()
+
+    def tearDown(self):
+        dsunload('apples')
+        soom.writepath = self.saved_writepath
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _summ(self, *args, **kwargs):
+        return self.ds.summ('variety', mean('size'), *args, **kwargs)
+
+    def test_cache(self):
+        cache = SummaryCache.get(self.ds)
+        self.failIf(cache is None)
+        a = self._summ(filterexpr='variety != 2')
+        self.assertEqual(len(cache.entries()), 1)
+        b = self._summ(filterexpr='variety != 2')
+        self.assertEqual(len(cache.entries()), 1)
+        self.failIf(a is b)
+        self.assertEqual(list(a['variety']), list(b['variety']))
+        self.assertEqual(list(a['_freq_']), list(b['_freq_']))
+        self.assertEqual(list(a['mean_of_size']), list(b['mean_of_size']))
+        self.assertEqual(b.filter_label, 'variety != 2')
+        # Anything that changes the result changes the key
+        self._summ(filterexpr='variety != 3')
+        self._summ(filterexpr='variety != 2', weightcol='weighting')
+        self._summ(condcol('grade', order(3, 2, 1, 0)))
+        self._summ(condcol('grade', suppress(0)))
+        self.ds.filter(expr='variety != 2').summ('variety', mean('size'))
+        self.assertEqual(len(cache.entries()), 6)
+        self._summ(filterexpr='variety != 4', nocache=True)
+        self._summ(condcol('grade', suppress(lambda v: v == 0)))
+        self.assertEqual(len(cache.entries()), 6)
+        # Least recently used are evicted first
+        entries = cache.entries()
+        total = sum([size for mtime, size, filename in entries])
+        cache.evict(total - 1)
+        self.assertEqual(cache.entries(), entries[1:])
+        # And a new generation starts afresh
+        self.ds.lock()
+        self.ds.new_generation()
+        self.failIf(os.path.exists(cache.path))
+
+    def test_disabled(self):
+        saved_size, soom.summary_cache_size = soom.summary_cache_size, 0
+        try:
+            self.assertEqual(SummaryCache.get(self.ds), None)
+        finally:
+            soom.summary_cache_size = saved_size
+        self.ds.lock()
+        try:
+            self.assertEqual(SummaryCache.get(self.ds), None)
+        finally:
+            self.ds.unlock()
+
 
 if __name__ == '__main__':
     unittest.main()